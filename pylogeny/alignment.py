@@ -11,6 +11,7 @@ P4 python phylogenetic library. '''
 
 import os
 import p4
+import numpy
 import model
 import tree
 import base
@@ -18,6 +19,7 @@ from newick import newickParser
 from executable import fasttree
 from tempfile import NamedTemporaryFile as NTempFile
 from shutil import copyfile
+from hashlib import sha1
 
 # Set up.
 
@@ -54,6 +56,11 @@ class alignment(object):
 
         # Keep track of temporary files.
         self.paths = {} 
+        self.fingerprint = None
+
+        # Partitions (e.g., genes of a concatenation); none by default.
+        self.partitions = []
+        self.partitionViews = []
 
     # Internals
 
@@ -88,6 +95,13 @@ class alignment(object):
         
         ''' Forcefully delete all temporary files and clear data. '''
         
+        if hasattr(self,'_pllpool'):
+            self._pllpool.close()
+            del self._pllpool
+        if hasattr(self,'_likelihoodEngine'): del self._likelihoodEngine
+        if hasattr(self,'_beagleScorer'): del self._beagleScorer
+        for view in self.partitionViews: view.close()
+        self.partitionViews = []
         self.data  = None
         self.model = None
         if len(self.paths) > 0:
@@ -106,6 +120,19 @@ class alignment(object):
 
         return [self.getSequenceString(i) for i in xrange(self.getNumSeqs())]
 
+    def toArray(self):
+
+        ''' Get all sequences as a two-dimensional array of character codes,
+        with a row for every sequence and a column for every site.
+
+        :return: a numpy array of unsigned 8-bit integers
+
+        '''
+
+        seqs = self.toStrList()
+        return numpy.frombuffer(''.join(seqs),dtype=numpy.uint8).reshape(
+            len(seqs),self.getSize())
+
     def getDataType(self):
         
         ''' Get the data type associated with this alignment (e.g., protein). 
@@ -219,6 +246,96 @@ class alignment(object):
 
         return self.data.taxNames
 
+    def getFingerprint(self):
+
+        ''' Get a digest of the data type, names and sequences of this
+        alignment; alignments read from identical files share it.
+
+        :return: a string (hexadecimal digest)
+
+        '''
+
+        if self.fingerprint == None:
+            h = sha1(self.getDataType())
+            for seq in self: h.update('%s\0%s\0' % (seq.name,seq.sequence))
+            self.fingerprint = h.hexdigest()
+        return self.fingerprint
+
+    # Partitions
+
+    def setPartitions(self,names,ranges,models=None):
+
+        ''' Partition the alignment into contiguous ranges of sites (e.g., the
+        genes of a concatenation), each with its own model. Anything built for
+        the alignment beforehand for scoring (e.g., libpll instances and the
+        partition model they use) is discarded.
+
+        :param names: a list of partition names (e.g., 'p1', 'p2')
+        :type names: a list of strings
+        :param ranges: a list of range tuples, from first to last site of
+        each partition (counting from 1, as in libpll partition files)
+        :type ranges: a list of integer tuples
+        :param models: an optional list of model names as libpll describes
+        them (e.g., 'WAG', 'DNA'); by default, 'DNA' or 'WAG' for all
+        :type models: a list of strings
+
+        '''
+
+        if models == None:
+            if self.getDataType() == 'protein': models = ['WAG']*len(names)
+            else: models = ['DNA']*len(names)
+        if not (len(names) == len(ranges) == len(models)):
+            raise ValueError('Need a name, range, and model for every partition.')
+        for lower,upper in ranges:
+            if lower < 1 or upper > self.getSize() or lower > upper:
+                raise ValueError('Partition range %d-%d is not in alignment.' % (
+                    lower,upper))
+        if hasattr(self,'_pllpool'):
+            self._pllpool.close()
+            del self._pllpool
+        if hasattr(self,'_pllmodel'):
+            self._pllmodel.close()
+            del self._pllmodel
+            del self.paths['pll']
+        for view in self.partitionViews: view.close()
+        self.partitions = [(n,m,tuple(r)) for n,r,m in zip(names,ranges,models)]
+        self.partitionViews = [alignmentPartition(self,i) for i in
+                               xrange(len(self.partitions))]
+
+    def getPartitions(self):
+
+        ''' Get all partitions of this alignment.
+
+        :return: a list of tuples of a name, model name, and range of sites
+
+        '''
+
+        return self.partitions
+
+    def getPartition(self,i):
+
+        ''' Get the ith partition of this alignment as an alignment of its own
+        sites; it is kept for as long as the partitions are, such that
+        anything built for scoring it is too.
+
+        :param i: an index amongst the partitions
+        :type i: an integer
+        :return: an :class:`.alignmentPartition` object
+
+        '''
+
+        return self.partitionViews[i]
+
+    def isPartitioned(self):
+
+        ''' Determine whether this alignment has been partitioned.
+
+        :return: a boolean
+
+        '''
+
+        return (len(self.partitions) > 0)
+
 
 class phylipFriendlyAlignment(alignment):
 
@@ -383,3 +500,99 @@ class phylipFriendlyAlignment(alignment):
         ''' Reintializes the object. '''
 
         return phylipFriendlyAlignment(self.getFASTA())
+
+
+class alignmentPartition(alignment):
+
+    ''' A view of a contiguous range of sites of an alignment, such as a gene
+    of a concatenation, that acts as an alignment of its own. Sequences are
+    not copied; the taxa and data type are those of the whole alignment. No
+    temporary files are made for a partition. '''
+
+    def __init__(self,parent,i):
+
+        ''' Instantiate a view of the ith partition of an alignment.
+
+        :param parent: a partitioned alignment
+        :type parent: an :class:`.alignment` object
+        :param i: an index amongst the partitions of the alignment
+        :type i: an integer
+
+        '''
+
+        self.parent = parent
+        self.index  = i
+        self.name, self.modelName, (lower,upper) = parent.getPartitions()[i]
+        self.lower  = lower-1
+        self.upper  = upper
+        self.data   = parent.data
+        self.model  = parent.model
+        self.paths  = {}
+        self.fingerprint = None
+        self.partitions = []
+        self.partitionViews = []
+
+    def __len__(self):
+
+        return self.upper-self.lower
+
+    def toArray(self):
+
+        ''' Get the sites of this partition in all sequences as a
+        two-dimensional array of character codes.
+
+        :return: a numpy array of unsigned 8-bit integers
+
+        '''
+
+        return self.parent.toArray()[:,self.lower:self.upper]
+
+    def getSequenceString(self,i):
+
+        ''' Acquire the sites of this partition in the ith sequence.
+
+        :param i: an index in the alignment (associated with a sequence)
+        :type i: an integer
+        :return: a string
+
+        '''
+
+        return self.parent.getSequenceString(i)[self.lower:self.upper]
+
+    def getTaxa(self):
+
+        ''' Get a list of taxa names associated with the alignment.
+
+        :return: a list of strings
+
+        '''
+
+        return self.parent.getTaxa()
+
+    def getFingerprint(self):
+
+        ''' Get a digest of the names and sites of this partition.
+
+        :return: a string (hexadecimal digest)
+
+        '''
+
+        if self.fingerprint == None:
+            h = sha1(self.getDataType())
+            for i,seq in enumerate(self):
+                h.update('%s\0%s\0' % (seq.name,self.getSequenceString(i)))
+            self.fingerprint = h.hexdigest()
+        return self.fingerprint
+
+    def setPartitions(self,names,ranges,models=None):
+
+        raise ValueError('A partition cannot be partitioned further.')
+
+    def close(self):
+
+        ''' Clear everything built for scoring this partition; sequences
+        belong to the whole alignment. '''
+
+        if hasattr(self,'_likelihoodEngine'): del self._likelihoodEngine
+        self.data  = None
+        self.model = None
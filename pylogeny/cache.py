@@ -0,0 +1,279 @@
+''' Cache scores of phylogenetic trees across landscapes. A score is keyed by a
+fingerprint of what a tree was scored against (e.g., the profiles of an
+alignment) alongside the structure of the tree (a Newick string without branch
+lengths) so that rebuilding a landscape, or running several heuristics over
+the same alignment, does not rescore any topology already seen.
+
+By default, parsimony scores are kept with the alignment object landscapes are
+built over (see getParsimonyCache); they are shared by every landscape over it
+and freed along with it. A cache shared by the whole process, such as one
+backed by an sqlite file, is opt-in (see setParsimonyCache) as it would
+otherwise hold scores of unrelated alignments for as long as the process runs.
+Log-likelihoods are only cached once a cache is set (see setLikelihoodCache).
+'''
+
+# Imports
+
+import os, sqlite3
+from collections import OrderedDict
+
+# Constants
+
+CACHE_DEFAULT_SIZE = 32768
+CACHE_TIMEOUT      = 60. # Seconds to wait on a file another process writes.
+
+# Cache Object
+
+class scoreCache(object):
+
+    ''' A bounded cache of tree scores; least recently used scores are evicted
+    first. Optionally backed by an sqlite file on disk that holds every score
+    ever stored, such that scores evicted from memory or computed in a
+    previous session are not lost. The file may be shared by several
+    processes reading and writing it at once (e.g., workers on one host);
+    every process connects to it on its own. '''
+
+    def __init__(self,size=CACHE_DEFAULT_SIZE,path=None):
+
+        ''' Initialize the cache.
+
+        :param size: the maximum number of scores held in memory
+        :type size: an integer
+        :param path: an optional path to an sqlite file to back the cache
+        :type path: a string
+
+        '''
+
+        self.size    = size
+        self.path    = path
+        self.scores  = OrderedDict()
+        self.hits    = 0
+        self.misses  = 0
+        self.connection = None
+        self.pid        = None
+        if path: self._openDatabase()
+
+    def _openDatabase(self):
+
+        ''' PRIVATE: Connect to the backing sqlite file. Write-ahead logging
+        lets readers proceed while another process writes. '''
+
+        self.connection = sqlite3.connect(self.path,timeout=CACHE_TIMEOUT)
+        self.pid        = os.getpid()
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS scores (
+            fingerprint TEXT, structure TEXT, score,
+            PRIMARY KEY (fingerprint,structure))""")
+        self.connection.commit()
+
+    def _getConnection(self):
+
+        ''' PRIVATE: Get the connection to the backing sqlite file, if there is
+        one; a process forked from the one that connected reconnects. '''
+
+        if self.connection and self.pid != os.getpid(): self._openDatabase()
+        return self.connection
+
+    def _fetch(self,item):
+
+        ''' PRIVATE: Read a score from the backing sqlite file. '''
+
+        row = self._getConnection().execute(
+            """SELECT score FROM scores WHERE fingerprint=? AND
+            structure=?""",item).fetchone()
+        if row: return row[0]
+
+    def _store(self,items):
+
+        ''' PRIVATE: Write scores to the backing sqlite file. '''
+
+        con = self._getConnection()
+        with con: con.executemany(
+            """INSERT OR REPLACE INTO scores VALUES (?,?,?)""",
+            [(k,s,scr) for (k,s),scr in items])
+
+    def _remember(self,item,score):
+
+        ''' PRIVATE: Hold a score in memory as the most recently used one. '''
+
+        if item in self.scores: del self.scores[item]
+        self.scores[item] = score
+        while len(self.scores) > self.size: self.scores.popitem(last=False)
+
+    def __len__(self):
+
+        return len(self.scores)
+
+    def __contains__(self,item):
+
+        return (self.get(*item) != None)
+
+    def get(self,key,struct):
+
+        ''' Get the score of a tree.
+
+        :param key: a fingerprint of what the tree was scored against
+        :type key: a string
+        :param struct: the structure of the tree
+        :type struct: a string
+        :return: a score or None if not found
+
+        '''
+
+        item  = (key,struct)
+        score = self.scores.get(item)
+        if score == None and self.connection: score = self._fetch(item)
+        if score == None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._remember(item,score)
+        return score
+
+    def getMany(self,key,structs):
+
+        ''' Get the scores of many trees scored against the same thing.
+
+        :param key: a fingerprint of what the trees were scored against
+        :type key: a string
+        :param structs: structures of the trees
+        :type structs: a list of strings
+        :return: a list of scores; None for those not found
+
+        '''
+
+        return [self.get(key,struct) for struct in structs]
+
+    def set(self,key,struct,score):
+
+        ''' Store the score of a tree.
+
+        :param key: a fingerprint of what the tree was scored against
+        :type key: a string
+        :param struct: the structure of the tree
+        :type struct: a string
+        :param score: the score of the tree
+
+        '''
+
+        self.setMany(key,[struct],[score])
+
+    def setMany(self,key,structs,scores):
+
+        ''' Store the scores of many trees scored against the same thing.
+
+        :param key: a fingerprint of what the trees were scored against
+        :type key: a string
+        :param structs: structures of the trees
+        :type structs: a list of strings
+        :param scores: the scores of the trees in the same order
+
+        '''
+
+        items = [((key,struct),score) for struct,score in zip(structs,scores)
+                 if score != None]
+        for item,score in items: self._remember(item,score)
+        if self.connection and items: self._store(items)
+
+    def clear(self):
+
+        ''' Remove all scores from memory; the backing file is untouched. '''
+
+        self.scores.clear()
+
+    def close(self):
+
+        ''' Close the backing sqlite file if there is one. '''
+
+        if self.connection:
+            if self.pid == os.getpid(): self.connection.close()
+            self.connection = None
+
+class likelihoodScoreCache(scoreCache):
+
+    ''' A bounded cache of log-likelihoods of trees alongside Newick strings
+    carrying the branch lengths they were optimized to; both are stored as a
+    tuple. Fingerprints should cover the alignment as well as the model the
+    trees were scored under. '''
+
+    def _openDatabase(self):
+
+        ''' PRIVATE: Connect to the backing sqlite file. '''
+
+        super(likelihoodScoreCache,self)._openDatabase()
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS likelihoods (
+            fingerprint TEXT, structure TEXT, score REAL, newick TEXT,
+            PRIMARY KEY (fingerprint,structure))""")
+        self.connection.commit()
+
+    def _fetch(self,item):
+
+        ''' PRIVATE: Read a score from the backing sqlite file. '''
+
+        row = self._getConnection().execute(
+            """SELECT score,newick FROM likelihoods WHERE fingerprint=? AND
+            structure=?""",item).fetchone()
+        if row: return (row[0],str(row[1]))
+
+    def _store(self,items):
+
+        ''' PRIVATE: Write scores to the backing sqlite file. '''
+
+        con = self._getConnection()
+        with con: con.executemany(
+            """INSERT OR REPLACE INTO likelihoods VALUES (?,?,?,?)""",
+            [(k,s,scr,newi) for (k,s),(scr,newi) in items])
+
+# Scores shared by all landscapes; none unless set.
+
+parsimonyCache = None
+
+# Log-likelihoods shared by all scoring; none unless set.
+
+likelihoodCache = None
+
+def getParsimonyCache(ali):
+
+    ''' Get the cache parsimony scores of trees over an alignment are kept in
+    by default: the one shared by all landscapes if set, otherwise one kept
+    with the alignment object.
+
+    :param ali: an alignment or None
+    :type ali: an :class:`.alignment.alignment` object
+    :return: a :class:`.scoreCache` object
+
+    '''
+
+    if parsimonyCache != None: return parsimonyCache
+    elif ali == None: return scoreCache()
+    if not hasattr(ali,'_parsimonycache'): ali._parsimonycache = scoreCache()
+    return ali._parsimonycache
+
+def setParsimonyCache(cache):
+
+    ''' Set the cache parsimony scores are shared in by all landscapes created
+    after (see setCache of a landscape to set that of one landscape). None,
+    the default, keeps scores with every alignment instead.
+
+    :param cache: a score cache or None
+    :type cache: a :class:`.scoreCache` object
+
+    '''
+
+    global parsimonyCache
+    parsimonyCache = cache
+
+def setLikelihoodCache(cache):
+
+    ''' Set the cache log-likelihoods are looked up in by the scoring module
+    before trees are scored and stored in after (e.g., one backed by an sqlite
+    file to keep them across sessions and share them between processes). None,
+    the default, disables caching.
+
+    :param cache: a likelihood score cache or None
+    :type cache: a :class:`.likelihoodScoreCache` object
+
+    '''
+
+    global likelihoodCache
+    likelihoodCache = cache
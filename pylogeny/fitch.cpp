@@ -9,6 +9,8 @@
 #include <string>
 #include <map>
 #include <locale>
+#include <thread>
+#include <cctype>
 
 using namespace std;
 
@@ -17,7 +19,6 @@ using namespace std;
 class Node {
   
   list<Node*> children;
-  string parsimony_profile_data;
   string label;
   int len;
   
@@ -25,7 +26,6 @@ class Node {
 
     // Constructors
     Node() {
-      parsimony_profile_data = "";
       label = "";
       len = 0;
     };
@@ -35,10 +35,8 @@ class Node {
     typedef list<Node*>::iterator ChildIterator;
   
     // Function Definitions
-    void setData(string str)          { parsimony_profile_data = str; };
     void setLabel(string str)         { label = str; };
     void addChild(Node *n)            { children.push_back(n); ++len; };
-    string getData()                  { return parsimony_profile_data; };
     string getLabel()                 { return label; };
     Children *getChildren()           { return &children; };
     ChildIterator iterChildrenBegin() { return children.begin(); };
@@ -192,144 +190,1160 @@ class PhylogenyParser {
 
 };
 
-/* Intersection/Union Functions for String-Composed Sets */
+/* Bit-Packed Profile Matrix */
 
-string strIntersection(string a, string b) {
+typedef unsigned long long Word;
+const int WORDBITS = 64;
 
-  string it;
-  set_intersection(a.begin(),a.end(),b.begin(),b.end(),
-                        back_inserter(it));
-  return it;
+class TaxonSet {
 
-}
+  // Taxa names mapped to their positions along profiles.
+
+  public:
+
+    int numTaxa;
+    map<string,int> taxa;
+
+    // Function Definitions
+    int indexOf(const string &name) {
+      map<string,int>::iterator it = taxa.find(name);
+      if (it == taxa.end() || it->second >= numTaxa) return -1;
+      return it->second;
+    };
+
+};
+
+class ProfileMatrix : public TaxonSet {
+
+  // Site profiles are packed along machine words such that bit j of block b
+  // refers to profile (b*WORDBITS)+j. A set of states for a node is stored
+  // as numStates words per block (block-major) so that Fitch intersections
+  // and unions are single AND/OR operations over a whole block of profiles.
+
+  vector<Word> leaves;  // State sets of every taxon.
+  vector<Word> valid;   // Mask of profiles that exist in each block.
+  vector<Word> planes;  // Bit-planes of the profile weights for each block.
+  int numPlanes;
+
+  public:
+
+    int numStates, numProfiles, numBlocks;
+    vector<long> weights;
+
+    // Constructor
+    ProfileMatrix(vector<string> &profiles, vector<long> &weis,
+                  map<string,int> &tax) {
+
+      numProfiles = profiles.size();
+      numBlocks   = (numProfiles+WORDBITS-1)/WORDBITS;
+      weights     = weis;
+      taxa        = tax;
+
+      // Without profiles, any taxon in the dictionary is acceptable.
+      if (numProfiles > 0) numTaxa = profiles[0].size();
+      else {
+        numTaxa = 0;
+        for (map<string,int>::iterator it = taxa.begin(); it != taxa.end();
+             ++it) numTaxa = max(numTaxa,it->second+1);
+      }
+
+      // Enumerate all characters comprising profiles as states.
+      int stateOf[256]; numStates = 0;
+      for (int c = 0; c < 256; ++c) stateOf[c] = -1;
+      for (int i = 0; i < numProfiles; ++i)
+        for (int t = 0; t < numTaxa; ++t) {
+          unsigned char ch = profiles[i][t];
+          if (stateOf[ch] < 0) stateOf[ch] = numStates++;
+        }
+
+      // Pack the single state observed for each taxon at each profile.
+      leaves.assign((size_t)numTaxa*setSize(),0);
+      valid.assign(numBlocks,0);
+      for (int i = 0; i < numProfiles; ++i) {
+        int b = i/WORDBITS; Word bit = 1ULL << (i%WORDBITS);
+        valid[b] |= bit;
+        for (int t = 0; t < numTaxa; ++t) {
+          int s = stateOf[(unsigned char)profiles[i][t]];
+          leaves[(size_t)t*setSize()+b*numStates+s] |= bit;
+        }
+      }
+
+      // Decompose weights into bit-planes for weighted population counts.
+      long maxWeight = 0; numPlanes = 0;
+      for (int i = 0; i < numProfiles; ++i)
+        if (weights[i] > maxWeight) maxWeight = weights[i];
+      while (maxWeight >> numPlanes) ++numPlanes;
+      planes.assign((size_t)numBlocks*numPlanes,0);
+      for (int i = 0; i < numProfiles; ++i) {
+        int b = i/WORDBITS; Word bit = 1ULL << (i%WORDBITS);
+        for (int k = 0; k < numPlanes; ++k)
+          if ((weights[i] >> k) & 1) planes[(size_t)b*numPlanes+k] |= bit;
+      }
+
+    };
+
+    // Function Definitions
+    int setSize()          { return numBlocks*numStates; };
+    Word *leafSet(int tax) { return &leaves[(size_t)tax*setSize()]; };
+
+    long weightOf(int b, Word mask) {
+      long w = 0;
+      for (int k = 0; k < numPlanes; ++k)
+        w += (long)__builtin_popcountll(mask & planes[(size_t)b*numPlanes+k])
+             << k;
+      return w;
+    };
+
+    long combine(Word *X, Word **C, int k, int *steps = NULL) {
+
+      // Fitch operation for a node with k children state sets (C). Stores
+      // resultant state set into X and returns the weighted cost incurred;
+      // steps incurred by every profile are optionally accumulated as well.
+      // This works on multifurcating nodes.
+      long cost = 0;
+      for (int b = 0; b < numBlocks; ++b) {
+        int o = b*numStates; Word nonempty = 0;
+        for (int s = 0; s < numStates; ++s) {
+          Word in = C[0][o+s];
+          for (int c = 1; c < k; ++c) in &= C[c][o+s];
+          X[o+s] = in; nonempty |= in;
+        }
+        // Where intersection is zero, take union and increase cost.
+        Word empty = valid[b] & ~nonempty;
+        if (empty) {
+          for (int s = 0; s < numStates; ++s) {
+            Word un = 0;
+            for (int c = 0; c < k; ++c) un |= C[c][o+s];
+            X[o+s] |= un & empty;
+          }
+          cost += (k-1)*weightOf(b,empty);
+          if (steps)
+            for (Word e = empty; e; e &= e-1)
+              steps[b*WORDBITS+__builtin_ctzll(e)] += k-1;
+        }
+      }
+      return cost;
+
+    };
+
+};
+
+/* Flattened Tree for Bit-Packed Traversal */
+
+class FlatTree {
+
+  // A tree stored as a post-order array of nodes with children indices laid
+  // out contiguously (compressed rows) for the Fitch pass.
+
+  public:
 
-string strUnion(string a, string b) {
+    vector<int> taxon;  // Taxon index of a leaf; -1 for internal nodes.
+    vector<int> start;  // Offset of a node's children in child array.
+    vector<int> child;  // Children indices of all nodes.
 
-  string it;
-  set_union(a.begin(),a.end(),b.begin(),b.end(),
-                back_inserter(it));
-  return it;
+    // Function Definitions
+    int size()             { return taxon.size(); };
+    int numChildren(int i) { return start[i+1]-start[i]; };
+    int *children(int i)   { return &child[start[i]]; };
+    bool isBinary() {
+      for (int i = 0; i < size(); ++i)
+        if (taxon[i] < 0 && numChildren(i) != 2) return false;
+      return true;
+    };
+
+};
+
+bool flattenTree(Tree *tree, TaxonSet *taxa, FlatTree *flat) {
+
+  // Flatten a parsed tree; returns false if a leaf is not a known taxon.
+  vector<Tree::TreeNode> postorder = tree->postOrder();
+  map<Tree::TreeNode,int> index;
+  flat->start.push_back(0);
+  for (size_t i = 0; i < postorder.size(); ++i) {
+    Tree::TreeNode n = postorder[i];
+    index[n] = i;
+    if (n->isLeaf()) {
+      int tax = taxa->indexOf(n->getLabel());
+      if (tax < 0) return false;
+      flat->taxon.push_back(tax);
+    } else {
+      flat->taxon.push_back(-1);
+      for (Node::ChildIterator ch = n->iterChildrenBegin();
+           ch != n->iterChildrenEnd(); ++ch) flat->child.push_back(index[*ch]);
+    }
+    flat->start.push_back(flat->child.size());
+  }
+  return true;
 
 }
 
-string intersectChildrenDataOfNode(Node *n) {
+/* Fitch Algorithm Implementation */
 
-  string interSet = string();
-  for (Node::ChildIterator ch = n->iterChildrenBegin();
-      ch != n->iterChildrenEnd(); ++ch) {
-    string data = (*ch)->getData();
-    if (interSet.size() == 0) interSet.assign(data);
-    else interSet.assign(strIntersection(data,interSet));
+long cost(ProfileMatrix *mat, FlatTree *tree, vector<Word> &buf,
+          vector<long> *local = NULL, int *steps = NULL) {
+
+  // Calculate parsimony score over all profiles at once. Buffer holds the
+  // state sets of every node of the tree; the cost incurred at each node
+  // and the steps incurred by every profile are optionally recorded too.
+  long total = 0;
+  int sz = mat->setSize(), n = tree->size();
+  vector<Word*> C;
+  buf.resize((size_t)n*sz);
+  if (local) local->assign(n,0);
+  for (int i = 0; i < n; ++i) {
+    Word *X = &buf[(size_t)i*sz];
+    if (tree->taxon[i] >= 0) {
+      Word *L = mat->leafSet(tree->taxon[i]);
+      copy(L,L+sz,X);
+    } else {
+      int k = tree->numChildren(i), *ch = tree->children(i);
+      C.resize(k);
+      for (int c = 0; c < k; ++c) C[c] = &buf[(size_t)ch[c]*sz];
+      long c = mat->combine(X,&C[0],k,steps);
+      if (local) (*local)[i] = c;
+      total += c;
+    }
   }
-  return interSet;
+  return total;
 
 }
 
-string unionChildrenDataOfNode(Node *n) {
+/* Parsimony-Informative Profiles */
+
+bool isInformative(string &profile, int &steps) {
 
-  string unionSet = string();
-  for (Node::ChildIterator ch = n->iterChildrenBegin();
-      ch != n->iterChildrenEnd(); ++ch) {
-    string data = (*ch)->getData();
-    if (unionSet.size() == 0) unionSet.assign(data);
-    else unionSet.assign(strUnion(data,unionSet));
+  // A profile is informative if at least two states are each found in two
+  // or more taxa; otherwise it costs the same number of steps (its number
+  // of states less one) on any binary tree.
+  int count[256] = {0}, states = 0, shared = 0;
+  for (size_t t = 0; t < profile.size(); ++t) {
+    int c = ++count[(unsigned char)profile[t]];
+    if (c == 1) ++states;
+    else if (c == 2) ++shared;
   }
-  return unionSet;
+  steps = max(states-1,0);
+  return (shared >= 2);
 
 }
 
-/* Fitch Algorithm Implementation */
+class ProfileSet {
 
-int cost(Tree *tree, int numPro, string *proArr, long *weiArr,
-         map<string,int> *map) {
+  // All profiles alongside only those that are informative. Binary trees are
+  // traversed with informative profiles alone and the steps of all others
+  // added as a constant; any other tree is traversed with all profiles.
 
-  // Calculate parsimony score. This works on multifurcating trees.
-  int total = 0;
-  vector<Tree::TreeNode> postorder = tree->postOrder();
-  for (int i = 0; i < numPro; i++) {
-    // For every profile...
-    int local = 0;
-    for (vector<Tree::TreeNode>::iterator it = postorder.begin();
-         it != postorder.end(); it++) {
-      if ((*it)->isLeaf()) {
-        int taxInd = map->at((*it)->getLabel());
-        (*it)->setData(proArr[i].substr(taxInd,1));
+  public:
+
+    ProfileMatrix all, *informative;
+    long constant;
+
+    // Constructor/Destructor
+    ProfileSet(vector<string> &profiles, vector<long> &weis,
+               map<string,int> &tax) : all(profiles,weis,tax) {
+      vector<string> pros; vector<long> ws; int steps;
+      constant = 0;
+      for (size_t i = 0; i < profiles.size(); ++i) {
+        if (isInformative(profiles[i],steps)) {
+          pros.push_back(profiles[i]);
+          ws.push_back(weis[i]);
+        } else constant += steps*weis[i];
       }
+      informative = new ProfileMatrix(pros,ws,tax);
+    };
+    ~ProfileSet() { delete informative; };
+
+    // Function Definitions
+    ProfileMatrix *matrixFor(FlatTree *tree) {
+      return tree->isBinary() ? informative : &all;
+    };
+    long offsetFor(FlatTree *tree) {
+      return tree->isBinary() ? constant : 0;
+    };
+    long score(FlatTree *tree, vector<Word> &buf) {
+      return cost(matrixFor(tree),tree,buf)+offsetFor(tree);
+    };
+
+};
+
+/* Incremental Rescoring of Rearrangements */
+
+class MoveBuffer {
+
+  // Working memory for rescoring rearrangements of a tree; every thread
+  // rescoring the same tree needs its own.
+
+  public:
+
+    vector<int> stamp, slot;  // Marks nodes recomputed for a rearrangement.
+    vector<Word> scratch;     // State sets of recomputed nodes.
+    int epoch;
+
+    // Constructor
+    MoveBuffer() { epoch = 0; };
+
+};
+
+class TreeState {
+
+  // Down-pass state sets of every node of a fixed tree. A rearrangement that
+  // prunes the subtree below node clip and regrafts it onto the edge above
+  // node dest only changes the state sets along the paths from the pruning
+  // and regrafting points to the root; only those are recomputed.
+
+  public:
+
+    PyObject *handle;       // Keeps the packed profiles alive.
+    ProfileSet *profiles;
+    ProfileMatrix *mat;
+    FlatTree tree;
+    vector<int> parent;
+    vector<Word> sets;
+    vector<long> local;
+    vector<long> below;     // Cost of every subtree.
+    vector<long> above;     // Cost of every path up to the root.
+    long total, highest;    // Highest is the costliest path to the root.
+    bool binary;
+    MoveBuffer buffer;      // For rescoring from the calling thread alone.
+
+    // Constructor
+    TreeState(PyObject *h, ProfileSet *p) {
+      handle = h; profiles = p; mat = NULL; total = highest = 0;
+      binary = false;
+      Py_INCREF(handle);
+    };
+    ~TreeState() { Py_DECREF(handle); };
+
+    // Function Definitions
+    void score() {
+      mat = profiles->matrixFor(&tree);
+      total = cost(mat,&tree,sets,&local)+profiles->offsetFor(&tree);
+      binary = tree.isBinary();
+
+      // Accumulate costs below and above every node for bounding moves.
+      int n = tree.size();
+      below = local; above = local; highest = 0;
+      for (int i = 0; i < n; ++i)
+        if (parent[i] >= 0) below[parent[i]] += below[i];
+      for (int i = n-1; i >= 0; --i) {
+        if (parent[i] >= 0) above[i] += above[parent[i]];
+        highest = max(highest,above[i]);
+      }
+    };
+
+    long move(int clip, int dest, MoveBuffer &buf) {
+
+      // Score the tree resulting from moving clip onto the edge above dest.
+      // The new node joining them is given index n. The parent of clip is
+      // suppressed if it is left with a single child.
+      int n = tree.size(), q = n, sz = mat->setSize();
+      vector<int> &stamp = buf.stamp, &slot = buf.slot;
+      vector<Word> &scratch = buf.scratch;
+      if ((int)stamp.size() <= n) {
+        stamp.assign(n+1,0); slot.assign(n+1,0);
+      }
+      int p = parent[clip], g = parent[p], c = -1, t;
+      bool suppress = (tree.numChildren(p) == 2);
+      if (suppress) {
+        int *ch = tree.children(p);
+        c = (ch[0] == clip) ? ch[1] : ch[0];
+        if (dest == p) dest = c;
+      }
+      t = parent[dest];
+      if (suppress && t == p) t = g;
+
+      // Collect path from new node to root, then that from the pruning point
+      // up to where it meets the first path.
+      int epoch = ++buf.epoch;
+      vector<int> order, path;
+      for (int x = q; x >= 0;) {
+        path.push_back(x); stamp[x] = epoch;
+        if (x == q) x = t;
+        else if (suppress && x == c) x = g;
+        else x = parent[x];
+      }
+      for (int x = suppress ? g : p; x >= 0 && stamp[x] != epoch;
+           x = parent[x]) {
+        order.push_back(x); stamp[x] = epoch;
+      }
+      order.insert(order.end(),path.begin(),path.end());
+
+      // Recompute state sets bottom-up; adjust the cost accordingly.
+      long delta = suppress ? -local[p] : 0;
+      scratch.resize((size_t)order.size()*sz);
+      vector<Word*> C;
+      for (size_t i = 0; i < order.size(); ++i) {
+        int x = order[i];
+        slot[x] = i;
+        C.clear();
+        if (x == q) {
+          C.push_back(0); C.push_back(0);
+          C[0] = (stamp[dest] == epoch) ? &scratch[(size_t)slot[dest]*sz]
+                                        : &sets[(size_t)dest*sz];
+          C[1] = &sets[(size_t)clip*sz];
+        } else {
+          int k = tree.numChildren(x), *ch = tree.children(x);
+          for (int j = 0; j < k; ++j) {
+            int y = ch[j];
+            if (x == p && y == clip) continue;
+            if (suppress && x == g && y == p) y = c;
+            if (x == t && y == dest) y = q;
+            C.push_back((stamp[y] == epoch) ? &scratch[(size_t)slot[y]*sz]
+                                            : &sets[(size_t)y*sz]);
+          }
+          delta -= local[x];
+        }
+        delta += mat->combine(&scratch[(size_t)i*sz],&C[0],C.size());
+      }
+      return total+delta;
+
+    };
+
+    long bound(int clip, MoveBuffer &buf) {
+
+      // Lower bound on the cost of any tree resulting from moving clip. On a
+      // binary tree, regrafting never costs less than the tree left after
+      // pruning and the pruned subtree scored apart. Otherwise, only nodes
+      // off the paths from the pruning and regrafting points to the root
+      // are sure to keep their cost.
+      int p = parent[clip], sz = mat->setSize();
+      if (!binary) return total-above[p]-highest;
+      int g = parent[p], *ch = tree.children(p);
+      int c = (ch[0] == clip) ? ch[1] : ch[0];
+
+      // Recompute state sets from the pruning point up to the root.
+      long delta = -local[p];
+      buf.scratch.resize((size_t)2*sz);
+      Word *prev = &sets[(size_t)c*sz], *curr;
+      vector<Word*> C;
+      for (int x = g, i = 0; x >= 0; x = parent[x], i ^= 1) {
+        int k = tree.numChildren(x), *chx = tree.children(x);
+        curr = &buf.scratch[(size_t)i*sz];
+        C.clear();
+        for (int j = 0; j < k; ++j)
+          C.push_back((chx[j] == p) ? prev : &sets[(size_t)chx[j]*sz]);
+        delta += mat->combine(curr,&C[0],k)-local[x];
+        p = x; prev = curr;
+      }
+      return total+delta;
+
+    };
+
+};
+
+/* Sankoff (Weighted) Parsimony Implementation */
+
+class SankoffMatrix : public TaxonSet {
+
+  // Site patterns resolved against the states of a step matrix. The costs
+  // of a node are kept for all patterns contiguously per state (state-major)
+  // so that the dynamic programming step runs along whole rows of patterns.
+
+  vector<int> leaves;     // State of every taxon at every pattern; -1 if
+                          // character is missing or not a known state.
+
+  public:
+
+    int numStates, numPatterns;
+    vector<double> steps;   // Step matrix: steps[s*S+t] = c(s,t).
+    vector<double> weights;
+
+    // Constructor
+    SankoffMatrix(vector<string> &profiles, vector<long> &weis,
+                  map<string,int> &tax, string &states, vector<double> &cost) {
+
+      numPatterns = profiles.size();
+      numStates   = states.size();
+      taxa        = tax;
+      steps       = cost;
+      weights.assign(weis.begin(),weis.end());
+      if (numPatterns > 0) numTaxa = profiles[0].size();
       else {
-        // Get the intersection of all children.
-        string X = intersectChildrenDataOfNode(*it);
-	      // Is intersection zero?
-        if (X.size() == 0) {
-          X = unionChildrenDataOfNode(*it);
-          local += (*it)->numChildren() - 1; // Increase cost.
-        } (*it)->setData(X);
+        numTaxa = 0;
+        for (map<string,int>::iterator it = taxa.begin(); it != taxa.end();
+             ++it) numTaxa = max(numTaxa,it->second+1);
+      }
+
+      // Characters are matched to states regardless of case.
+      int stateOf[256];
+      for (int c = 0; c < 256; ++c) stateOf[c] = -1;
+      for (int s = 0; s < numStates; ++s) {
+        unsigned char ch = states[s];
+        stateOf[tolower(ch)] = stateOf[toupper(ch)] = s;
+      }
+      leaves.assign((size_t)numTaxa*numPatterns,-1);
+      for (int p = 0; p < numPatterns; ++p)
+        for (int t = 0; t < numTaxa; ++t)
+          leaves[(size_t)t*numPatterns+p] =
+            stateOf[(unsigned char)profiles[p][t]];
+
+    };
+
+    // Function Definitions
+    int setSize() { return numPatterns*numStates; };
+
+    void addLeaf(double *X, int tax) {
+
+      // Add the cost of each state of a parent to reach a leaf.
+      int S = numStates, P = numPatterns, *obs = &leaves[(size_t)tax*P];
+      for (int s = 0; s < S; ++s) {
+        double *x = X+(size_t)s*P, *c = &steps[s*S];
+        for (int p = 0; p < P; ++p) if (obs[p] >= 0) x[p] += c[obs[p]];
       }
+
+    };
+
+    void addNode(double *X, double *Y, double *best) {
+
+      // Add the least cost of each state of a parent to reach any state of
+      // an internal node, for which the costs are Y; best is a row of
+      // patterns for working memory.
+      int S = numStates, P = numPatterns;
+      for (int s = 0; s < S; ++s) {
+        double *x = X+(size_t)s*P, *c = &steps[s*S];
+        for (int p = 0; p < P; ++p) best[p] = c[0]+Y[p];
+        for (int t = 1; t < S; ++t) {
+          double ct = c[t], *y = Y+(size_t)t*P;
+          for (int p = 0; p < P; ++p) best[p] = min(best[p],ct+y[p]);
+        }
+        for (int p = 0; p < P; ++p) x[p] += best[p];
+      }
+
+    };
+
+    double total(double *X, double *best) {
+
+      // Weighted sum of the least costs of all patterns at the root.
+      int S = numStates, P = numPatterns; double sum = 0;
+      copy(X,X+P,best);
+      for (int s = 1; s < S; ++s)
+        for (int p = 0; p < P; ++p) best[p] = min(best[p],X[(size_t)s*P+p]);
+      for (int p = 0; p < P; ++p) sum += weights[p]*best[p];
+      return sum;
+
+    };
+
+};
+
+double sankoff(SankoffMatrix *mat, FlatTree *tree, vector<double> &buf) {
+
+  // Calculate weighted parsimony score over all patterns at once. Buffer
+  // holds the costs of every state of internal nodes; a node's costs are
+  // only held until those of its parent are computed.
+  int n = tree->size(), sz = mat->setSize(), used = 0;
+  if (tree->taxon[n-1] >= 0) return 0;
+  vector<int> slot(n,-1), freed;
+  for (int i = 0; i < n; ++i) {
+    if (tree->taxon[i] >= 0) continue;
+    int k = tree->numChildren(i), *ch = tree->children(i);
+    if (freed.empty()) slot[i] = used++;
+    else { slot[i] = freed.back(); freed.pop_back(); }
+    for (int c = 0; c < k; ++c)
+      if (slot[ch[c]] >= 0) freed.push_back(slot[ch[c]]);
+  }
+  buf.resize((size_t)(used+1)*sz);
+  double *best = &buf[(size_t)used*sz];
+  for (int i = 0; i < n; ++i) {
+    if (tree->taxon[i] >= 0) continue;
+    double *X = &buf[(size_t)slot[i]*sz];
+    int k = tree->numChildren(i), *ch = tree->children(i);
+    fill(X,X+sz,0);
+    for (int c = 0; c < k; ++c) {
+      if (tree->taxon[ch[c]] >= 0) mat->addLeaf(X,tree->taxon[ch[c]]);
+      else mat->addNode(X,&buf[(size_t)slot[ch[c]]*sz],best);
     }
-    total += local*weiArr[i];
   }
-  return total;
+  return mat->total(&buf[(size_t)slot[n-1]*sz],best);
 
 }
 
-static PyObject * fitch_cost(PyObject *self, PyObject *args) {
-
-  // Get input Newick string and lists of profiles & weights.
-  char *newickstr; PyObject *proList, *weiList, *taxDict;
-  if (!PyArg_ParseTuple(args,"sOOO",&newickstr,&proList,&weiList,&taxDict))
-    return NULL;
-  string newick(newickstr);
+/* Conversion of Python Arguments */
 
-  // See how many elements comprise the list arguments.
-  int proEles = PyList_Size(proList),
-      weiEles = PyList_Size(weiList);
-  if (proEles != weiEles) return NULL; // Do not match.
+bool readProfiles(PyObject *proList, PyObject *weiList, PyObject *taxDict,
+                  vector<string> &pros, vector<long> &weis,
+                  map<string,int> &taxa) {
 
-  // Construct and populate the tree.
-  Tree tree;
-  PhylogenyParser parser(&tree,newick);
-  parser.parse();
+  // Acquire profiles, weights and taxa dictionary; sets a Python error
+  // and returns false on failure.
+  if (!PyList_Check(proList) || !PyList_Check(weiList)) {
+    PyErr_SetString(PyExc_TypeError,"Profiles and weights must be lists.");
+    return false;
+  }
+  int proEles = PyList_Size(proList), weiEles = PyList_Size(weiList);
+  if (proEles != weiEles) {
+    PyErr_SetString(PyExc_ValueError,"Profiles and weights do not match.");
+    return false;
+  }
 
   // Acquire profiles (first list argument).
-  string *strArr = new string[proEles];
   for (int i = 0; i < proEles; i++) {
-    char *proCurr; PyObject *curr;
-    curr = PyList_GetItem(proList,i);
-    if (PyString_Check(curr)) {
-      proCurr = PyString_AsString(curr);
-      strArr[i] = string(proCurr);
-    } else return NULL;
+    PyObject *curr = PyList_GetItem(proList,i);
+    if (!PyString_Check(curr)) {
+      PyErr_SetString(PyExc_TypeError,"Profiles must be strings.");
+      return false;
+    }
+    pros.push_back(string(PyString_AsString(curr)));
+    if (pros[i].size() != pros[0].size()) {
+      PyErr_SetString(PyExc_ValueError,"Profiles differ in length.");
+      return false;
+    }
   }
 
   // Acquire weights (second list argument).
-  long *weiArr = new long[weiEles];
-  for (int i = 0; i < proEles; i++) {
+  for (int i = 0; i < weiEles; i++) {
     PyObject *it = PyList_GetItem(weiList,i);
-    if (PyInt_Check(it)) weiArr[i] = PyInt_AsLong(it);
-    else return NULL;
+    if (PyInt_Check(it) || PyLong_Check(it)) weis.push_back(PyInt_AsLong(it));
+    else {
+      PyErr_SetString(PyExc_TypeError,"Weights must be integers.");
+      return false;
+    }
   }
 
   // Acquire dictionary mapping taxa to vectors.
-  map<string,int> taxMap;
-  if (PyDict_Check(taxDict)) {
-    PyObject *li = PyDict_Items(taxDict);
-    int numEles = PyList_Size(li);
-    for (int j = 0; j < numEles; j++) {
-      PyObject *tu = PyList_GetItem(li,j);
-      PyObject *key = PyTuple_GetItem(tu,0);
-      PyObject *ind = PyTuple_GetItem(tu,1);
-      string k = PyString_AsString(key);
-      int v = (int)PyInt_AsLong(ind);
-      taxMap.insert(pair<string,int>(k,v));
+  if (!PyDict_Check(taxDict)) {
+    PyErr_SetString(PyExc_TypeError,"Taxa must be given as a dictionary.");
+    return false;
+  }
+  PyObject *key, *ind; Py_ssize_t pos = 0;
+  while (PyDict_Next(taxDict,&pos,&key,&ind)) {
+    if (!PyString_Check(key)) {
+      PyErr_SetString(PyExc_TypeError,"Taxa names must be strings.");
+      return false;
     }
-  } else return NULL;
+    taxa.insert(pair<string,int>(PyString_AsString(key),
+                                 (int)PyInt_AsLong(ind)));
+  }
+  return true;
+
+}
+
+bool readTree(char *newickstr, TaxonSet *taxa, FlatTree *flat) {
+
+  // Construct, populate and flatten a tree; sets a Python error and returns
+  // false on failure.
+  Tree tree;
+  PhylogenyParser parser(&tree,string(newickstr));
+  parser.parse();
+  if (!flattenTree(&tree,taxa,flat)) {
+    PyErr_SetString(PyExc_KeyError,"Tree has a leaf not found in profiles.");
+    return false;
+  }
+  return true;
+
+}
+
+static PyObject * fitch_cost(PyObject *self, PyObject *args) {
+
+  // Get input Newick string and lists of profiles & weights.
+  char *newickstr; PyObject *proList, *weiList, *taxDict;
+  if (!PyArg_ParseTuple(args,"sOOO",&newickstr,&proList,&weiList,&taxDict))
+    return NULL;
+
+  // Pack the profiles.
+  vector<string> pros; vector<long> weis; map<string,int> taxa;
+  if (!readProfiles(proList,weiList,taxDict,pros,weis,taxa)) return NULL;
+  ProfileSet set(pros,weis,taxa);
+
+  // Construct and populate the tree.
+  FlatTree flat;
+  if (!readTree(newickstr,&set.all,&flat)) return NULL;
 
   // Get the fitch parsimony cost.
-  int c = cost(&tree,proEles,strArr,weiArr,&taxMap);
+  vector<Word> buf;
+  long c = set.score(&flat,buf);
 
   // Construct into a Python object and return.
-  delete [] strArr;
-  delete [] weiArr;
-  return Py_BuildValue("i",c);
+  return Py_BuildValue("l",c);
+
+}
+
+/* Persistent Profile Handles */
+
+static char PROFILES[] = "profiles";
+
+static void destroyProfiles(void *p, void *desc) {
+
+  delete (ProfileSet*)p;
+
+}
+
+static ProfileSet * getProfiles(PyObject *p) {
+
+  // Acquire the packed profiles behind a handle; sets a Python error and
+  // returns NULL if the object is not a handle.
+  if (!PyCObject_Check(p) || PyCObject_GetDesc(p) != PROFILES) {
+    PyErr_SetString(PyExc_ReferenceError,"Could not parse profile handle.");
+    return NULL;
+  }
+  return (ProfileSet*)PyCObject_AsVoidPtr(p);
+
+}
+
+static PyObject * fitch_new(PyObject *self, PyObject *args) {
+
+  // Get lists of profiles & weights and the taxa dictionary.
+  PyObject *proList, *weiList, *taxDict;
+  if (!PyArg_ParseTuple(args,"OOO",&proList,&weiList,&taxDict)) return NULL;
+
+  // Pack the profiles into native memory owned by the handle.
+  vector<string> pros; vector<long> weis; map<string,int> taxa;
+  if (!readProfiles(proList,weiList,taxDict,pros,weis,taxa)) return NULL;
+  ProfileSet *set = new ProfileSet(pros,weis,taxa);
+
+  // Return pointer to packed profiles; freed when handle is collected.
+  return PyCObject_FromVoidPtrAndDesc((void*)set,PROFILES,destroyProfiles);
+
+}
+
+static PyObject * fitch_handlecost(PyObject *self, PyObject *args) {
+
+  // Get handle and input Newick string.
+  PyObject *p; char *newickstr; ProfileSet *set;
+  if (!PyArg_ParseTuple(args,"Os",&p,&newickstr)) return NULL;
+  if (!(set = getProfiles(p))) return NULL;
+
+  // Construct and populate the tree.
+  FlatTree flat;
+  if (!readTree(newickstr,&set->all,&flat)) return NULL;
+
+  // Get the fitch parsimony cost.
+  vector<Word> buf;
+  return Py_BuildValue("l",set->score(&flat,buf));
+
+}
+
+static char TREESTATE[] = "tree state";
+
+static void destroyTreeState(void *p, void *desc) {
+
+  delete (TreeState*)p;
+
+}
+
+static TreeState * getTreeState(PyObject *p) {
+
+  // Acquire the tree state behind a handle; sets a Python error and returns
+  // NULL if the object is not a handle.
+  if (!PyCObject_Check(p) || PyCObject_GetDesc(p) != TREESTATE) {
+    PyErr_SetString(PyExc_ReferenceError,"Could not parse tree handle.");
+    return NULL;
+  }
+  return (TreeState*)PyCObject_AsVoidPtr(p);
+
+}
+
+static PyObject * fitch_newtree(PyObject *self, PyObject *args) {
+
+  // Get profile handle and lists of parent indices and labels of nodes.
+  PyObject *p, *parList, *lblList; ProfileSet *set;
+  if (!PyArg_ParseTuple(args,"OOO",&p,&parList,&lblList)) return NULL;
+  if (!(set = getProfiles(p))) return NULL;
+
+  if (!PyList_Check(parList) || !PyList_Check(lblList) ||
+      PyList_Size(parList) != PyList_Size(lblList)) {
+    PyErr_SetString(PyExc_TypeError,
+                    "Parents and labels must be lists of equal size.");
+    return NULL;
+  }
+
+  // Nodes are given in post-order; the root is last.
+  int n = PyList_Size(parList);
+  if (n == 0) {
+    PyErr_SetString(PyExc_ValueError,"Tree has no nodes.");
+    return NULL;
+  }
+  vector<int> parent(n), count(n+1,0);
+  for (int i = 0; i < n; ++i) {
+    parent[i] = (int)PyInt_AsLong(PyList_GetItem(parList,i));
+    if ((i < n-1 && (parent[i] <= i || parent[i] >= n)) ||
+        (i == n-1 && parent[i] != -1)) {
+      PyErr_SetString(PyExc_ValueError,"Nodes must be given in post-order.");
+      return NULL;
+    }
+    if (parent[i] >= 0) ++count[parent[i]+1];
+  }
+
+  // Lay out children and resolve leaves to taxa.
+  TreeState *state = new TreeState(p,set);
+  FlatTree *flat = &state->tree;
+  state->parent = parent;
+  flat->start.assign(n+1,0);
+  for (int i = 0; i < n; ++i) flat->start[i+1] = flat->start[i]+count[i+1];
+  flat->child.resize(n-1);
+  flat->taxon.assign(n,-1);
+  vector<int> fill(flat->start.begin(),flat->start.end()-1);
+  for (int i = 0; i < n-1; ++i) flat->child[fill[parent[i]]++] = i;
+  for (int i = 0; i < n; ++i) {
+    if (flat->numChildren(i) > 0) continue;
+    PyObject *lbl = PyList_GetItem(lblList,i);
+    int tax = -1;
+    if (PyString_Check(lbl)) tax = set->all.indexOf(PyString_AsString(lbl));
+    if (tax < 0) {
+      delete state;
+      PyErr_SetString(PyExc_KeyError,"Tree has a leaf not found in profiles.");
+      return NULL;
+    }
+    flat->taxon[i] = tax;
+  }
+  state->score();
+
+  // Return pointer to tree state; freed when handle is collected.
+  return PyCObject_FromVoidPtrAndDesc((void*)state,TREESTATE,
+                                      destroyTreeState);
+
+}
+
+static PyObject * fitch_treecost(PyObject *self, PyObject *args) {
+
+  // Get tree handle; return its parsimony cost.
+  PyObject *p; TreeState *state;
+  if (!PyArg_ParseTuple(args,"O",&p)) return NULL;
+  if (!(state = getTreeState(p))) return NULL;
+  return Py_BuildValue("l",state->total);
+
+}
+
+static bool checkMove(TreeState *state, int clip, int dest) {
+
+  // Ensure a node can be pruned and regrafted above another; sets a Python
+  // error and returns false otherwise.
+  int n = state->tree.size();
+  if (clip < 0 || clip >= n-1 || dest < 0 || dest >= n) {
+    PyErr_SetString(PyExc_IndexError,"Node index out of range.");
+    return false;
+  }
+  if (state->tree.numChildren(state->parent[clip]) < 2) {
+    PyErr_SetString(PyExc_ValueError,"Cannot prune from a unary node.");
+    return false;
+  }
+  for (int x = dest; x >= 0; x = state->parent[x])
+    if (x == clip) {
+      PyErr_SetString(PyExc_ValueError,
+                      "Cannot move into subtree of pruned node.");
+      return false;
+    }
+  return true;
+
+}
+
+static PyObject * fitch_movecost(PyObject *self, PyObject *args) {
+
+  // Get tree handle, index of node to prune and of node to regraft above.
+  PyObject *p; TreeState *state; int clip, dest;
+  if (!PyArg_ParseTuple(args,"Oii",&p,&clip,&dest)) return NULL;
+  if (!(state = getTreeState(p))) return NULL;
+  if (!checkMove(state,clip,dest)) return NULL;
+
+  // Get the fitch parsimony cost of the rearranged tree.
+  return Py_BuildValue("l",state->move(clip,dest,state->buffer));
+
+}
+
+/* Batch Scoring */
+
+template <class Task> void runThreads(int count, int threads, Task task) {
+
+  // Perform task(i,t) for every item i in [0,count) spread across a number
+  // of native threads, t being the thread; the calling thread is the first.
+  if (threads > count) threads = count;
+  if (threads <= 1) {
+    for (int i = 0; i < count; ++i) task(i,0);
+    return;
+  }
+  vector<thread> pool;
+  for (int t = 1; t < threads; ++t)
+    pool.push_back(thread([&task,count,threads,t]() {
+      for (int i = t; i < count; i += threads) task(i,t);
+    }));
+  for (int i = 0; i < count; i += threads) task(i,0);
+  for (size_t t = 0; t < pool.size(); ++t) pool[t].join();
+
+}
+
+static PyObject * toList(vector<long> &values) {
+
+  PyObject *list = PyList_New(values.size());
+  if (!list) return NULL;
+  for (size_t i = 0; i < values.size(); ++i)
+    PyList_SET_ITEM(list,i,PyInt_FromLong(values[i]));
+  return list;
+
+}
+
+static bool readNewicks(PyObject *treList, vector<string> &newicks) {
+
+  // Acquire a list of Newick strings; sets a Python error and returns false
+  // on failure.
+  if (!PyList_Check(treList)) {
+    PyErr_SetString(PyExc_TypeError,"Trees must be given as a list.");
+    return false;
+  }
+  for (int i = 0; i < PyList_Size(treList); ++i) {
+    PyObject *curr = PyList_GetItem(treList,i);
+    if (!PyString_Check(curr)) {
+      PyErr_SetString(PyExc_TypeError,"Trees must be Newick strings.");
+      return false;
+    }
+    newicks.push_back(string(PyString_AsString(curr)));
+  }
+  return true;
+
+}
+
+static PyObject * fitch_costs(PyObject *self, PyObject *args) {
+
+  // Get handle, list of Newick strings and optional number of threads.
+  PyObject *p, *treList; ProfileSet *set; int threads = 1;
+  if (!PyArg_ParseTuple(args,"OO|i",&p,&treList,&threads)) return NULL;
+  if (!(set = getProfiles(p))) return NULL;
+  vector<string> newicks;
+  if (!readNewicks(treList,newicks)) return NULL;
+  int n = newicks.size();
+
+  // Parse and score all trees without holding the interpreter lock.
+  vector<long> costs(n,0); vector<char> found(n,1);
+  Py_BEGIN_ALLOW_THREADS
+  vector< vector<Word> > bufs(max(threads,1));
+  runThreads(n,threads,[&](int i, int t) {
+    Tree tree; FlatTree flat;
+    PhylogenyParser parser(&tree,newicks[i]);
+    parser.parse();
+    if (flattenTree(&tree,&set->all,&flat))
+      costs[i] = set->score(&flat,bufs[t]);
+    else found[i] = 0;
+  });
+  Py_END_ALLOW_THREADS
+  if (find(found.begin(),found.end(),0) != found.end()) {
+    PyErr_SetString(PyExc_KeyError,"Tree has a leaf not found in profiles.");
+    return NULL;
+  }
+  return toList(costs);
+
+}
+
+static PyObject * fitch_movecosts(PyObject *self, PyObject *args) {
+
+  // Get tree handle, lists of nodes to prune and of nodes to regraft above
+  // and optional number of threads.
+  PyObject *p, *clipList, *destList; TreeState *state; int threads = 1;
+  if (!PyArg_ParseTuple(args,"OOO|i",&p,&clipList,&destList,&threads))
+    return NULL;
+  if (!(state = getTreeState(p))) return NULL;
+  if (!PyList_Check(clipList) || !PyList_Check(destList) ||
+      PyList_Size(clipList) != PyList_Size(destList)) {
+    PyErr_SetString(PyExc_TypeError,
+                    "Nodes must be given as lists of equal size.");
+    return NULL;
+  }
+  int n = PyList_Size(clipList);
+  vector<int> clips(n), dests(n);
+  for (int i = 0; i < n; ++i) {
+    clips[i] = (int)PyInt_AsLong(PyList_GetItem(clipList,i));
+    dests[i] = (int)PyInt_AsLong(PyList_GetItem(destList,i));
+    if (PyErr_Occurred() || !checkMove(state,clips[i],dests[i])) return NULL;
+  }
+
+  // Rescore all rearrangements without holding the interpreter lock.
+  vector<long> costs(n,0);
+  Py_BEGIN_ALLOW_THREADS
+  vector<MoveBuffer> bufs(max(threads,1));
+  runThreads(n,threads,[&](int i, int t) {
+    costs[i] = state->move(clips[i],dests[i],bufs[t]);
+  });
+  Py_END_ALLOW_THREADS
+  return toList(costs);
+
+}
+
+static PyObject * fitch_movebounds(PyObject *self, PyObject *args) {
+
+  // Get tree handle, list of nodes to prune and optional number of threads.
+  PyObject *p, *clipList; TreeState *state; int threads = 1;
+  if (!PyArg_ParseTuple(args,"OO|i",&p,&clipList,&threads)) return NULL;
+  if (!(state = getTreeState(p))) return NULL;
+  if (!PyList_Check(clipList)) {
+    PyErr_SetString(PyExc_TypeError,"Nodes must be given as a list.");
+    return NULL;
+  }
+  int n = PyList_Size(clipList);
+  vector<int> clips(n);
+  for (int i = 0; i < n; ++i) {
+    clips[i] = (int)PyInt_AsLong(PyList_GetItem(clipList,i));
+    if (PyErr_Occurred()) return NULL;
+    if (clips[i] < 0 || clips[i] >= state->tree.size()-1) {
+      PyErr_SetString(PyExc_IndexError,"Node index out of range.");
+      return NULL;
+    }
+    if (state->tree.numChildren(state->parent[clips[i]]) < 2) {
+      PyErr_SetString(PyExc_ValueError,"Cannot prune from a unary node.");
+      return NULL;
+    }
+  }
+
+  // Bound all rearrangements of each node without the interpreter lock.
+  vector<long> bounds(n,0);
+  Py_BEGIN_ALLOW_THREADS
+  vector<MoveBuffer> bufs(max(threads,1));
+  runThreads(n,threads,[&](int i, int t) {
+    bounds[i] = state->bound(clips[i],bufs[t]);
+  });
+  Py_END_ALLOW_THREADS
+  return toList(bounds);
+
+}
+
+/* Per-Profile Steps */
+
+static PyObject * fitch_steps(PyObject *self, PyObject *args) {
+
+  // Get handle and input Newick string.
+  PyObject *p; char *newickstr; ProfileSet *set;
+  if (!PyArg_ParseTuple(args,"Os",&p,&newickstr)) return NULL;
+  if (!(set = getProfiles(p))) return NULL;
+
+  // Construct and populate the tree.
+  FlatTree flat;
+  if (!readTree(newickstr,&set->all,&flat)) return NULL;
+
+  // Count steps of all profiles; return them packed as native integers.
+  int n = set->all.numProfiles;
+  vector<int> steps(n+1,0);
+  vector<Word> buf;
+  cost(&set->all,&flat,buf,NULL,&steps[0]);
+  return PyString_FromStringAndSize((char*)&steps[0],n*sizeof(int));
+
+}
+
+static PyObject * fitch_allsteps(PyObject *self, PyObject *args) {
+
+  // Get handle, list of Newick strings and optional number of threads.
+  PyObject *p, *treList; ProfileSet *set; int threads = 1;
+  if (!PyArg_ParseTuple(args,"OO|i",&p,&treList,&threads)) return NULL;
+  if (!(set = getProfiles(p))) return NULL;
+  vector<string> newicks;
+  if (!readNewicks(treList,newicks)) return NULL;
+  int n = newicks.size(), m = set->all.numProfiles;
+
+  // Count steps of all profiles of all trees (a row for each tree) without
+  // holding the interpreter lock.
+  vector<int> steps((size_t)n*m+1,0); vector<char> found(n,1);
+  Py_BEGIN_ALLOW_THREADS
+  vector< vector<Word> > bufs(max(threads,1));
+  runThreads(n,threads,[&](int i, int t) {
+    Tree tree; FlatTree flat;
+    PhylogenyParser parser(&tree,newicks[i]);
+    parser.parse();
+    if (flattenTree(&tree,&set->all,&flat))
+      cost(&set->all,&flat,bufs[t],NULL,&steps[(size_t)i*m]);
+    else found[i] = 0;
+  });
+  Py_END_ALLOW_THREADS
+  if (find(found.begin(),found.end(),0) != found.end()) {
+    PyErr_SetString(PyExc_KeyError,"Tree has a leaf not found in profiles.");
+    return NULL;
+  }
+  return PyString_FromStringAndSize((char*)&steps[0],(size_t)n*m*sizeof(int));
+
+}
+
+/* Sankoff Handles */
+
+static char SANKOFF[] = "sankoff";
+
+static void destroySankoff(void *p, void *desc) {
+
+  delete (SankoffMatrix*)p;
+
+}
+
+static SankoffMatrix * getSankoff(PyObject *p) {
+
+  // Acquire the patterns and step matrix behind a handle; sets a Python
+  // error and returns NULL if the object is not a handle.
+  if (!PyCObject_Check(p) || PyCObject_GetDesc(p) != SANKOFF) {
+    PyErr_SetString(PyExc_ReferenceError,"Could not parse Sankoff handle.");
+    return NULL;
+  }
+  return (SankoffMatrix*)PyCObject_AsVoidPtr(p);
+
+}
+
+static PyObject * fitch_newsankoff(PyObject *self, PyObject *args) {
+
+  // Get lists of profiles & weights, the taxa dictionary, a string of states
+  // and a flattened step matrix (row-major, from state to state).
+  PyObject *proList, *weiList, *taxDict, *stepList; char *states;
+  if (!PyArg_ParseTuple(args,"OOOsO",&proList,&weiList,&taxDict,&states,
+                        &stepList)) return NULL;
+  vector<string> pros; vector<long> weis; map<string,int> taxa;
+  if (!readProfiles(proList,weiList,taxDict,pros,weis,taxa)) return NULL;
+  string sts(states);
+  if (!PyList_Check(stepList) ||
+      PyList_Size(stepList) != (Py_ssize_t)(sts.size()*sts.size()) ||
+      sts.size() == 0) {
+    PyErr_SetString(PyExc_ValueError,
+                    "Step matrix must give a cost for every pair of states.");
+    return NULL;
+  }
+  vector<double> cost(PyList_Size(stepList));
+  for (size_t i = 0; i < cost.size(); ++i) {
+    cost[i] = PyFloat_AsDouble(PyList_GetItem(stepList,i));
+    if (PyErr_Occurred()) return NULL;
+  }
+
+  // Return pointer to patterns; freed when handle is collected.
+  SankoffMatrix *mat = new SankoffMatrix(pros,weis,taxa,sts,cost);
+  return PyCObject_FromVoidPtrAndDesc((void*)mat,SANKOFF,destroySankoff);
+
+}
+
+static PyObject * fitch_sankoffcost(PyObject *self, PyObject *args) {
+
+  // Get handle and input Newick string.
+  PyObject *p; char *newickstr; SankoffMatrix *mat;
+  if (!PyArg_ParseTuple(args,"Os",&p,&newickstr)) return NULL;
+  if (!(mat = getSankoff(p))) return NULL;
+
+  // Construct and populate the tree.
+  FlatTree flat;
+  if (!readTree(newickstr,mat,&flat)) return NULL;
+
+  // Get the Sankoff parsimony cost.
+  vector<double> buf;
+  return Py_BuildValue("d",sankoff(mat,&flat,buf));
+
+}
+
+static PyObject * fitch_sankoffcosts(PyObject *self, PyObject *args) {
+
+  // Get handle, list of Newick strings and optional number of threads.
+  PyObject *p, *treList; SankoffMatrix *mat; int threads = 1;
+  if (!PyArg_ParseTuple(args,"OO|i",&p,&treList,&threads)) return NULL;
+  if (!(mat = getSankoff(p))) return NULL;
+  vector<string> newicks;
+  if (!readNewicks(treList,newicks)) return NULL;
+
+  // Parse and score all trees without holding the interpreter lock.
+  int n = newicks.size();
+  vector<double> costs(n,0); vector<char> found(n,1);
+  Py_BEGIN_ALLOW_THREADS
+  vector< vector<double> > bufs(max(threads,1));
+  runThreads(n,threads,[&](int i, int t) {
+    Tree tree; FlatTree flat;
+    PhylogenyParser parser(&tree,newicks[i]);
+    parser.parse();
+    if (flattenTree(&tree,mat,&flat)) costs[i] = sankoff(mat,&flat,bufs[t]);
+    else found[i] = 0;
+  });
+  Py_END_ALLOW_THREADS
+  if (find(found.begin(),found.end(),0) != found.end()) {
+    PyErr_SetString(PyExc_KeyError,"Tree has a leaf not found in profiles.");
+    return NULL;
+  }
+  PyObject *list = PyList_New(n);
+  if (!list) return NULL;
+  for (int i = 0; i < n; ++i)
+    PyList_SET_ITEM(list,i,PyFloat_FromDouble(costs[i]));
+  return list;
 
 }
 
@@ -338,6 +1352,32 @@ static PyObject * fitch_cost(PyObject *self, PyObject *args) {
 static PyMethodDef modulemethods[] = {
   {"calculateCost",fitch_cost,METH_VARARGS,
   "Given a Newick string tree, calculate the parsimony cost."},
+  {"new",fitch_new,METH_VARARGS,
+  "Pack profiles, weights and a taxa dictionary into a reusable handle."},
+  {"cost",fitch_handlecost,METH_VARARGS,
+  "Given a profile handle and a Newick string tree, calculate the parsimony cost."},
+  {"newTree",fitch_newtree,METH_VARARGS,
+  "Given a profile handle, parent indices and labels of nodes, keep the state sets of a tree."},
+  {"treeCost",fitch_treecost,METH_VARARGS,
+  "Given a tree handle, return the parsimony cost of the tree."},
+  {"moveCost",fitch_movecost,METH_VARARGS,
+  "Given a tree handle, calculate the parsimony cost of pruning a node and regrafting it above another."},
+  {"costs",fitch_costs,METH_VARARGS,
+  "Given a profile handle and a list of Newick string trees, calculate all parsimony costs."},
+  {"moveCosts",fitch_movecosts,METH_VARARGS,
+  "Given a tree handle and lists of nodes to prune and regraft above, calculate all parsimony costs."},
+  {"moveBounds",fitch_movebounds,METH_VARARGS,
+  "Given a tree handle and a list of nodes, bound the parsimony cost of pruning each node and regrafting it anywhere."},
+  {"steps",fitch_steps,METH_VARARGS,
+  "Given a profile handle and a Newick string tree, count the steps of every profile as packed native integers."},
+  {"allSteps",fitch_allsteps,METH_VARARGS,
+  "Given a profile handle and a list of Newick string trees, count the steps of every profile of every tree as packed native integers."},
+  {"newSankoff",fitch_newsankoff,METH_VARARGS,
+  "Pack profiles, weights, a taxa dictionary, states and a step matrix into a reusable handle."},
+  {"sankoffCost",fitch_sankoffcost,METH_VARARGS,
+  "Given a Sankoff handle and a Newick string tree, calculate the weighted parsimony cost."},
+  {"sankoffCosts",fitch_sankoffcosts,METH_VARARGS,
+  "Given a Sankoff handle and a list of Newick string trees, calculate all weighted parsimony costs."},
   {NULL,NULL,0,NULL}
 };
 
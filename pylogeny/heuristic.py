@@ -16,6 +16,7 @@ from tree import tree
 # Constants
 
 SMGR_MIN_NUM_LIKELIHOOD = 32
+SMGR_NUM_FINALISTS      = 4
 
 # Base Heuristic Superclass/Interface
 
@@ -35,10 +36,10 @@ class phylogeneticLinearHeuristic(heuristic):
     ''' A base class for a heuristic that works on a phylogenetic landscape
     and only possesses a single path (of search). '''
     
-    path, bestTree = list(), None
     def __init__(self,ls,startNode):
         super(phylogeneticLinearHeuristic,self
               ).__init__(ls,startNode)
+        self.path, self.bestTree = list(), None # Not shared by instances.
     def getPath(self):     return self.path
     def getBestTree(self): return self.bestTree
     
@@ -49,7 +50,7 @@ class parsimonyGreedy(phylogeneticLinearHeuristic):
     ''' Greedy (hill-climbing) landscape exploration by comparsion of parsimony.
     '''
     
-    def __init__(self,ls,startNode):
+    def __init__(self,ls,startNode,bound=False):
         
         ''' Initialize this heuristic.
         
@@ -57,10 +58,14 @@ class parsimonyGreedy(phylogeneticLinearHeuristic):
         :type ls: a :class:`.landscape.landscape` object
         :param startNode: what node to start with
         :type startNode: a node (dictionary) from the landscape (getNode())
+        :param bound: whether to bound neighbors on their parsimony and only
+        add the best one to the landscape at every step
+        :type bound: a boolean
         
         '''
         
         super(parsimonyGreedy,self).__init__(ls,startNode)
+        self.bound = bound
         
     def explore(self):
     
@@ -81,6 +86,15 @@ class parsimonyGreedy(phylogeneticLinearHeuristic):
 
             # Add this tree to the path.
             self.path.append(cursor)
+            
+            # Only build the best neighbor if bounding.
+            if self.bound:
+                best = landscape.exploreBestParsimonyNeighbor(cursor['index'])
+                if (best != None): cursor = landscape.getNode(best)
+                else:
+                    self.bestTree = cursor
+                    break
+                continue
 
             # Explore the current tree and only score via parsimony.
             landscape.exploreTree(cursor['index'])
@@ -109,7 +123,7 @@ class likelihoodGreedy(phylogeneticLinearHeuristic):
     ''' Greedy (hill-climbing) landscape exploration by comparsion of
     likelihood. '''
     
-    def __init__(self,ls,startNode):
+    def __init__(self,ls,startNode,workers=1,search=False):
         
         ''' Initialize this heuristic.
 
@@ -117,10 +131,18 @@ class likelihoodGreedy(phylogeneticLinearHeuristic):
         :type ls: a :class:`.landscape.landscape` object
         :param startNode: what node to start with
         :type startNode: a node (dictionary) from the landscape (getNode())
+        :param workers: the number of processes scoring neighbors at once
+        :type workers: an integer
+        :param search: whether to find neighbors by a libpll rearrangement
+        search rather than enumerating them; ignored if libpll is not
+        available
+        :type search: a boolean
 
         '''
         
         super(likelihoodGreedy,self).__init__(ls,startNode)
+        self.workers = workers
+        self.search  = search and landscape.pllEnabled
         
     def explore(self):
     
@@ -143,14 +165,15 @@ class likelihoodGreedy(phylogeneticLinearHeuristic):
             self.path.append(cursor)
 
             # Explore the current tree and only score via parsimony.
-            landscape.exploreTree(cursor['index'])
+            if self.search: landscape.exploreTreeByLikelihood(cursor['index'])
+            else: landscape.exploreTree(cursor['index'])
             
             # Rank by likelihood.
             nodes = landscape.getNeighborsFor(cursor['index'])
             nodes = [landscape.getNode(x) for x in nodes]
             nodes = [it for it in nodes if not it in self.path]
-            map(lambda d: landscape.getVertex(d['index']).scoreLikelihood(),
-                nodes)
+            landscape.scoreLikelihoods([d['index'] for d in nodes],
+                                       workers=self.workers)
             nodes = sorted(nodes,key=lambda d: d['tree'].score[0])
             
             # Get best likelihood tree.
@@ -171,7 +194,7 @@ class smoothGreedy(phylogeneticLinearHeuristic):
     ''' Parsimony-driven greedy landscape exploration 
     by comparsion of likelihoods. '''
     
-    def __init__(self,ls,startNode):
+    def __init__(self,ls,startNode,screen=False):
         
         ''' Initialize this heuristic.
 
@@ -179,17 +202,22 @@ class smoothGreedy(phylogeneticLinearHeuristic):
         :type ls: a :class:`.landscape.landscape` object
         :param startNode: what node to start with
         :type startNode: a node (dictionary) from the landscape (getNode())
+        :param screen: whether to screen neighbors by a quick likelihood
+        (with inherited branch lengths) and only fully score the best few
+        :type screen: a boolean
 
         '''       
        
         super(smoothGreedy,self).__init__(ls,startNode)
+        self.screen = screen
         
     def explore(self):
     
         ''' Perform greedy search of the landscape using
         a method of greed via parsimonious criterion and then
         performing final smoothing via likelihood on top 10% of
-        1-SPR neighbors ranked on basis of parsimony.
+        1-SPR neighbors ranked on basis of parsimony (if screening, only
+        the best few of those by a quick likelihood).
         
         :return: None; landscape is modified
         
@@ -234,7 +262,14 @@ class smoothGreedy(phylogeneticLinearHeuristic):
                 # Check likelihood of some number of neighbors.
                 numtodo = max(SMGR_MIN_NUM_LIKELIHOOD,len(nodes)/10)
                 numtodo = min(numtodo,len(nodes))
-                for node in nodes[:numtodo]:                
+                todo    = nodes[:numtodo]
+                if self.screen:
+                    # Only fully score the best by a quick likelihood.
+                    landscape.scoreApproximateLikelihoods(
+                        [cursor['index']]+[d['index'] for d in todo])
+                    todo = sorted(todo,key=lambda d: d.get('approximate'),
+                                  reverse=True)[:SMGR_NUM_FINALISTS]
+                for node in todo:
                     # Get log-likelihood of this neighbor.
                     if (node['tree'].score[0] == None):
                         ml = ll(node['tree'],ali)
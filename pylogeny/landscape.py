@@ -19,10 +19,21 @@ import networkx
 import tree
 import alignment
 import base
+import os
+import multiprocessing
+from time import time
 from random import choice
+from Queue import Empty
+from pll import getPartitionModel, getInstanceAttributes, \
+     setInstanceAttributes, instanceAttributes, getInstancePool, pllEnabled
 from scoring import getParsimonyFromProfiles as parsimony, getLogLikelihood as\
-     ll
+     ll, getParsimonyForRearrangements as moveParsimonies, \
+     getWeightedParsimonyFromProfiles as weightedParsimony, \
+     getWeightedParsimonyFromProfilesForAll as weightedParsimonies, \
+     getBestRearrangement as bestMove, \
+     getParsimonyStepsFromProfilesForAll as allSteps, LIKELIHOOD_QUICK
 from parsimony import profile_set as profiles
+from cache import getParsimonyCache
 from networkx import components as comp, algorithms as alg
 from base import patriciaTree
 from tree import treeSet, numberRootedTrees, numberUnrootedTrees
@@ -31,6 +42,37 @@ from rearrangement import TYPE_NNI, TYPE_SPR, TYPE_TBR
 postOrderTraversal = base.treeStructure.postOrderTraversal
 
 LS_NOT_DEFINED = -1
+LS_POLL_INTERVAL = 0.5
+
+# Parallel Likelihood Scoring
+
+_workerAlignment, _workerStarted = None, None
+
+def _initLikelihoodWorker(ali,started,threads):
+    
+    ''' PRIVATE: Set up a worker process for scoring log-likelihood. It keeps
+    its own copy of the alignment and builds its own libpll instances, using
+    at most a given number of threads. '''
+    
+    global _workerAlignment, _workerStarted
+    if hasattr(ali,'_pllpool'): del ali._pllpool
+    attribs = getInstanceAttributes(ali)
+    setInstanceAttributes(ali,instanceAttributes(
+        min(attribs.threads,threads),attribs.gamma,attribs.fastScaling,
+        attribs.saveMemory))
+    _workerAlignment, _workerStarted = ali, started
+    
+def _scoreLikelihoodsInWorker(items):
+    
+    ''' PRIVATE: Score log-likelihood of a chunk of trees in a worker process;
+    reports when it started on each tree. '''
+    
+    scores = list()
+    for i,newick in items:
+        _workerStarted.put((os.getpid(),i,time()))
+        t = tree.tree(newick)
+        scores.append((i,ll(t,_workerAlignment),t.getNewick()))
+    return scores
 
 # Graph Object
 
@@ -302,7 +344,8 @@ class landscape(graph,treeSet):
     
     ''' Defines an entire phylogenetic tree space. '''
     
-    def __init__(self,ali,starting_tree=None,root=True,operator='SPR'):
+    def __init__(self,ali,starting_tree=None,root=True,operator='SPR',
+                 stepmatrix=None):
         
         ''' Initialize the landscape.
 
@@ -317,6 +360,9 @@ class landscape(graph,treeSet):
         :param operator: a string that describes what operator the\
         landscape is mostly comprised of.
         :type operator: a string
+        :param stepmatrix: an optional step matrix to score parsimony of all\
+        trees by weighted (Sankoff) parsimony (see setStepMatrix).
+        :type stepmatrix: a :class:`.parsimony.stepMatrix` object
         
         '''        
         
@@ -331,6 +377,10 @@ class landscape(graph,treeSet):
         self.operator           = operator
         self.parsimony_profiles = None
         self.newickSearchDict   = dict()
+        self.threads            = 1
+        self.stepmatrix         = None
+        self.sankoff_profiles   = None
+        self.cache              = getParsimonyCache(ali)
         
         # Analyze alignment.
         if ali:
@@ -338,6 +388,9 @@ class landscape(graph,treeSet):
             self.leaves = ali.getNumSeqs()
             # Get parsimony profile.
             self.parsimony_profiles = profiles(ali)           
+        
+        # Set up weighted parsimony before any tree is scored.
+        self.setStepMatrix(stepmatrix)
                 
         # Set up the root.
         if root:
@@ -351,8 +404,11 @@ class landscape(graph,treeSet):
             topol = tre.toTopology()
             new   = topol.toNewick()
             if not (tre.score):
-                sc = parsimony(new,p)
+                sc = self._scoreParsimony(new)
                 tre.score = (None,sc)            
+            elif self.stepmatrix:
+                sc = self._scoreParsimony(new)
+                tre.score = (tre.score[0],sc)
         
     def getAlignment(self): 
         
@@ -440,6 +496,7 @@ class landscape(graph,treeSet):
         self.alignment          = ali
         self.leaves             = ali.getNumSeqs()
         self.parsimony_profiles = profiles(ali)
+        if self.stepmatrix: self.sankoff_profiles = profiles(ali,recode=False)
         
     def setOperator(self,op):
         
@@ -451,6 +508,108 @@ class landscape(graph,treeSet):
         '''
         
         self.operator = op
+        
+    def setThreads(self,num):
+        
+        ''' Set the number of native threads used to score parsimony of many
+        trees at once (e.g., when exploring a tree).
+        
+        :param num: a number of threads
+        :type num: an integer
+        
+        '''
+        
+        self.threads = num
+        
+    def setStepMatrix(self,matrix):
+        
+        ''' Set a step matrix such that parsimony of trees in this landscape
+        is scored by weighted (Sankoff) parsimony rather than Fitch
+        parsimony; None reverts to the latter. Trees already given a
+        parsimony score are rescored so all scores stay comparable.
+        
+        :param matrix: a step matrix or None
+        :type matrix: a :class:`.parsimony.stepMatrix` object
+        
+        '''
+        
+        self.stepmatrix = matrix
+        if matrix and self.alignment:
+            self.sankoff_profiles = profiles(self.alignment,recode=False)
+        if not self.alignment: return
+        
+        # Rescore trees scored otherwise.
+        for i in self.iterNodes():
+            tre = self.getTree(i)
+            if tre.score and tre.score[1] != None:
+                tre.score = (tre.score[0],self._scoreParsimony(
+                    tre.getNewick(),tre.getStructure()))
+            
+    def setCache(self,cache):
+        
+        ''' Set the cache parsimony scores of trees are looked up in before
+        being computed and stored in after; by default, one kept with the
+        alignment unless the cache module was given one shared by all
+        landscapes (see getParsimonyCache). None disables caching.
+        
+        :param cache: a score cache or None
+        :type cache: a :class:`.cache.scoreCache` object
+        
+        '''
+        
+        self.cache = cache
+            
+    def _getCacheKey(self):
+        
+        ''' PRIVATE: Get a fingerprint of what parsimony is scored against. '''
+        
+        if self.stepmatrix:
+            return 'sankoff:%s:%s' % (self.sankoff_profiles.getFingerprint(),
+                                      self.stepmatrix.getFingerprint())
+        return 'fitch:%s' % (self.parsimony_profiles.getFingerprint())
+            
+    def _scoreParsimony(self,newick,struct=None):
+        
+        ''' PRIVATE: Score parsimony of a tree given by Newick string; its
+        structure, if given, is used to look up and store the score. '''
+        
+        if self.cache != None and struct:
+            key = self._getCacheKey()
+            scr = self.cache.get(key,struct)
+            if scr != None: return scr
+        if self.stepmatrix:
+            scr = weightedParsimony(newick,self.sankoff_profiles,
+                                    self.stepmatrix)
+        else: scr = parsimony(newick,self.parsimony_profiles)
+        if self.cache != None and struct: self.cache.set(key,struct,scr)
+        return scr
+    
+    def _scoreParsimonyOfMoves(self,moves,trees):
+        
+        ''' PRIVATE: Score parsimony of the trees resulting from a list of
+        rearrangements; trees are the corresponding tree objects. Only trees
+        not found in the cache are scored. '''
+        
+        # Look up all trees first.
+        structs = [t.getStructure() for t in trees]
+        if self.cache != None:
+            key    = self._getCacheKey()
+            scores = self.cache.getMany(key,structs)
+        else: scores = [None for _ in trees]
+        todo = [x for x in xrange(len(trees)) if scores[x] == None]
+        if not todo: return scores
+        
+        # Score the rest.
+        if self.stepmatrix:
+            new = weightedParsimonies([trees[x].getNewick() for x in todo],
+                                      self.sankoff_profiles,self.stepmatrix,
+                                      self.threads)
+        else: new = moveParsimonies([moves[x] for x in todo],
+                                    self.parsimony_profiles,self.threads)
+        for x,scr in zip(todo,new): scores[x] = scr
+        if self.cache != None:
+            self.cache.setMany(key,[structs[x] for x in todo],new)
+        return scores
     
     # Node Management
                 
@@ -480,6 +639,7 @@ class landscape(graph,treeSet):
         node['explored'] = False
         node['tree']     = tobj
         node['failed']   = False
+        node['approximate'] = None
         
         # Preliminary scoring.
         if score:
@@ -487,15 +647,15 @@ class landscape(graph,treeSet):
                 # Get the parsimony since this is fast; set likelihood
                 # to nothing.
                 if self.alignment:
-                    tobj.score = (None,parsimony(
-                        tobj.newick,self.parsimony_profiles))
+                    tobj.score = (None,self._scoreParsimony(tobj.newick,
+                                                            structure))
                 else: tobj.score = (None,None)
             elif tobj.score[1] == None:
                 # Get the parsimony since this is fast; set likelihood
                 # to nothing.
                 if self.alignment:
-                    tobj.score = (tobj.score[0],parsimony(
-                        tobj.newick,self.parsimony_profiles))  
+                    tobj.score = (tobj.score[0],self._scoreParsimony(
+                        tobj.newick,structure))
         
         # Return the index.
         return i
@@ -622,9 +782,6 @@ class landscape(graph,treeSet):
         
         '''
         
-        # Get parsimony profiles.
-        p = self.parsimony_profiles
-        
         # Check node.
         node  = self.getNode(i)
         if (node['explored']): return None
@@ -645,8 +802,10 @@ class landscape(graph,treeSet):
             
             bra  = choice(branches)
             branches.remove(bra)
-            enum = topol.iterTypeForBranch(bra,type) # Iterate over each.
-        
+            if (type == TYPE_TBR): # Sample moves in a random order.
+                enum = topol.iterTBRForBranch(bra,shuffle=True)
+            else: enum = topol.iterTypeForBranch(bra,type) # Iterate over each.
+
             for en in enum:
                 
                 # Get metadata.
@@ -666,12 +825,10 @@ class landscape(graph,treeSet):
                     continue
     
                 # See if tree violating existing locks.
-                if isvi:
-                    en = en.toTopology()
-                    if self._isViolating(en): continue
+                if isvi and self._isViolating(en.toTopology()): continue
     
-                # Score.
-                scr = parsimony(new,p)
+                # Score by rescoring only what the move changes.
+                scr = self._scoreParsimonyOfMoves([en],[t])[0]
                 t.score  = (None,scr)
                 t.origin = typ
                 
@@ -700,9 +857,6 @@ class landscape(graph,treeSet):
         
         '''
         
-        # Get parsimony profiles.
-        p = self.parsimony_profiles
-        
         # Check node.
         node  = self.getNode(i)
         if (node['explored']): return list()
@@ -717,9 +871,13 @@ class landscape(graph,treeSet):
                 hasthis = topol.getBranchFromBipartition(lock)
                 if (hasthis): topol.lockBranch(hasthis)
         
-        # Perform full-enumeration exploration (1 move).
+        # Perform full-enumeration exploration (1 move). Without locks, every
+        # distinct neighbor is enumerated once; flipping the tree around can
+        # otherwise reach neighbors that only moving a locked subtree gives.
         neighbors = list()        
-        enum = topol.allType(type)
+        unique = not (hasattr(self,'locks') and self.locks)
+        enum = topol.allType(type,unique)
+        found, moves = set(), list()
         
         for en in enum:
             
@@ -729,6 +887,7 @@ class landscape(graph,treeSet):
             new = t.getNewick()
 
             # See if already been found.
+            if t.getStructure() in found: continue
             inlandscape = self.findTreeTopologyByStructure(t.getStructure())
             if (inlandscape != None):
                 # Is in landscape; has connection to tree?
@@ -740,14 +899,16 @@ class landscape(graph,treeSet):
                 continue
 
             # See if tree violating existing locks.
-            if isvi:
-                en = en.toTopology()
-                if self._isViolating(en): continue
-
-            # Score.
-            scr = parsimony(new,p)
-            t.score  = (None,scr)
+            if isvi and self._isViolating(en.toTopology()): continue
+            found.add(t.getStructure())
             t.origin = typ
+            moves.append((en,t))
+
+        # Score all at once by rescoring only what each move changes.
+        scores = self._scoreParsimonyOfMoves([en for en,_ in moves],
+                                             [t for _,t in moves])
+        for (en,t),scr in zip(moves,scores):
+            t.score = (None,scr)
             
             # Add to landscape.
             j = self._newNode(t,score=True)
@@ -760,6 +921,275 @@ class landscape(graph,treeSet):
         
         return neighbors
 
+    def exploreTreeByLikelihood(self,i,type=TYPE_SPR,radius=1):
+        
+        ''' Get all neighbors to a tree named i in the landscape from a single
+        rearrangement search by libpll rather than enumerating and scoring
+        rearrangements here. Neighbors are added in bulk with the approximate
+        log-likelihood libpll found for each (see getApproximateLikelihood of
+        a vertex); duplicates are only added once. Rearrangement type is
+        TYPE_SPR, TYPE_NNI, or None for both. Raises a SystemError if libpll
+        is not available; use exploreTree in that case.
+        
+        :param i: a tree index
+        :param type: the type of rearrangement (e.g., TYPE_SPR, TYPE_NNI)
+        :param radius: the maximum distance a subtree is moved
+        :type radius: an integer
+        :return: a list of neighbors as tree names (usually integers)
+        
+        '''
+        
+        # Check node and libpll.
+        node  = self.getNode(i)
+        if (node['explored']): return list()
+        if not pllEnabled:
+            raise SystemError('libpll is not installed on your system; ' +
+                              'cannot search for neighbors by likelihood.')
+        topol = node['tree'].toTopology()
+        
+        # Perform a single search.
+        pool  = getInstancePool(self.alignment)
+        data  = pool.acquire(topol)
+        try: moves = data.getRearrangements(type,radius)
+        except:
+            data.close()
+            raise
+        pool.release(data)
+        
+        # Add all neighbors at once.
+        neighbors, found = list(), dict()
+        for typ,approx,newick in moves:
+            t = tree.tree(newick,check=True)
+            struct = t.getStructure()
+            if struct in found:
+                # Keep the best approximation of a duplicate.
+                j = found[struct]
+                if j != None and approx > self.getNode(j)['approximate']:
+                    self.getNode(j)['approximate'] = approx
+                continue
+            found[struct] = None
+            inlandscape = self.findTreeTopologyByStructure(struct)
+            if (inlandscape != None):
+                # Is in landscape; has connection to tree?
+                if ((inlandscape != i) and self.graph.has_node(inlandscape)): 
+                    if not self.graph.has_edge(inlandscape,i):
+                        self.graph.add_edge(inlandscape,i)
+                        self.getEdge(inlandscape,i)['weight'] = \
+                            self.defaultWeight
+                continue
+            if self.locks and self._isViolating(t.toTopology()): continue
+            t.origin = typ
+            j = self._newNode(t,score=True)
+            self.getNode(j)['approximate'] = approx
+            found[struct] = j
+            neighbors.append(j)
+            self.graph.add_edge(i,j)
+            self.getEdge(i,j)['weight'] = self.defaultWeight
+        
+        # Set explored to True.
+        node['explored'] = True
+        
+        return neighbors
+
+    def exploreBestParsimonyNeighbor(self,i,type=TYPE_SPR):
+        
+        ''' Get the neighbor of least parsimony to a tree named i in the
+        landscape if it improves upon that tree. Unlike exploreTree, neighbors
+        are bounded on their parsimony before being scored and only the best
+        one is built and added to the landscape; neighbors that cannot improve
+        upon it are discarded without constructing them. Rearrangement type
+        is provided as for exploreTree.
+        
+        :param i: a tree index
+        :param type: the type of rearrangement (e.g., TYPE_SPR, TYPE_NNI)
+        :return: a tree name (usually an integer) or None if no better tree
+        
+        '''
+        
+        # Check node.
+        node  = self.getNode(i)
+        tre   = node['tree']
+        topol = tre.toTopology()
+        
+        # Bounds only hold for unweighted parsimony of permitted moves.
+        if self.stepmatrix or self._isViolating(topol):
+            self.exploreTree(i,type)
+            pars  = lambda d: self.getNode(d)['tree'].score[1]
+            near  = [x for x in self.graph.neighbors(i) if pars(x) < pars(i)]
+            if (len(near) == 0): return None
+            return min(near,key=pars)
+        
+        # Check for locks.
+        if hasattr(self,'locks'):
+            for lock in self.locks:
+                hasthis = topol.getBranchFromBipartition(lock)
+                if (hasthis): topol.lockBranch(hasthis)
+        
+        # Find best move by branch and bound; only build that tree.
+        en,scr = bestMove(topol.allType(type),self.parsimony_profiles,
+                          tre.score[1],self.threads)
+        if (en == None): return None
+        t = en.toTree()
+        j = self.findTreeTopologyByStructure(t.getStructure())
+        if (j == None):
+            t.origin = en.getType()
+            t.score  = (None,scr)
+            if self.cache != None:
+                self.cache.set(self._getCacheKey(),t.getStructure(),scr)
+            j = self._newNode(t,score=True)
+        if not self.graph.has_edge(i,j):
+            self.graph.add_edge(i,j)
+            self.getEdge(i,j)['weight'] = self.defaultWeight
+        return j
+
+    def getParsimonySteps(self,nodes=None,sites=False):
+        
+        ''' Get the (Fitch) parsimony steps every site pattern incurs on trees
+        in the landscape in a single call, e.g., to find what sites drive
+        differences between local optima. Steps are not weighted by how many
+        sites share a pattern unless expanded to every site.
+        
+        :param nodes: a list of tree names; by default, all trees
+        :param sites: whether to expand patterns to every site
+        :type sites: a boolean
+        :return: a numpy array with a row for every tree
+        
+        '''
+        
+        if nodes == None: nodes = self.getNodeNames()
+        newicks = [self.getTree(i).getNewick() for i in nodes]
+        steps   = allSteps(newicks,self.parsimony_profiles,self.threads)
+        if sites: return self.parsimony_profiles.toSites(steps)
+        return steps
+        
+    def _setLikelihood(self,i,l,newick=None):
+        
+        ''' PRIVATE: Set the log-likelihood of a tree, alongside its Newick
+        string with updated branch lengths; None marks it as failed. '''
+        
+        node = self.getNode(i)
+        tre  = node['tree']
+        pars = tre.score[1] if tre.score else None
+        if l == None:
+            node['failed'] = True
+            return
+        tre.score = (l,pars)
+        if newick and newick != tre.getNewick():
+            try: tre.updateNewick(newick,reroot=True)
+            except ValueError: pass
+    
+    def scoreLikelihoods(self,nodes=None,workers=None,chunksize=1,
+                         timeout=None):
+        
+        ''' Score log-likelihood of many trees in the landscape in parallel.
+        Trees are scored across worker processes that each hold their own
+        libpll instances and copy of the alignment; scores are written to
+        trees as they arrive. A tree that cannot be scored, or takes longer
+        than a timeout to be, is marked as failed instead.
+        
+        :param nodes: a list of tree names; by default, all trees
+        :param workers: the number of worker processes; by default, the number
+        of processors. With a single worker, trees are scored in this process.
+        :type workers: an integer
+        :param chunksize: the number of trees handed to a worker at once
+        :type chunksize: an integer
+        :param timeout: seconds a tree may take to be scored (None is forever);
+        only applies to worker processes
+        :type timeout: a float
+        :return: a dictionary of tree names to log-likelihoods (None if failed)
+        
+        '''
+        
+        if nodes == None: nodes = self.getNodeNames()
+        scr  = lambda i: self.getTree(i).getScore()
+        todo = [i for i in nodes if not self.getNode(i).get('failed') and 
+                (scr(i) == None or scr(i)[0] == None)]
+        if workers == None: workers = multiprocessing.cpu_count()
+        
+        # Score in this process.
+        if workers <= 1:
+            for i in todo: self._setLikelihood(i,ll(self.getTree(i),
+                                                    self.alignment))
+            todo = list()
+        
+        # Temporary files are made before workers are so that they are shared.
+        ali = self.alignment
+        if todo:
+            ali.getPhylip()
+            getPartitionModel(ali)
+        
+        while todo:
+            
+            # Start workers, sharing processors between their libpll threads;
+            # they report when each tree is started.
+            started = multiprocessing.Queue()
+            threads = max(1,multiprocessing.cpu_count()/workers)
+            pool    = multiprocessing.Pool(workers,_initLikelihoodWorker,
+                                           (ali,started,threads))
+            items   = [(i,self.getTree(i).getNewick()) for i in todo]
+            chunks  = [items[x:x+chunksize] for x in xrange(
+                0,len(items),chunksize)]
+            results = pool.imap_unordered(_scoreLikelihoodsInWorker,chunks)
+            pending, current, stalled = set(todo), dict(), list()
+            
+            # Collect results as they arrive; look for stalled trees.
+            while pending and not stalled:
+                try:
+                    if timeout == None: scores = results.next()
+                    else: scores = results.next(LS_POLL_INTERVAL)
+                    for i,l,new in scores:
+                        self._setLikelihood(i,l,new)
+                        pending.discard(i)
+                except multiprocessing.TimeoutError: pass
+                except StopIteration: break
+                if timeout == None: continue
+                try:
+                    while True:
+                        pid,i,at = started.get_nowait()
+                        current[pid] = (i,at)
+                except Empty: pass
+                now = time()
+                stalled = [i for i,at in current.values() if i in pending
+                           and now-at > timeout]
+            
+            # Stalled trees have failed; restart workers for the rest.
+            if stalled: pool.terminate()
+            else: pool.close()
+            pool.join()
+            for i in stalled:
+                self._setLikelihood(i,None)
+                pending.discard(i)
+            todo = [i for i in todo if i in pending]
+        
+        return dict((i,None if self.getNode(i).get('failed') else scr(i)[0])
+                    for i in nodes)
+
+    def scoreApproximateLikelihoods(self,nodes=None,level=LIKELIHOOD_QUICK):
+        
+        ''' Cheaply approximate log-likelihood of many trees in the landscape
+        in this process, e.g., to screen neighbors of a tree and only score
+        the most promising ones fully (see scoreLikelihoods). Trees keep their
+        scores and branch lengths; approximations are kept alongside them (see
+        getApproximateLikelihood of a vertex). Subtrees trees share, such as
+        those of a tree and its neighbors, are only scored once.
+        
+        :param nodes: a list of tree names; by default, all trees
+        :param level: LIKELIHOOD_QUICK to take branch lengths as they are
+        (neighbors inherit them from the tree they were found from), or
+        LIKELIHOOD_LOCAL to also optimize those around subtrees that were
+        not scored before (see the scoring module)
+        :return: a dictionary of tree names to approximate log-likelihoods
+        (None if they could not be scored)
+        
+        '''
+        
+        if nodes == None: nodes = self.getNodeNames()
+        scores = dict()
+        for i in nodes:
+            scores[i] = ll(self.getTree(i),self.alignment,False,level=level)
+            if scores[i] != None: self.getNode(i)['approximate'] = scores[i]
+        return scores
+        
     # Lock Management
         
     def getLocks(self):
@@ -1265,6 +1695,19 @@ class vertex(object):
         
         return self.obj['explored']
     
+    def getApproximateLikelihood(self):
+        
+        ''' Get the log-likelihood approximated for this tree, if it was;
+        either by libpll when it was found by a rearrangement search or
+        without fully optimizing its branch lengths (see
+        scoreApproximateLikelihoods of a landscape).
+        
+        :return: a floating point value or None
+        
+        '''
+        
+        return self.obj.get('approximate')
+    
     def isFailed(self):
         
         ''' Determine if any errors are associated with this node.
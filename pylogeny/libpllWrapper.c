@@ -26,6 +26,7 @@ static PyObject * phylo_init(PyObject *self, PyObject *args);
 static PyObject * phylo_del(PyObject *self, PyObject *args);
 static PyObject * phylo_getml(PyObject *self, PyObject *args);
 static PyObject * phylo_getnewick(PyObject *self, PyObject *args);
+static PyObject * phylo_settopology(PyObject *self, PyObject *args);
 static PyObject * phylo_getspr_withindist(PyObject *self, PyObject *args);
 static PyObject * phylo_getnni_withindist(PyObject *self, PyObject *args);
 static PyObject * phylo_getall_withindist(PyObject *self, PyObject *args);
@@ -101,9 +102,14 @@ static PyObject * phylo_init(PyObject *self, PyObject *args) {
                *newick,
                *partf;
    problem_t   *problem;
-
-   // Parse arguments.
-   if (!PyArg_ParseTuple(args,"sss",&alignf,&newick,&partf)) {
+   int          threads     = 8,
+                gamma       = 1,
+                fastScaling = 0,
+                saveMemory  = 0;
+
+   // Parse arguments; instance attributes are optional.
+   if (!PyArg_ParseTuple(args,"sss|iiii",&alignf,&newick,&partf,&threads,
+                         &gamma,&fastScaling,&saveMemory)) {
       PyErr_SetString(PyExc_IOError,"Need alignment file, newick string, partition file as strings.");
       return NULL;
    }
@@ -124,12 +130,12 @@ static PyObject * phylo_init(PyObject *self, PyObject *args) {
    }
       
    // Set attributes.
-   attr->rateHetModel     =  PLL_GAMMA;
-   attr->fastScaling      =  PLL_FALSE;
-   attr->saveMemory       =  PLL_FALSE;
+   attr->rateHetModel     = gamma ? PLL_GAMMA : PLL_CAT;
+   attr->fastScaling      = fastScaling ? PLL_TRUE : PLL_FALSE;
+   attr->saveMemory       = saveMemory ? PLL_TRUE : PLL_FALSE;
    attr->useRecom         =  PLL_FALSE;
    attr->randomNumberSeed = 0xFACEFACE;
-   attr->numberOfThreads  =          8;
+   attr->numberOfThreads  = threads;
 
    // Create new problem instance.
    problem->instance = pllCreateInstance(attr);
@@ -238,6 +244,42 @@ static PyObject * phylo_getnewick(PyObject *self, PyObject *args) {
    
 }
 
+static PyObject * phylo_settopology(PyObject *self, PyObject *args) {
+
+   // Get pointer, Newick string.
+   PyObject *p; const char *newick; problem_t *pp; pllNewickTree *tree;
+   if (!PyArg_ParseTuple(args,"Os",&p,&newick) || !PyCObject_Check(p)) {
+      PyErr_SetString(PyExc_ReferenceError,"Could not parse pointer, string.");
+      return NULL;
+   } pp = (problem_t*)PyCObject_AsVoidPtr(p);
+
+   // Parse the tree; keep the current one if it cannot be.
+   tree = pllNewickParseString(newick);
+   if (!tree) {
+      PyErr_SetString(PyExc_IOError,"Tree was not able to be parsed.");
+      return NULL;
+   }
+
+   // Moves found for the current tree no longer apply.
+   if (pp->arrangelist) pllDestroyRearrangeList(&(pp->arrangelist));
+   pp->arrangelist = NULL;
+
+   // Swap in the new topology; alignment and partitions are kept (tips are
+   // matched to sequences by name). Branch lengths are reset to defaults.
+   pllNewickParseDestroy(&(pp->tree));
+   pp->tree = tree;
+   pllTreeInitTopologyNewick(pp->instance,tree,PLL_TRUE);
+
+   // Restart model as when initialized; nothing from the last tree carries.
+   pllInitModel(pp->instance,pp->partitions);
+   pllEvaluateLikelihood(pp->instance,pp->partitions,pp->instance->start,
+                         PLL_TRUE,PLL_FALSE);
+
+   // Return None.
+   return Py_BuildValue("");
+
+}
+
 static PyObject * phylo_getspr_withindist(PyObject *self, PyObject *args) {
 
    // Get pointer, radius to go to.
@@ -322,7 +364,7 @@ static PyObject * phylo_getall_withindist(PyObject *self, PyObject *args) {
 
 static PyMethodDef modulemethods[] = {
    {"new", phylo_init, METH_VARARGS,
-   "Initialize a problem with an alignment, Newick tree, and partition model."},
+   "Initialize a problem with an alignment, Newick tree, and partition model; optionally, a number of threads and whether to use gamma rate heterogeneity (otherwise CAT), fast scaling and memory saving."},
    {"destroy", phylo_del, METH_VARARGS,
    "Destroy an input problem and deallocate all resources."},
    {"getLogLikelihood", phylo_getml, METH_VARARGS,
@@ -335,6 +377,8 @@ static PyMethodDef modulemethods[] = {
    "Get all moves within a maximum distance from a leaf of current given tree instance."},
    {"getNewickString", phylo_getnewick, METH_VARARGS,
    "Get the Newick string for the current initialized problem."},
+   {"setTopology", phylo_settopology, METH_VARARGS,
+   "Replace the tree of an initialized problem by a Newick tree, keeping its alignment and partitions; branch lengths and model are reset as for a new problem."},
    {NULL, NULL, 0, NULL}
 };
 
@@ -0,0 +1,743 @@
+''' Score phylogenetic trees by log-likelihood in-process by Felsenstein's
+pruning algorithm, vectorized with numpy over compressed site patterns and
+rate categories. Needs neither libpll nor BEAGLE; serves as a scorer where
+neither is built and as a reference to check the native path against. '''
+
+# Imports
+
+import numpy
+from math import exp, log, lgamma
+from hashlib import sha1
+from parsimony import DNA_STATES, AMINO_ACID_STATES
+from newick import newickParser
+from cache import scoreCache
+
+# Constants
+
+LIKELIHOOD_GAMMA_CATEGORIES = 4
+LIKELIHOOD_DEFAULT_LENGTH   = 0.1
+LIKELIHOOD_MIN_LENGTH       = 1e-4 # Shortest str() keeps in fixed-point.
+LIKELIHOOD_MAX_LENGTH       = 10.
+LIKELIHOOD_MIN_FREQUENCY    = 1e-6
+LIKELIHOOD_ROUNDS           = 16
+LIKELIHOOD_EPSILON          = 1e-3
+LIKELIHOOD_TOLERANCE        = 1e-6
+LIKELIHOOD_PRECISION        = 8 # Decimals of branch lengths in Newick strings.
+LIKELIHOOD_CACHE_BYTES      = 256*1024*1024
+
+DNA_AMBIGUITY = {'U':'T','R':'AG','Y':'CT','S':'CG','W':'AT','K':'GT',
+                 'M':'AC','B':'CGT','D':'AGT','H':'ACT','V':'ACG'}
+AMINO_ACID_AMBIGUITY = {'B':'ND','Z':'QE','J':'IL'}
+
+# Empirical amino acid model of Whelan and Goldman (2001); exchangeabilities
+# are given as a lower triangle with states in the order of AMINO_ACID_STATES.
+
+WAG_EXCHANGEABILITIES = '''
+0.551571
+0.509848 0.635346
+0.738998 0.147304 5.42942
+1.02704 0.528191 0.265256 0.0302949
+0.908598 3.0355 1.54364 0.616783 0.0988179
+1.58285 0.439157 0.947198 6.17416 0.021352 5.46947
+1.41672 0.584665 1.12556 0.865584 0.306674 0.330052 0.567717
+0.316954 2.13715 3.95629 0.930676 0.248972 4.29411 0.570025 0.24941
+0.193335 0.186979 0.554236 0.039437 0.170135 0.113917 0.127395 0.0304501
+0.13819
+0.397915 0.497671 0.131528 0.0848047 0.384287 0.869489 0.154263 0.0613037
+0.499462 3.17097
+0.906265 5.35142 3.01201 0.479855 0.0740339 3.8949 2.58443 0.373558 0.890432
+0.323832 0.257555
+0.893496 0.683162 0.198221 0.103754 0.390482 1.54526 0.315124 0.1741 0.404141
+4.25746 4.85402 0.934276
+0.210494 0.102711 0.0961621 0.0467304 0.39802 0.0999208 0.0811339 0.049931
+0.679371 1.05947 2.11517 0.088836 1.19063
+1.43855 0.679489 0.195081 0.423984 0.109404 0.933372 0.682355 0.24357 0.696198
+0.0999288 0.415844 0.556896 0.171329 0.161444
+3.37079 1.22419 3.97423 1.07176 1.40766 1.02887 0.704939 1.34182 0.740169
+0.31944 0.344739 0.96713 0.493905 0.545931 1.61328
+2.12111 0.554413 2.03006 0.374866 0.512984 0.857928 0.822765 0.225833 0.473307
+1.45816 0.326622 1.38698 1.51612 0.171903 0.795384 4.37802
+0.113133 1.16392 0.0719167 0.129767 0.71707 0.215737 0.156557 0.336983
+0.262569 0.212483 0.665309 0.137505 0.515706 1.52964 0.139405 0.523742
+0.110864
+0.240735 0.381533 1.086 0.325711 0.543833 0.22771 0.196303 0.103604 3.87344
+0.42017 0.398618 0.133264 0.428437 6.45428 0.216046 0.786993 0.291148 2.48539
+2.00601 0.251849 0.196246 0.152335 1.00214 0.301281 0.588731 0.187247 0.118358
+7.8213 1.80034 0.305434 2.05845 0.649892 0.314887 0.232739 1.38823 0.365369
+0.31473'''
+
+WAG_FREQUENCIES = [0.0866279,0.0439720,0.0390894,0.0570451,0.0193078,
+                   0.0367281,0.0580589,0.0832518,0.0244313,0.0484660,
+                   0.0862090,0.0620286,0.0195027,0.0384319,0.0457631,
+                   0.0695179,0.0610127,0.0143859,0.0352742,0.0708956]
+
+# Rate Heterogeneity
+
+def _incompleteGamma(a,x):
+
+    ''' PRIVATE: Regularized lower incomplete gamma function P(a,x); by its
+    series for small x and by its continued fraction otherwise. '''
+
+    if x <= 0.: return 0.
+    front = exp(a*log(x)-x-lgamma(a))
+    if x < a+1.:
+        term = total = 1./a
+        n = a
+        while abs(term) > abs(total)*1e-15:
+            n += 1.
+            term *= x/n
+            total += term
+        return total*front
+    b = x+1.-a
+    c = 1e300
+    d = h = 1./b
+    for i in xrange(1,1000):
+        an = -i*(i-a)
+        b += 2.
+        d  = an*d+b
+        c  = b+an/c
+        d  = 1./(d if abs(d) > 1e-300 else 1e-300)
+        c  = c if abs(c) > 1e-300 else 1e-300
+        h *= d*c
+        if abs(d*c-1.) < 1e-15: break
+    return 1.-front*h
+
+def discreteGamma(alpha,categories=LIKELIHOOD_GAMMA_CATEGORIES):
+
+    ''' Acquire rates for categories of equal probability approximating a gamma
+    distribution of rates with mean one, each rate being the mean of its
+    category (Yang, 1994).
+
+    :param alpha: the shape parameter of the gamma distribution
+    :type alpha: a floating point value
+    :param categories: the number of categories
+    :type categories: an integer
+    :return: a numpy array of floating point values
+
+    '''
+
+    if alpha <= 0.: raise ValueError('Gamma shape must be positive.')
+
+    # Find cut points between categories by bisection on the distribution.
+    cuts = [0.]
+    for i in xrange(1,categories):
+        p, lo, hi = float(i)/categories, 0., alpha
+        while _incompleteGamma(alpha,hi) < p: hi *= 2.
+        for _ in xrange(200):
+            mid = (lo+hi)/2.
+            if _incompleteGamma(alpha,mid) < p: lo = mid
+            else: hi = mid
+        cuts.append((lo+hi)/2.)
+
+    # Mean of every category; sums to one over all of them.
+    below = [_incompleteGamma(alpha+1.,c) for c in cuts] + [1.]
+    rates = numpy.diff(below)*categories
+    return rates/rates.mean()
+
+# Substitution Models
+
+class substitutionModel(object):
+
+    ''' A time-reversible model of character substitution: exchangeabilities
+    between states, their equilibrium frequencies and, optionally, gamma-
+    distributed rates across sites. The rate matrix is normalized to one
+    expected substitution per unit time and decomposed once such that
+    transition probabilities for any number of branch lengths come from a
+    single batched product. '''
+
+    def __init__(self,states,exchangeabilities,frequencies=None,alpha=None,
+                 categories=LIKELIHOOD_GAMMA_CATEGORIES,name=''):
+
+        ''' Initialize this model.
+
+        :param states: the character states
+        :type states: a string
+        :param exchangeabilities: a symmetric matrix of exchangeabilities
+        between states (the diagonal is ignored)
+        :type exchangeabilities: a list of lists of numbers
+        :param frequencies: equilibrium state frequencies; equal by default
+        :type frequencies: a list of numbers
+        :param alpha: a shape for gamma-distributed rates; none by default
+        :type alpha: a floating point value
+        :param categories: the number of gamma rate categories
+        :type categories: an integer
+        :param name: an optional name for this model (e.g., 'HKY85')
+        :type name: a string
+
+        '''
+
+        num = len(states)
+        if frequencies is None: frequencies = [1.]*num
+        self.states = states
+        self.name   = name
+        self.alpha  = alpha
+        self.exchangeabilities = numpy.array(exchangeabilities,dtype=float)
+        self.frequencies = numpy.array(frequencies,dtype=float)
+        if self.exchangeabilities.shape != (num,num) or \
+           len(self.frequencies) != num:
+            raise ValueError('Model must have parameters for every state.')
+        if (self.exchangeabilities < 0).any() or \
+           (self.frequencies < 0).any():
+            raise ValueError('Model parameters must not be negative.')
+        self.frequencies = numpy.maximum(self.frequencies,
+                                         LIKELIHOOD_MIN_FREQUENCY)
+        self.frequencies /= self.frequencies.sum()
+        if alpha: self.rates = discreteGamma(alpha,categories)
+        else:     self.rates = numpy.ones(1)
+        self._decompose()
+
+    def _decompose(self):
+
+        ''' PRIVATE: Build the normalized rate matrix and decompose it. Being
+        reversible, it is similar to a symmetric matrix. '''
+
+        pi = self.frequencies
+        Q  = self.exchangeabilities*pi[None,:]
+        numpy.fill_diagonal(Q,0.)
+        numpy.fill_diagonal(Q,-Q.sum(axis=1))
+        Q /= -(pi*Q.diagonal()).sum()
+        root = numpy.sqrt(pi)
+        vals,vecs = numpy.linalg.eigh(root[:,None]*Q/root[None,:])
+        self.matrix      = Q
+        self.eigenvalues = vals
+        self.eigenvectors = vecs/root[:,None]
+        self.inverse     = vecs.T*root[None,:]
+
+    def __len__(self):
+
+        return len(self.states)
+
+    def getStates(self):
+
+        ''' Acquire the character states of this model.
+
+        :return: a string
+
+        '''
+
+        return self.states
+
+    def getFrequencies(self):
+
+        ''' Acquire equilibrium frequencies of all states.
+
+        :return: a numpy array of floating point values
+
+        '''
+
+        return self.frequencies
+
+    def getRates(self):
+
+        ''' Acquire the rate of every rate category (one without gamma).
+
+        :return: a numpy array of floating point values
+
+        '''
+
+        return self.rates
+
+    def getFingerprint(self):
+
+        ''' Acquire a digest of the states and parameters of this model;
+        models with identical parameters share it.
+
+        :return: a string (hexadecimal digest)
+
+        '''
+
+        h = sha1(self.states)
+        for arr in (self.exchangeabilities,self.frequencies,self.rates):
+            h.update(numpy.ascontiguousarray(arr,dtype=float).tostring())
+        return h.hexdigest()
+
+    def getTransitionMatrices(self,lengths):
+
+        ''' Acquire transition probability matrices for many branch lengths
+        and every rate category at once.
+
+        :param lengths: branch lengths
+        :type lengths: a list or numpy array of floating point values
+        :return: a numpy array indexed by branch, category, and two states
+
+        '''
+
+        times = numpy.asarray(lengths,dtype=float)[:,None]*self.rates[None,:]
+        expon = numpy.exp(times[...,None]*self.eigenvalues)
+        P = numpy.einsum('ij,bkj,jl->bkil',self.eigenvectors,expon,
+                         self.inverse)
+        return numpy.maximum(P,0.)
+
+def jc69Model(alpha=None,categories=LIKELIHOOD_GAMMA_CATEGORIES):
+
+    ''' Acquire the Jukes-Cantor (1969) model for nucleotides.
+
+    :param alpha: an optional shape for gamma-distributed rates
+    :param categories: the number of gamma rate categories
+    :return: a :class:`.substitutionModel` object
+
+    '''
+
+    return gtrModel([1.]*6,None,alpha,categories,'JC69')
+
+def hky85Model(kappa=2.,frequencies=None,alpha=None,
+               categories=LIKELIHOOD_GAMMA_CATEGORIES):
+
+    ''' Acquire the Hasegawa-Kishino-Yano (1985) model for nucleotides.
+
+    :param kappa: the ratio of transition to transversion rates
+    :param frequencies: frequencies of A, C, G, T; equal by default
+    :param alpha: an optional shape for gamma-distributed rates
+    :param categories: the number of gamma rate categories
+    :return: a :class:`.substitutionModel` object
+
+    '''
+
+    return gtrModel([1.,kappa,1.,1.,kappa,1.],frequencies,alpha,categories,
+                    'HKY85')
+
+def gtrModel(rates,frequencies=None,alpha=None,
+             categories=LIKELIHOOD_GAMMA_CATEGORIES,name='GTR'):
+
+    ''' Acquire the general time-reversible model for nucleotides.
+
+    :param rates: relative rates of A-C, A-G, A-T, C-G, C-T, G-T changes
+    :type rates: a list of six numbers
+    :param frequencies: frequencies of A, C, G, T; equal by default
+    :param alpha: an optional shape for gamma-distributed rates
+    :param categories: the number of gamma rate categories
+    :param name: an optional name for this model
+    :return: a :class:`.substitutionModel` object
+
+    '''
+
+    if len(rates) != 6: raise ValueError('GTR requires six rates.')
+    R = numpy.zeros((4,4))
+    R[numpy.triu_indices(4,1)] = rates
+    return substitutionModel(DNA_STATES,R+R.T,frequencies,alpha,categories,
+                             name)
+
+def wagModel(frequencies=None,alpha=None,
+             categories=LIKELIHOOD_GAMMA_CATEGORIES):
+
+    ''' Acquire the WAG model (Whelan and Goldman, 2001) for amino acids.
+
+    :param frequencies: amino acid frequencies; those of WAG by default
+    :param alpha: an optional shape for gamma-distributed rates
+    :param categories: the number of gamma rate categories
+    :return: a :class:`.substitutionModel` object
+
+    '''
+
+    if frequencies is None: frequencies = WAG_FREQUENCIES
+    R = numpy.zeros((20,20))
+    R[numpy.tril_indices(20,-1)] = [float(x) for x in
+                                    WAG_EXCHANGEABILITIES.split()]
+    return substitutionModel(AMINO_ACID_STATES,R+R.T,frequencies,alpha,
+                             categories,'WAG')
+
+# Newick Output
+
+def _writeNewick(node):
+
+    ''' PRIVATE: Write a Newick string for a parsed node with all branch
+    lengths in fixed-point notation (as the Newick parser expects). Children
+    are sorted as they are when a parsed node is written as a string. '''
+
+    if len(node.children) == 0: return node.label
+    children = sorted(node.children,key=lambda d: d.child.label)
+    return '(%s)%s' % (','.join(['%s:%.*f' % (_writeNewick(b.child),
+        LIKELIHOOD_PRECISION,b.branch_length) for b in children]),node.label)
+
+# Likelihood Engine
+
+class likelihoodEngine(object):
+
+    ''' Score trees against an alignment by Felsenstein's pruning algorithm.
+    Sites are compressed to unique patterns; conditional likelihoods are held
+    as arrays indexed by rate category, pattern, and state, and are rescaled
+    at every node to avoid underflow. Branch lengths are optimized by Newton's
+    method, one branch at a time over repeated traversals; model parameters
+    are fixed.
+    
+    Conditional likelihoods of subtrees are cached, keyed by the subtree and
+    its branch lengths, such that a tree differing from one scored before by
+    a rearrangement only has those on paths from the changed branches to the
+    root recomputed. Least recently used subtrees are evicted first once the
+    cache holds a given number of bytes. '''
+
+    def __init__(self,alignment,model=None,cacheBytes=LIKELIHOOD_CACHE_BYTES):
+
+        ''' Initialize this engine.
+
+        :param alignment: an alignment object
+        :type alignment: an :class:`.alignment.alignment` object
+        :param model: a substitution model; by default, HKY85 with empirical
+        frequencies for nucleotides or WAG for amino acids
+        :type model: a :class:`.substitutionModel` object
+        :param cacheBytes: the most memory kept for conditional likelihoods of
+        subtrees (0 disables caching)
+        :type cacheBytes: an integer
+
+        '''
+
+        self.alignment = alignment
+        self.model     = model
+        self.taxa      = {}
+        self.weights   = None
+        self.patterns  = None
+        self.tips      = None
+        if model == None:
+            if alignment.getDataType() == 'protein': self.model = wagModel()
+            else: self.model = hky85Model()
+        self._compressSites()
+        if model == None and self.model.getStates() == DNA_STATES:
+            self.model = hky85Model(frequencies=self.getEmpiricalFrequencies())
+        entry = (len(self.model.getRates())*len(self.model)+1)*8*len(
+            self.weights)
+        self.partials = scoreCache(cacheBytes/entry)
+
+    def _compressSites(self):
+
+        ''' PRIVATE: Collapse identical columns of the alignment into weighted
+        patterns and build conditional likelihoods of every taxon at them.
+        Characters not amongst the states of the model are missing data. '''
+
+        states = self.model.getStates()
+        if states == DNA_STATES: ambiguity = DNA_AMBIGUITY
+        elif states == AMINO_ACID_STATES: ambiguity = AMINO_ACID_AMBIGUITY
+        else: ambiguity = {}
+        table = numpy.ones((256,len(states)))
+        for c in xrange(256):
+            ch = chr(c).upper()
+            if ch in states: table[c] = [s == ch for s in states]
+            elif ch in ambiguity: table[c] = [s in ambiguity[ch] for s in
+                                              states]
+        upper = numpy.arange(256,dtype=numpy.uint8)
+        upper[ord('a'):ord('z')+1] -= 32
+        data = upper[self.alignment.toArray()]
+        self.patterns,self.sites,self.weights = numpy.unique(
+            data,axis=1,return_inverse=True,return_counts=True)
+        self.tips = table[self.patterns]
+        for i,seq in enumerate(self.alignment): self.taxa[seq.name] = i
+
+    def getEmpiricalFrequencies(self):
+
+        ''' Acquire frequencies of states amongst all unambiguous characters
+        of the alignment.
+
+        :return: a numpy array of floating point values
+
+        '''
+
+        known  = (self.tips.sum(axis=2) == 1)[...,None]
+        counts = (self.tips*known*self.weights[None,:,None]).sum(axis=(0,1))
+        return counts/max(counts.sum(),1.)
+
+    def _parse(self,newick):
+
+        ''' PRIVATE: Parse a Newick string and list its nodes in post-order
+        alongside the index of every parent and the length of the branch to
+        it. Lengths are NaN if the string gives none at all; otherwise, those
+        missing are zero (as zero lengths are written without one). '''
+
+        root  = newickParser(newick).parse()
+        order, stack = [], [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend([b.child for b in node.children])
+        order.reverse()
+        index = dict((id(n),i) for i,n in enumerate(order))
+        parents = [index[id(n.parent.parent)] if n.parent else -1 for n in
+                   order]
+        children = [[index[id(b.child)] for b in n.children] for n in order]
+        lengths  = numpy.array([n.parent.branch_length if n.parent else 0.
+                                for n in order])
+        if not any(n.parent.lengthGiven for n in order if n.parent):
+            lengths[:] = numpy.nan
+        for n in order:
+            if len(n.children) == 0 and not n.label in self.taxa:
+                raise ValueError('Taxon %s not found in alignment.' % (
+                    repr(n.label)))
+        return root,order,parents,children,lengths
+
+    def _combine(self,parts):
+
+        ''' PRIVATE: Multiply conditional likelihoods at a node from several
+        directions; each is carried along a branch first if transition
+        matrices are given for it. The product is rescaled such that its
+        largest entry at every pattern is one.
+
+        :return: a tuple of the conditional likelihoods and log-scalers
+
+        '''
+
+        total, scale = None, 0.
+        for vec,sc,P in parts:
+            if P is not None: vec = numpy.matmul(vec,P.transpose(0,2,1))
+            total = vec if total is None else total*vec
+            scale = scale + sc
+        big = total.max(axis=2).max(axis=0)
+        big[big <= 0.] = 1.
+        return total/big[None,:,None], scale + numpy.log(big)
+
+    def _getKeys(self,order,children,lengths):
+
+        ''' PRIVATE: Key every node by the subtree below it and its branch
+        lengths; identical subtrees of any two trees share a key.
+
+        :return: a list of strings
+
+        '''
+
+        keys = []
+        for i,node in enumerate(order):
+            if len(children[i]) == 0: keys.append(node.label)
+            else: keys.append(sha1(','.join(sorted(['%s:%r' % (
+                keys[c],lengths[c]) for c in children[i]]))).hexdigest())
+        return keys
+
+    def _prune(self,order,children,P,keys):
+
+        ''' PRIVATE: Compute conditional likelihoods of the subtree below
+        every node in post-order, taking those of subtrees from the cache
+        where possible.
+
+        :return: a tuple of a list of tuples of conditional likelihoods and
+        log-scalers, and a list of nodes that were not found in the cache
+
+        '''
+
+        below, missed = [None]*len(order), []
+        for i,node in enumerate(order):
+            if len(children[i]) == 0:
+                below[i] = (self.tips[self.taxa[node.label]][None],0.)
+                continue
+            below[i] = self.partials.get('',keys[i])
+            if below[i] == None:
+                below[i] = self._combine([(below[c][0],below[c][1],P[c])
+                                          for c in children[i]])
+                missed.append(i)
+        return below, missed
+
+    def _keep(self,keys,children,below):
+
+        ''' PRIVATE: Cache conditional likelihoods below all interior nodes. '''
+
+        inner = [i for i in xrange(len(keys)) if len(children[i]) > 0]
+        self.partials.setMany('',[keys[i] for i in inner],
+                              [below[i] for i in inner])
+
+    def _getSiteLikelihoods(self,vec,scale,outside=None):
+
+        ''' PRIVATE: Acquire log-likelihoods of every pattern from conditional
+        likelihoods at a node (and optionally those from outside of it). '''
+
+        if outside is not None: vec = vec*outside
+        cats = (vec*self.model.getFrequencies()).sum(axis=2)
+        site = cats.sum(axis=0)/len(self.model.getRates())
+        return numpy.log(numpy.maximum(site,1e-300)) + scale
+
+    def _optimizeLength(self,above,below,t):
+
+        ''' PRIVATE: Optimize the length of a single branch by Newton's method
+        given conditional likelihoods from either of its ends. Likelihoods are
+        expanded in the eigenbasis of the model so that every evaluation costs
+        a single product. '''
+
+        m  = self.model
+        w  = self.weights
+        A  = numpy.matmul(above*m.getFrequencies(),m.eigenvectors)
+        B  = numpy.matmul(below,m.inverse.T)
+        C  = A*B/len(m.getRates())
+        lr = m.getRates()[:,None]*m.eigenvalues[None,:]
+        def evaluate(t):
+            E  = C*numpy.exp(lr*t)[:,None,:]
+            f  = numpy.maximum(E.sum(axis=(0,2)),1e-300)
+            f1 = (E*lr[:,None,:]).sum(axis=(0,2))/f
+            f2 = (E*(lr**2)[:,None,:]).sum(axis=(0,2))/f
+            return (w*numpy.log(f)).sum(), (w*f1).sum(), (w*(f2-f1*f1)).sum()
+        cur,d1,d2 = evaluate(t)
+        for _ in xrange(32):
+            if d2 < 0.: step = -d1/d2
+            else: step = t if d1 > 0. else -t/2.
+            for _ in xrange(16):
+                new = min(max(t+step,LIKELIHOOD_MIN_LENGTH),
+                          LIKELIHOOD_MAX_LENGTH)
+                nxt,n1,n2 = evaluate(new)
+                if nxt >= cur: break
+                step /= 2.
+            else: break
+            moved = abs(new-t)
+            t,cur,d1,d2 = new,nxt,n1,n2
+            if moved < LIKELIHOOD_TOLERANCE: break
+        return round(t,LIKELIHOOD_PRECISION)
+
+    def _smooth(self,order,parents,children,lengths,P,below,targets=None):
+
+        ''' PRIVATE: Optimize every branch (or those above given nodes) once,
+        in pre-order. Conditional likelihoods from above a node are built from
+        those above its parent and those of its siblings; those below a node
+        are refreshed once all of its branches were optimized. Only paths from
+        the root to the given nodes are traversed. '''
+
+        m = self.model
+        root  = len(order)-1
+        visit = None
+        if targets != None:
+            visit = set()
+            for i in targets:
+                while i >= 0 and not i in visit:
+                    visit.add(i)
+                    i = parents[i]
+        above = {}
+        stack = [(root,False)]
+        while stack:
+            i,done = stack.pop()
+            if done:
+                below[i] = self._combine([(below[c][0],below[c][1],P[c])
+                                          for c in children[i]])
+                del above[i]
+                continue
+            p = parents[i]
+            if p >= 0:
+                parts = [(below[s][0],below[s][1],P[s]) for s in children[p]
+                         if s != i]
+                if p != root: parts.append(above[p]+(P[p],))
+                above[i] = self._combine(parts)
+                if targets == None or i in targets:
+                    lengths[i] = self._optimizeLength(above[i][0],below[i][0],
+                                                      lengths[i])
+                    P[i] = m.getTransitionMatrices([lengths[i]])[0]
+            nxt = [c for c in children[i] if visit == None or c in visit]
+            if len(nxt) == 0:
+                above.pop(i,None)
+                continue
+            above.setdefault(i,None)
+            stack.append((i,True))
+            for c in reversed(nxt): stack.append((c,False))
+
+    def _score(self,newick,optimize,local=False):
+
+        ''' PRIVATE: Score a tree, optionally optimizing its branch lengths:
+        all of them, or only those adjacent to subtrees not found in the cache.
+        Conditional likelihoods are cached unless only some were optimized.
+
+        :return: a tuple of log-likelihoods of every pattern and the parsed tree
+
+        '''
+
+        root,order,parents,children,lengths = self._parse(newick)
+        lengths[numpy.isnan(lengths)] = LIKELIHOOD_DEFAULT_LENGTH
+        if optimize: lengths[lengths <= 0.] = LIKELIHOOD_DEFAULT_LENGTH
+        lengths[-1] = 0.
+        P = list(self.model.getTransitionMatrices(lengths))
+        keys = self._getKeys(order,children,lengths)
+        below,missed = self._prune(order,children,P,keys)
+        sites = self._getSiteLikelihoods(*below[-1])
+        if optimize:
+            targets = None
+            if local:
+                targets = set(missed)
+                for i in missed: targets.update(children[i])
+            best = (sites*self.weights).sum()
+            for _ in xrange(LIKELIHOOD_ROUNDS):
+                self._smooth(order,parents,children,lengths,P,below,targets)
+                sites = self._getSiteLikelihoods(*below[-1])
+                lnl = (sites*self.weights).sum()
+                if lnl-best < LIKELIHOOD_EPSILON: break
+                best = lnl
+            for n,l in zip(order,lengths):
+                if n.parent: n.parent.branch_length = l
+            keys = self._getKeys(order,children,lengths)
+        if not local: self._keep(keys,children,below)
+        return sites,root
+
+    def getLogLikelihood(self,newick,optimize=True):
+
+        ''' Acquire the log-likelihood of a tree.
+
+        :param newick: a Newick string
+        :type newick: a string
+        :param optimize: whether to optimize branch lengths or take them as
+        given (those missing take a default length)
+        :type optimize: a boolean
+        :return: a floating point value
+
+        '''
+
+        return self.score(newick,optimize)[0]
+
+    def score(self,newick,optimize=True,local=False):
+
+        ''' Acquire the log-likelihood of a tree alongside a Newick string
+        for it carrying the branch lengths it was scored with.
+
+        :param newick: a Newick string
+        :type newick: a string
+        :param optimize: whether to optimize branch lengths
+        :type optimize: a boolean
+        :param local: whether to only optimize branches adjacent to subtrees
+        that are not cached (e.g., those a rearrangement of a tree scored
+        before changed) and keep all others as given; such a tree is not
+        cached in turn
+        :type local: a boolean
+        :return: a tuple of a floating point value and a string
+
+        '''
+
+        sites,root = self._score(newick,optimize,local)
+        return float((sites*self.weights).sum()), _writeNewick(root)+';'
+
+    def scoreRearrangement(self,rearr,optimize=True):
+
+        ''' Acquire the log-likelihood of the tree a rearrangement induces
+        alongside a Newick string for it. Branch lengths are inherited from
+        the rearranged topology; if it was scored by this engine, only
+        conditional likelihoods on paths from the moved subtree and from
+        where it was pruned to the root are recomputed, and only branches
+        adjacent to those paths are optimized.
+
+        :param rearr: a rearrangement
+        :type rearr: a :class:`.rearrangement.rearrangement` object
+        :param optimize: whether to optimize branch lengths along the paths
+        :type optimize: a boolean
+        :return: a tuple of a floating point value and a string
+
+        '''
+
+        return self.score(rearr.toNewick(),optimize,local=True)
+
+    def getSiteLogLikelihoods(self,newick,optimize=True):
+
+        ''' Acquire the log-likelihood of every site of the alignment.
+
+        :param newick: a Newick string
+        :type newick: a string
+        :param optimize: whether to optimize branch lengths
+        :type optimize: a boolean
+        :return: a numpy array of floating point values
+
+        '''
+
+        return self._score(newick,optimize)[0][self.sites]
+
+def getLikelihoodEngine(alignment,model=None):
+
+    ''' Acquire the likelihood engine kept for an alignment, building one if
+    there is none or it does not use the given model.
+
+    :param alignment: an alignment object
+    :type alignment: an :class:`.alignment.alignment` object
+    :param model: an optional substitution model
+    :type model: a :class:`.substitutionModel` object
+    :return: a :class:`.likelihoodEngine` object
+
+    '''
+
+    engine = getattr(alignment,'_likelihoodEngine',None)
+    if engine == None or (model != None and engine.model is not model):
+        engine = likelihoodEngine(alignment,model)
+        alignment._likelihoodEngine = engine
+    return engine
@@ -66,6 +66,7 @@ class branch(base.treeBranch):
         self.child          = chi
         self.branch_length  = l
         self.branch_support = s
+        self.lengthGiven    = True # Whether parsed with a branch length.
         
     def __str__(self):
         st, sl = self.child, self.branch_length
@@ -74,6 +75,21 @@ class branch(base.treeBranch):
 
 # Traversal Functions
 
+def toStructure(top):
+    
+    ''' Write a tree as a Newick string without any branch lengths (and
+    without a trailing semicolon), in the order a node is written.
+    
+    :param top: a top-level node for a tree (root node)
+    :type top: a :class:`.node` object
+    :return: a string
+    
+    '''
+    
+    if len(top.children) == 0: return top.label
+    l = sorted([b.child for b in top.children],key=lambda d: d.label)
+    return '(%s)%s' % (','.join(map(toStructure,l)),top.label)
+
 def assignParents(top):
     
     ''' Should be a one-time use function. Goes through
@@ -384,7 +400,7 @@ def parseNewick(newick,i,j,top):
         # Hit a subtree?
         if newick[i] == '(':
             k, _ = (getBalancingBracket(newick,i)), None
-            brlength = 0.0
+            brlength = None
             if newick[k+1] == ':': # Has branch length?
                 _, brlength = getBranchLength(newick,k+1)
             elif newick[k+1] != ',': # Has name or statistical support?
@@ -392,18 +408,22 @@ def parseNewick(newick,i,j,top):
                 newnode.label = name
                 if newick[_+1] == ':': # Branch length after this?
                     _, brlength = getBranchLength(newick,_+1)
-            if brlength > 0.0 and top: nb.branch_length = brlength
+            if top: nb.lengthGiven = (brlength != None)
+            if brlength != None and brlength > 0.0 and top:
+                nb.branch_length = brlength
             parseNewick(newick,i+1,k,newnode)
             if (_ != None): k = _
         
         # Hit a leaf?
         else:
             k, name = getLeafName(newick,i)
-            brlength = 0.0
+            brlength = None
             if (k+1 <= j):
                 if newick[k+1] == ':':
                     k, brlength = getBranchLength(newick,k+1)
-            if brlength > 0.0 and top: nb.branch_length = brlength
+            if top: nb.lengthGiven = (brlength != None)
+            if brlength != None and brlength > 0.0 and top:
+                nb.branch_length = brlength
             newnode.label = name
             
         # Advance forward.
@@ -5,45 +5,136 @@ optimization of a phylogenetic topology with a particular set of data. '''
 # Author: Alex Safatli
 # E-mail: safatli@cs.dal.ca
 
+import numpy
+from hashlib import sha1
 from base import treeStructure
 postorder = treeStructure.postOrderTraversal
 
+# Profile Construction
+
+def recode(data):
+    
+    ''' Recode every column of a two-dimensional array of character codes
+    such that characters are numbered in order of their first occurrence
+    along that column (e.g., a column TTAG becomes 0012). Done for all
+    columns at once by a stable sort of each column.
+    
+    :param data: an array with a row for every sequence
+    :type data: a numpy array of character codes
+    :return: a tuple of the recoded array and a boolean array marking where\
+    characters first occur in each column
+    
+    '''
+    
+    n,m  = data.shape
+    cols = numpy.arange(m)
+    rows = numpy.arange(n)[:,None]
+    
+    # Sort each column; equal characters are then contiguous with the row of
+    # their first occurrence leading (stable sort).
+    order = data.argsort(axis=0,kind='mergesort')
+    srted = data[order,cols]
+    lead  = numpy.ones((n,m),dtype=bool)
+    lead[1:] = (srted[1:] != srted[:-1])
+    
+    # Propagate the row of first occurrence to all of its characters.
+    start = numpy.maximum.accumulate(numpy.where(lead,rows,0),axis=0)
+    first = numpy.empty((n,m),dtype=numpy.intp)
+    first[order,cols] = order[start,cols]
+    
+    # Number first occurrences down each column.
+    isfirst = (first == rows)
+    rank    = isfirst.cumsum(axis=0) - 1
+    return rank[first,cols], isfirst
+
 class profile_set:
     
     ''' Hold a set of site_profile profiles for an 
-    entire alignment. '''
+    entire alignment. Profiles are classified as parsimony-informative or
+    not; the steps all uninformative profiles incur on any binary tree are
+    held as a constant. '''
 
-    def __init__(self,alignment):
+    def __init__(self,alignment,recode=True):
         
         ''' Initialize this profile set by indicating an alignment. 
         
         :param alignment: an alignment object
         :type alignment: an :class:`.alignment.alignment` object
+        :param recode: whether to recode sites to components in order of\
+        occurrence (default) or keep their characters, as is needed for\
+        weighted parsimony with a :class:`.stepMatrix`
+        :type recode: a boolean
         
         '''
         
         self.alignment = alignment
+        self.recoded   = recode
         self.numSites  = alignment.getSize()
         self.taxa      = {}
         self.profiles  = []
         self.weights   = []
         self.sites     = []
+        self.patterns  = []
+        self.informative = []
+        self.minSteps  = []
+        self.constant  = 0
+        self.fingerprint = None
+        self.partitionSets = None
         self._constructSet()
+        self._classifySet()
         self._buildTaxaDict()
     
     def _constructSet(self):
         
-        ''' PRIVATE: Build all site_profiles. '''
-        
-        num = self.numSites
-        for site in xrange(num):
-            pro = site_profile(self.alignment,site)
-            self.sites.append(pro)
-            if pro in self.profiles:
-                self.weights[self.profiles.index(pro)] += 1
-            else:
-                self.profiles.append(pro)
+        ''' PRIVATE: Build all site_profiles. Every column is recoded at once
+        and identical columns are collapsed by hashing their vectors. '''
+        
+        data = self.alignment.toArray()
+        if data.size == 0: return
+        
+        # One vector of characters ('0', '1', ...) per column, or the
+        # characters of the column themselves.
+        if self.recoded:
+            codes,isfirst = recode(data)
+            vecs = numpy.ascontiguousarray(
+                (codes + ord('0')).T.astype(numpy.uint8))
+        else: vecs = numpy.ascontiguousarray(data.T)
+        found = {}
+        for site in xrange(self.numSites):
+            vec = vecs[site].tostring()
+            ind = found.get(vec)
+            if ind is None:
+                ind = found[vec] = len(self.profiles)
+                if self.recoded:
+                    chars = data[isfirst[:,site],site]
+                    alpha = dict((chr(c),i) for i,c in enumerate(chars))
+                else: alpha = dict((c,c) for c in set(vec))
+                self.profiles.append(site_profile(self.alignment,site,
+                                                  vec,alpha))
                 self.weights.append(1)
+            else: self.weights[ind] += 1
+            self.patterns.append(ind)
+            self.sites.append(self.profiles[ind])
+            
+    def _classifySet(self):
+        
+        ''' PRIVATE: Mark profiles as informative if at least two components
+        are each found in two or more taxa. Any other profile costs its number
+        of components less one on any binary tree; these are summed. '''
+        
+        num = len(self.profiles)
+        if num == 0: return
+        vecs = numpy.frombuffer(''.join([str(x) for x in self.profiles]),
+                                dtype=numpy.uint8).reshape(num,-1)
+        codes  = recode(vecs.T)[0]
+        steps  = codes.max(axis=0)
+        shared = numpy.zeros(num,dtype=int)
+        for comp in xrange(steps.max()+1):
+            shared += ((codes == comp).sum(axis=0) >= 2)
+        self.informative = (shared >= 2).tolist()
+        self.minSteps    = steps.tolist()
+        self.constant    = sum([w*st for w,st,inf in zip(
+            self.weights,self.minSteps,self.informative) if not inf])
                 
     def _buildTaxaDict(self):
         
@@ -68,6 +159,68 @@ class profile_set:
         
         return self.weights[val]
     
+    def isInformative(self,val):
+        
+        ''' Determine whether the profile at an index is parsimony-informative.
+        
+        :param val: an index of the set
+        :type val: an integer
+        :return: a boolean
+        
+        '''
+        
+        return self.informative[val]
+    
+    def getFingerprint(self):
+        
+        ''' Acquire a digest of the taxa, profiles and weights of this set;
+        sets built from identical alignments share it.
+        
+        :return: a string (hexadecimal digest)
+        
+        '''
+        
+        if self.fingerprint == None:
+            h = sha1('recoded' if self.recoded else 'raw')
+            for tax in sorted(self.taxa,key=self.taxa.get): h.update(tax+'\0')
+            for pro,wei in zip(self.profiles,self.weights):
+                h.update('%s:%d\0' % (str(pro),wei))
+            self.fingerprint = h.hexdigest()
+        return self.fingerprint
+    
+    def getPartitionSets(self):
+        
+        ''' Acquire a profile set for every partition of the alignment (see
+        setPartitions of an alignment), built once and kept; a set for the
+        whole alignment alone if it is not partitioned. Parsimony of a tree is
+        the sum of that over every partition.
+        
+        :return: a list of :class:`.profile_set` objects
+        
+        '''
+        
+        ali = self.alignment
+        if not ali.isPartitioned(): return [self]
+        views = [ali.getPartition(i) for i in xrange(len(ali.getPartitions()))]
+        if self.partitionSets == None or \
+           [x.alignment for x in self.partitionSets] != views:
+            self.partitionSets = [profile_set(v,self.recoded) for v in views]
+        return self.partitionSets
+    
+    def toSites(self,values):
+        
+        ''' Expand values held for every profile (e.g., the steps each incurs
+        on a tree) to every site of the alignment. The last axis of values is
+        taken to run along profiles.
+        
+        :param values: values for every profile
+        :type values: a list or numpy array
+        :return: a numpy array
+        
+        '''
+        
+        return numpy.asarray(values)[...,self.patterns]
+    
     def get(self,val):
         
         ''' Acquire the site profile at an index. 
@@ -99,7 +252,7 @@ class site_profile:
     ''' Consolidate a single column of the alignment into a set of components
     with associated counts. '''
     
-    def __init__(self,alignment,site):
+    def __init__(self,alignment,site,vector=None,alphabet=None):
         
         ''' Initialize this profile. 
         
@@ -107,14 +260,19 @@ class site_profile:
         :type alignment: an `.alignment.alignment` object
         :param site: a site/column index along the alignment
         :type site: an integer
+        :param vector: an optional, already recoded vector for the site
+        :type vector: a string
+        :param alphabet: an optional dictionary mapping characters to their\
+        components in the vector
+        :type alphabet: a dictionary
         
         '''
         
         self.alignment = alignment
         self.site      = site
-        self.alphabet  = None
-        self.vector    = ''
-        self._buildVector()
+        self.alphabet  = alphabet
+        self.vector    = vector
+        if vector is None: self._buildVector()
         
     def __eq__(self,o):
         
@@ -135,15 +293,148 @@ class site_profile:
         
         aliData = self.alignment.data
         sitesli = aliData.sequenceSlice(self.site)
-        compn   = 0
         comps   = {}
+        vector  = []
         for it in sitesli:
-            if not it in comps:
-                comps[it] = compn
-                compn += 1
-            self.vector += str(comps[it])
+            if not it in comps: comps[it] = len(comps)
+            vector.append(chr(ord('0') + comps[it]))
+        self.vector   = ''.join(vector)
         self.alphabet = comps
 
+# Step Matrices
+
+DNA_STATES        = 'ACGT'
+AMINO_ACID_STATES = 'ARNDCQEGHILKMFPSTWYV'
+
+class stepMatrix(object):
+    
+    ''' Hold the costs (steps) of a change from one character state to
+    another for weighted (Sankoff) parsimony. Characters are matched to states
+    regardless of case; those not amongst the states (e.g., gaps, ambiguity
+    codes) are treated as missing data. '''
+    
+    def __init__(self,states,costs=None):
+        
+        ''' Initialize this step matrix.
+        
+        :param states: the character states
+        :type states: a string or list of characters
+        :param costs: an optional square matrix of costs where costs[i][j] is\
+        the cost of a change from state i to state j; by default, any change\
+        costs a single step
+        :type costs: a list of lists of numbers
+        
+        '''
+        
+        self.states = ''.join(states).upper()
+        num = len(self.states)
+        if num == 0 or len(set(self.states)) != num:
+            raise ValueError('States of a step matrix must be unique.')
+        if costs is None:
+            costs = [[int(i != j) for j in xrange(num)] for i in xrange(num)]
+        if len(costs) != num or any([len(row) != num for row in costs]):
+            raise ValueError('Step matrix must have a cost for every pair of'
+                             ' states.')
+        self.costs = [[float(c) for c in row] for row in costs]
+        if any([c < 0 for row in self.costs for c in row]):
+            raise ValueError('Costs of a step matrix must not be negative.')
+        
+    def __len__(self):
+        
+        return len(self.states)
+    
+    def __eq__(self,o):
+        
+        if not isinstance(o,stepMatrix): return False
+        return (self.states == o.states and self.costs == o.costs)
+    
+    def __ne__(self,o):
+        
+        return not self.__eq__(o)
+    
+    def getStates(self):
+        
+        ''' Acquire the character states of this matrix.
+        
+        :return: a string
+        
+        '''
+        
+        return self.states
+    
+    def cost(self,a,b):
+        
+        ''' Acquire the cost of a change from one state to another.
+        
+        :param a: a state
+        :type a: a character
+        :param b: a state
+        :type b: a character
+        :return: a floating point value
+        
+        '''
+        
+        st = self.states
+        return self.costs[st.index(a.upper())][st.index(b.upper())]
+    
+    def toList(self):
+        
+        ''' Acquire all costs as a single list (row by row).
+        
+        :return: a list of floating point values
+        
+        '''
+        
+        return [c for row in self.costs for c in row]
+    
+    def getFingerprint(self):
+        
+        ''' Acquire a digest of the states and costs of this matrix.
+        
+        :return: a string (hexadecimal digest)
+        
+        '''
+        
+        return sha1(self.states+repr(self.toList())).hexdigest()
+
+def transitionTransversionMatrix(transition=1.,transversion=2.):
+    
+    ''' Acquire a step matrix for nucleotides that weights transitions (A-G,
+    C-T) and transversions separately.
+    
+    :param transition: the cost of a transition
+    :param transversion: the cost of a transversion
+    :return: a :class:`.stepMatrix` object
+    
+    '''
+    
+    purines = 'AG'
+    st = DNA_STATES
+    costs = [[0. if a == b else (transition if (a in purines) == (
+        b in purines) else transversion) for b in st] for a in st]
+    return stepMatrix(st,costs)
+
+def readStepMatrix(path):
+    
+    ''' Read a step matrix from a file: a line listing the states followed by
+    a line of costs for every state, which may begin with that state (e.g.,
+    an amino acid cost matrix). Lines starting with # are ignored.
+    
+    :param path: a path to a file
+    :type path: a string
+    :return: a :class:`.stepMatrix` object
+    
+    '''
+    
+    fh = open(path)
+    lines = [l.split() for l in fh if l.strip() and not l.startswith('#')]
+    fh.close()
+    if len(lines) == 0: raise ValueError('No step matrix found in file.')
+    states = lines[0]
+    costs  = [row[1:] if len(row) == len(states)+1 else row
+              for row in lines[1:]]
+    return stepMatrix(states,costs)
+
 def fitch_cost(topology,profiles):
     
     ''' Calculate the cost using Fitch algorithm on 
@@ -151,10 +442,11 @@ def fitch_cost(topology,profiles):
     of the Fitch algorithm; see fitch C++ module for 
     a C++ implementation that is roughly four times faster. '''
     
-    # Calculate parsimony score.
-    total = 0
+    # Calculate parsimony score; uninformative profiles add a constant.
+    total = profiles.constant
     porde = [x for x in postorder(topology.getRoot())]
     for profile in xrange(len(profiles)):
+        if not profiles.isInformative(profile): continue
         posdata, local = {}, 0
         for node in porde:
             # If is leaf.
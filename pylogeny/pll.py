@@ -5,9 +5,69 @@
 # E-mail: safatli@cs.dal.ca
 
 import alignment, rearrangement
-from libpllWrapper import *
 from tempfile import NamedTemporaryFile as NTempFile
-import os, sys
+import os, sys, threading
+from multiprocessing import cpu_count
+from time import time
+
+# libpll coupling; scoring falls back to the likelihood module without it.
+
+pllEnabled = True
+try: from libpllWrapper import *
+except ImportError: pllEnabled = False
+
+# Constants
+
+PLL_DEFAULT_THREADS     = 8
+PLL_CALIBRATION_THREADS = (1,2,4,8,16)
+
+class instanceAttributes:
+    
+    ''' Attributes of a libpll instance: how many threads it uses and whether
+    rate heterogeneity is modelled by a gamma distribution (otherwise, CAT),
+    with fast scaling, or with memory saving (e.g., for gap-heavy
+    alignments). '''
+    
+    def __init__(self,threads=PLL_DEFAULT_THREADS,gamma=True,
+                 fastScaling=False,saveMemory=False):
+        
+        ''' Initialize a set of attributes.
+        
+        :param threads: the number of threads libpll uses
+        :type threads: an integer
+        :param gamma: whether to use gamma rate heterogeneity (otherwise CAT)
+        :type gamma: a boolean
+        :param fastScaling: whether to use fast scaling
+        :type fastScaling: a boolean
+        :param saveMemory: whether to save memory on gaps
+        :type saveMemory: a boolean
+        
+        '''
+        
+        self.threads     = threads
+        self.gamma       = gamma
+        self.fastScaling = fastScaling
+        self.saveMemory  = saveMemory
+        
+    def __eq__(self,o):
+        
+        return isinstance(o,instanceAttributes) and \
+            self.toTuple() == o.toTuple()
+    
+    def __ne__(self,o):
+        
+        return not self == o
+        
+    def toTuple(self):
+        
+        ''' Get the attributes in the order libpll instances take them.
+        
+        :return: a tuple of integers
+        
+        '''
+        
+        return (self.threads,int(self.gamma),int(self.fastScaling),
+                int(self.saveMemory))
 
 class dataModel:
     
@@ -15,7 +75,7 @@ class dataModel:
     into a libpll-associated data structure. Allows for log-likelihood
     scoring of this model. MUST BE CLOSED AFTER USE. '''
 
-    def __init__(self,topo,alignm,model=None):
+    def __init__(self,topo,alignm,model=None,attribs=None):
 
         ''' Initialize the data model and respective structures. 
         
@@ -23,6 +83,9 @@ class dataModel:
         :type topo: :class:`.rearrangement.topology`
         :param alignm: a phylip-friendly alignment object.
         :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+        :param attribs: optional instance attributes; by default, those kept
+        with the alignment
+        :type attribs: :class:`.instanceAttributes`
         
         '''
         
@@ -31,20 +94,29 @@ class dataModel:
             raise TypeError('libpll interfacing needs phylipFriendlyAlignment.')
 
         # Model handling. See if one already defined in alignment.
-        if not model:
-            if hasattr(alignm,'_pllmodel'): self.model = alignm._pllmodel
-            else:
-                self.model = partitionModel(alignm)
-                self.model.createSimpleModel()
-                alignm._pllmodel = self.model
-                alignm.paths['pll'] = self.model.getFileName()
+        if not model: self.model = getPartitionModel(alignm)
         else: self.model = model        
 
         # Other things.
+        if not attribs: attribs = getInstanceAttributes(alignm)
         modf           = self.model.getFileName()
+        self.attribs   = attribs
         self.instance  = new(alignm.getPhylip(),
                              topo.toUnrootedNewick(),
-                             modf)
+                             modf,*attribs.toTuple())
+        
+    def setTopology(self,topo):
+        
+        ''' Replace the tree of the problem instance, keeping its alignment
+        and partitions. Branch lengths and model parameters are reset, so it
+        scores the tree as a new data model would.
+        
+        :param topo: a topology object
+        :type topo: :class:`.rearrangement.topology`
+        
+        '''
+        
+        setTopology(self.instance,topo.toUnrootedNewick())
         
     def getNewickString(self):
         
@@ -56,6 +128,28 @@ class dataModel:
         
         return getNewickString(self.instance)
         
+    def getRearrangements(self,type=None,radius=1):
+        
+        ''' Search for all rearrangements of the tree of the problem instance
+        within a radius using libpll, which approximates the log-likelihood of
+        every resultant tree.
+        
+        :param type: a rearrangement type (TYPE_SPR or TYPE_NNI); None for both
+        :param radius: the maximum distance a subtree is moved
+        :type radius: an integer
+        :return: a list of tuples of a type (string), approximate
+        log-likelihood, and Newick string
+        
+        '''
+        
+        if type == rearrangement.TYPE_SPR:
+            return getSPRMovesInDistance(self.instance,radius)
+        elif type == rearrangement.TYPE_NNI:
+            return getNNIMovesInDistance(self.instance,radius)
+        elif type == None:
+            return getAllMovesInDistance(self.instance,radius)
+        raise ValueError('libpll does not search for that rearrangement type.')
+        
     def getLogLikelihood(self):
         
         ''' Calculates log-likelihood using libpll.
@@ -72,6 +166,204 @@ class dataModel:
         
         destroy(self.instance)
 
+class instancePool:
+    
+    ''' A pool of warm libpll problem instances for a single alignment and
+    partition model. Rather than parsing the alignment and partition files
+    and initializing the model for every tree scored, an idle instance is
+    given the topology of the next tree. MUST BE CLOSED AFTER USE. '''
+    
+    def __init__(self,alignm,model=None,size=4,attribs=None):
+        
+        ''' Initialize an empty pool.
+        
+        :param alignm: a phylip-friendly alignment object.
+        :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+        :param model: an optional partition model
+        :type model: :class:`.partitionModel`
+        :param size: the maximum number of idle instances kept
+        :type size: an integer
+        :param attribs: optional instance attributes; by default, those kept
+        with the alignment
+        :type attribs: :class:`.instanceAttributes`
+        
+        '''
+        
+        if not attribs: attribs = getInstanceAttributes(alignm)
+        self.alignment = alignm
+        self.model     = model
+        self.attribs   = attribs
+        self.size      = size
+        self.idle      = list()
+        self.lock      = threading.Lock()
+        
+    def acquire(self,topo):
+        
+        ''' Acquire a data model for a topology; an idle instance is reused if
+        there is one. Should be released back to the pool after use.
+        
+        :param topo: a topology object
+        :type topo: :class:`.rearrangement.topology`
+        :return: a :class:`.dataModel` object
+        
+        '''
+        
+        with self.lock:
+            if self.idle: data = self.idle.pop()
+            else: data = None
+        if data == None:
+            return dataModel(topo,self.alignment,self.model,self.attribs)
+        try: data.setTopology(topo)
+        except:
+            data.close()
+            raise
+        return data
+    
+    def release(self,data):
+        
+        ''' Return a data model to the pool for reuse. It is closed instead if
+        the pool is full.
+        
+        :param data: a data model acquired from this pool
+        :type data: :class:`.dataModel`
+        
+        '''
+        
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(data)
+                return
+        data.close()
+        
+    def close(self):
+        
+        ''' Close all idle instances. '''
+        
+        with self.lock:
+            for data in self.idle: data.close()
+            self.idle = list()
+
+def getPartitionModel(alignm):
+    
+    ''' Acquire the partition model kept with an alignment, creating it if
+    needed: one with a partition for every partition of the alignment, if it
+    is partitioned, or otherwise a simple one. Its file is deleted alongside
+    the alignment.
+    
+    :param alignm: a phylip-friendly alignment object.
+    :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+    :return: a :class:`.partitionModel` object
+    
+    '''
+    
+    if not hasattr(alignm,'_pllmodel'):
+        model = partitionModel(alignm)
+        if alignm.isPartitioned():
+            names,models,ranges = zip(*alignm.getPartitions())
+            model.createModel(models,names,ranges)
+        else: model.createSimpleModel()
+        alignm._pllmodel = model
+        alignm.paths['pll'] = model.getFileName()
+    return alignm._pllmodel
+
+def getInstancePool(alignm,attribs=None):
+    
+    ''' Acquire the pool of libpll instances kept with an alignment for its
+    default partition model, creating it if needed. It is closed alongside the
+    alignment, or replaced if other instance attributes are asked for.
+    
+    :param alignm: a phylip-friendly alignment object.
+    :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+    :param attribs: optional instance attributes; by default, those kept
+    with the alignment
+    :type attribs: :class:`.instanceAttributes`
+    :return: an :class:`.instancePool` object
+    
+    '''
+    
+    if not attribs: attribs = getInstanceAttributes(alignm)
+    if hasattr(alignm,'_pllpool') and alignm._pllpool.attribs != attribs:
+        alignm._pllpool.close()
+        del alignm._pllpool
+    if not hasattr(alignm,'_pllpool'):
+        alignm._pllpool = instancePool(alignm,attribs=attribs)
+    return alignm._pllpool
+
+def getInstanceAttributes(alignm):
+    
+    ''' Acquire the instance attributes kept with an alignment (e.g., once
+    calibrated); otherwise, the defaults.
+    
+    :param alignm: a phylip-friendly alignment object.
+    :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+    :return: an :class:`.instanceAttributes` object
+    
+    '''
+    
+    if hasattr(alignm,'_pllattribs'): return alignm._pllattribs
+    return instanceAttributes()
+
+def setInstanceAttributes(alignm,attribs):
+    
+    ''' Keep instance attributes with an alignment such that libpll instances
+    for it are made with them by default.
+    
+    :param alignm: a phylip-friendly alignment object.
+    :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+    :param attribs: instance attributes
+    :type attribs: :class:`.instanceAttributes`
+    
+    '''
+    
+    alignm._pllattribs = attribs
+
+def calibrateThreads(alignm,topo,counts=None,repeats=3,attribs=None):
+    
+    ''' Measure how quickly a tree is scored by libpll across numbers of
+    threads for an alignment on this host; the fastest is kept with the
+    alignment as its default.
+    
+    :param alignm: a phylip-friendly alignment object.
+    :type alignm: :class:`.alignment.phylipFriendlyAlignment`
+    :param topo: a topology object to score
+    :type topo: :class:`.rearrangement.topology`
+    :param counts: numbers of threads to try; by default, powers of two up
+    to the number of processors
+    :type counts: a list of integers
+    :param repeats: how many times the tree is scored for every number
+    :type repeats: an integer
+    :param attribs: other instance attributes to keep; by default, those
+    kept with the alignment
+    :type attribs: :class:`.instanceAttributes`
+    :return: the number of threads found fastest or None if none worked
+    
+    '''
+    
+    if not attribs: attribs = getInstanceAttributes(alignm)
+    if not counts:
+        counts = [c for c in PLL_CALIBRATION_THREADS if c <= cpu_count()]
+    
+    # Measure trees scored per second; instance setup is not counted.
+    rates = dict()
+    for count in counts:
+        trial = instanceAttributes(count,attribs.gamma,attribs.fastScaling,
+                                   attribs.saveMemory)
+        try: data = dataModel(topo,alignm,attribs=trial)
+        except IOError: continue
+        try:
+            start = time()
+            for _ in xrange(repeats): data.getLogLikelihood()
+            rates[count] = repeats/max(time()-start,1e-9)
+        except IOError: pass
+        data.close()
+    if not rates: return None
+    
+    # Keep the fastest.
+    best = max(rates,key=rates.get)
+    setInstanceAttributes(alignm,instanceAttributes(
+        best,attribs.gamma,attribs.fastScaling,attribs.saveMemory))
+    return best
+
 class partitionModel:
     
     ''' A partition model intended for libpll. '''
@@ -88,6 +380,7 @@ class partitionModel:
         self.handle = NTempFile(delete=False)
         self.length = len(ali)
         self.isprotein = (ali.getDataType() == 'protein')
+        self.text = ''
         
     def getFileName(self):
         
@@ -99,6 +392,16 @@ class partitionModel:
         
         return self.handle.name
     
+    def getText(self):
+        
+        ''' Get the text written to the model file.
+        
+        :return: a string
+        
+        '''
+        
+        return self.text
+    
     def createSimpleModel(self,pmodel='WAG'):
         
         ''' Establish a simple model (e.g., one type).
@@ -112,6 +415,7 @@ class partitionModel:
         if self.isprotein: simplemodel = "%s, p1 = 1-%d\n" % (
             pmodel,self.length)
         else: simplemodel = "DNA, p1 = 1-%d\n" % (self.length)
+        self.text += simplemodel
         self.handle.write(simplemodel)
         self.handle.close()
         
@@ -134,6 +438,7 @@ class partitionModel:
             par    = partnames[m]
             rl, ru = ranges[m]
             towr   = "%s, %s = %d-%d\n" % (mod,par,rl,ru)
+            self.text += towr
             self.handle.write(towr)
         self.handle.close()
         
@@ -13,6 +13,8 @@ operator. '''
 # E-mail: safatli@cs.dal.ca
 
 import newick, tree, base
+from array import array
+from random import sample
 
 # Exception Handling
 
@@ -45,7 +47,7 @@ class rearrangement:
 
     ''' Encapsulates a single rearrangement move of type SPR, NNI, ... '''
 
-    def __init__(self,struct,type,targ,dest):
+    def __init__(self,struct,type,targ,dest,via=None):
 
         ''' Initialize by providing a pointer to a base topology, a target
         branch to be moved, and its destination.
@@ -55,13 +57,16 @@ class rearrangement:
         :param type: the type of movement to perform
         :param targ: a target branch
         :param dest: a destination branch
+        :param via: for TBR moves, a branch beneath the target the moved
+        subtree is reconnected by (None for its current root)
         
         '''
         
         self.topol       = struct
         self.type        = type
         self.target      = targ
-        self.destination = dest    
+        self.destination = dest
+        self.via         = via
     
     def getType(self):
         
@@ -89,6 +94,18 @@ class rearrangement:
         
         return (self.type == TYPE_TBR)
     
+    def isPruneAndRegraft(self):
+        
+        ''' Determine whether the move prunes the subtree beneath the target
+        and regrafts it, as it is, onto the destination; otherwise, the subtree
+        is reconnected by another branch (or the rest of the tree is moved).
+        
+        :return: a boolean
+        
+        '''
+        
+        return (self.via == None and self.destination != None)
+    
     def toTopology(self):
         
         ''' Commit the actual move and return the topology.
@@ -97,7 +114,7 @@ class rearrangement:
         
         '''
         
-        topo = self.topol.move(self.target,self.destination)
+        topo = self.topol.move(self.target,self.destination,via=self.via)
         topo.rerootToLeaf()
         return topo
     
@@ -111,7 +128,7 @@ class rearrangement:
         '''
         
         return self.topol.move(self.target,self.destination,
-                               returnStruct=False)
+                               returnStruct=False,via=self.via)
     
     def toTree(self):
         
@@ -121,7 +138,9 @@ class rearrangement:
         
         '''
         
-        out = self.toTopology().toTree()
+        newi,struct = self.topol.moveToStrings(self.target,self.destination,
+                                               self.via)
+        out = tree.tree(newi,structure=struct)
         out.origin = self.getType()
         return out
     
@@ -138,6 +157,9 @@ class rearrangement:
     def __str__(self):
         
         t = self.getType()
+        if self.via:
+            return '<%s> move [%s] by [%s] to [%s]' % (
+                t,self.target,self.via,self.destination)
         return '<%s> move [%s] to [%s]' % (t,self.target,self.destination)
 
 # Tree structure.
@@ -159,7 +181,9 @@ class topology(base.treeStructure):
         '''
         
         self.root        = t
-        self.forbidden  = {}
+        self.order      = {}
+        self.extent     = {}
+        self.preorder   = []
         self.branches   = []
         self.locked     = []
         self.fakebranch = None
@@ -169,7 +193,7 @@ class topology(base.treeStructure):
         if t != None: 
             if rerootToLeaf: self.rerootToLeaf(toLeaf)
             self._getAllBranches()
-            self._getForbiddenStates()
+            self._numberBranches()
             self._clearInteriorNodeNames()
             if rerootToLeaf: self._lockLeafBranch()       
        
@@ -182,22 +206,57 @@ class topology(base.treeStructure):
             self.branches.extend(newick.getAllBranches(br))
         self.partitions = [[x for x in self.branches]]  
        
-    def _getForbiddenStates(self):
+    def _numberBranches(self):
+        
+        ''' PRIVATE: Number all branches in pre-order. The subtree beneath a
+        branch is then numbered consecutively after it, up to its extent, such
+        that membership in that subtree is a comparison of two numbers. '''
+        
+        self.order, self.extent = {}, {}
+        self.preorder = preorder = []
+        stack = list(reversed(self.root.children))
+        while stack:
+            br = stack.pop()
+            self.order[br] = len(preorder)
+            preorder.append(br)
+            stack.extend(reversed(br.child.children))
+        for br in reversed(preorder):
+            if br.child.children:
+                self.extent[br] = self.extent[br.child.children[-1]]
+            else: self.extent[br] = self.order[br]
+    
+    def _isInSubtree(self,br,x):
         
-        ''' PRIVATE: Construct forbidden state lists for each branch. '''
+        ''' PRIVATE: Whether a branch lies beneath another, or is that branch. '''
         
-        # Set up list for each branch.
-        for br in self.branches:
-            # Anything inside the subtree for that branch
-            # is forbidden to be moved to by this branch.
-            self.forbidden[br] = [_ for _ in newick.getAllBranches(br)]
-            # Any siblings are also forbidden 
-            # (give the same tree).
-            siblings = br.parent.children
-            siblings = [_ for _ in siblings if _!=br]
-            self.forbidden[br].extend(siblings)
-            # And the parent is forbidden.
-            self.forbidden[br].append(br.parent.parent)
+        return self.order[br] <= self.order[x] <= self.extent[br]
+    
+    def _isForbidden(self,br,x):
+        
+        ''' PRIVATE: Whether a branch is forbidden from being moved to another:
+        the latter is the branch itself or lies in its subtree, is a sibling, or
+        is the branch above its parent (all of which give the same tree). '''
+        
+        return (self._isInSubtree(br,x) or x.parent == br.parent or
+                x == br.parent.parent)
+    
+    def _isInPartition(self,b,x):
+        
+        ''' PRIVATE: Whether a branch could move to another without a violation
+        of any locks; that is, the two lie on the same side of every lock. '''
+        
+        if not x in self.order: return False
+        for lo in self.locked:
+            lb = lo.branch
+            if not lb in self.order: continue
+            if self._isInSubtree(lb,b) != self._isInSubtree(lb,x): return False
+        return True
+    
+    def _canMove(self,b,x):
+        
+        ''' PRIVATE: Whether a branch can be moved to another. '''
+        
+        return self._isInPartition(b,x) and not self._isForbidden(b,x)
         
     def _clearInteriorNodeNames(self):
         
@@ -230,14 +289,7 @@ class topology(base.treeStructure):
         ''' PRIVATE: Acquire the list of branches: those this particular branch
         could move to without violation of any locks and itself. '''
         
-        possible = [x for x in self.branches]
-        for lo in self.locked:
-            l,r = lo.getBranchListRepresentation()
-            if b in l: o = r
-            else: o = l
-            for i in o:
-                if i in possible: possible.remove(i)
-        return possible
+        return [x for x in self.branches if self._isInPartition(b,x)]
 
     def _flipOperation(self,opname,br):
         
@@ -437,78 +489,237 @@ class topology(base.treeStructure):
         self.locked.append(bipart)        
         return True
 
-    def move(self,branch,destination,returnStruct=True):
+    def _checkMove(self,branch,destination,via=None):
+        
+        ''' PRIVATE: Raise an error if a branch cannot be moved to a
+        destination branch (reconnected by a branch beneath it, if given). '''
+        
+        # Check reconnection.
+        if via != None:
+            if not branch in self.order or \
+               not via in self._getReconnections(branch):
+                raise RearrangementError(
+                    'Cannot reconnect by a branch outside of subtree.')
+            if not self._canReconnect(branch,via):
+                raise RearrangementError(
+                    'Cannot move outside of locked partition.')
+            if destination == None and branch.parent == self.root: return
+            if destination in branch.parent.children and destination != branch:
+                return
         
-        ''' Move a branch and attach to a destination branch. Return new
-        structure, or return merely the resultant Newick string.
-
-        :return: a :class:`.topology` object or a Newick string
-        
-        '''
+        # Check partitions.
+        if not self._isInPartition(branch,destination):
+            raise RearrangementError('Cannot move outside of locked partition.')
         
         # Cannot move to these.
-        forbidden = self.forbidden[branch]
-        if destination in forbidden:
+        if self._isForbidden(branch,destination):
             raise RearrangementError('Cannot move into subtree or to sibling.')
+    
+    def _getReconnections(self,branch):
         
-        # Check partitions.
-        partition = self._getPartition(branch)
-        if destination not in partition:
-            raise RearrangementError('Cannot move outside of locked partition.')
+        ''' PRIVATE: Acquire the branches beneath a branch its subtree could be
+        reconnected by other than its current root; those beneath its children
+        in pre-order. '''
+        
+        i,j = self.order[branch],self.extent[branch]
+        return [x for x in self.preorder[i+1:j+1] if x.parent != branch.child]
+    
+    def _canReconnect(self,branch,via):
+        
+        ''' PRIVATE: Whether the subtree beneath a branch could be reconnected
+        by a branch within it without a violation of any locks; that is, none
+        lie on the path between the two. '''
+        
+        for lo in self.locked:
+            lb = lo.branch
+            if not lb in self.order or lb == via: continue
+            if self.order[branch] < self.order[lb] and \
+               self._isInSubtree(lb,via): return False
+        return True
+    
+    def _applyReroot(self,branch,via):
+        
+        ''' PRIVATE: Reroot the subtree beneath a branch in place such that it
+        hangs from a branch within it, which is broken in half, without
+        checking. The node the subtree hung from becomes its new root; the
+        branches on the path to it are reversed.
+        
+        :return: what is needed to undo the reroot (see _undoReroot)
+        
+        '''
+        
+        # Get the path of branches from the root of the subtree.
+        r, path, q = branch.child, [], via.parent
+        while q != r:
+            path.append(q.parent)
+            q = q.parent.parent
+        path.reverse()
+        nodes = [r] + [b.child for b in path]
+        s = [b for b in r.children if b != path[0]][0]
+        
+        # Keep everything that will change.
+        undo = ([(n,list(n.children),n.parent) for n in nodes + [s.child]],
+                [(b,b.parent,b.child,b.branch_length) for b in path + [s,via]])
+        
+        # The first branch is reversed to the sibling; r is suppressed.
+        first = path[0]
+        first.parent, first.child = nodes[1], s.child
+        first.branch_length += s.branch_length
+        s.child.parent = first
+        
+        # Reverse the remaining branches along the path.
+        for i in xrange(2,len(nodes)):
+            b = path[i-1]
+            b.parent, b.child = nodes[i], nodes[i-1]
+            nodes[i-1].parent = b
+        for i in xrange(1,len(nodes)):
+            if i < len(path): down = path[i]
+            else: down = via
+            children = nodes[i].children
+            children[children.index(down)] = path[i-1]
+        
+        # Break the branch in half; r hangs in between.
+        half = via.branch_length/2.0
+        s.parent, s.child, s.branch_length = r, nodes[-1], half
+        nodes[-1].parent = s
+        via.parent, via.branch_length = r, half
+        r.children[r.children.index(first)] = via
+        return undo
+    
+    def _undoReroot(self,undo):
+        
+        ''' PRIVATE: Undo a reroot made in place by _applyReroot. '''
+        
+        nodes,branches = undo
+        for n,children,parent in nodes:
+            n.children[:] = children
+            n.parent = parent
+        for b,parent,child,length in branches:
+            b.parent, b.child, b.branch_length = parent, child, length
+    
+    def _applyMove(self,branch,destination,via=None):
+        
+        ''' PRIVATE: Move a branch and attach it to a destination branch in
+        place, without checking the move. Children keep their positions such
+        that the move can be undone exactly. If a branch beneath it is given,
+        the subtree is first rerooted there (a TBR move); without a
+        destination, it then stays where it is.
+        
+        :return: what is needed to undo the move (see _undoMove), or None if
+        the branch or destination is not attached to the tree
+        
+        '''
         
         # Get parents.
         s_parent = branch.parent       # Source parent. 
+        if s_parent == None: return None
+        if destination == None:
+            if via == None: return None
+            return (self._applyReroot(branch,via),None)
         t_parent = destination.parent  # Target parent.
-        
-        # If parents were found, do transform.
-        if s_parent != None and t_parent != None:
+        if t_parent == None: return None
+        rerooted = None
+        if via != None: rerooted = self._applyReroot(branch,via)
             
-            # Remove the branch.
-            s_parent.children.remove(branch)
-            
-            # Create new node.
-            node = newick.node('',[branch])
-            
-            # Break destination branch in half, attach.
-            half  = destination.branch_length/2.0
-            outer = newick.branch(destination.child,half,node)
-            inner = newick.branch(node,half,t_parent)
-            t_parent.children.remove(destination)
-            t_parent.children.append(inner)
-            node.children.append(outer)
-            destination.child.parent = outer
-            node.parent = inner
-            
-            # Check degree of source parent; combine edges if necessary.
-            if len(s_parent.children) == 1:
-                a = s_parent.children[0]
-                b = s_parent.parent
-                end = a.child
-                start = b.parent
-                comb = a.branch_length + b.branch_length
-                fakebr = newick.branch(end,comb,start)
-                end.parent = fakebr
-                start.children.remove(b)
-                start.children.append(fakebr)
-            
-            if returnStruct:
-                # Immutable so recreate new structure.
-                result = dup(self)
-            else: result = self.toNewick()
-            
-            # Undo changes.
-            s_parent.children.append(branch)
-            if len(s_parent.children) == 2:
+        # Remove the branch.
+        s_index = s_parent.children.index(branch)
+        del s_parent.children[s_index]
+        
+        # Create new node.
+        node = newick.node('',[branch])
+        
+        # Break destination branch in half, attach.
+        half  = destination.branch_length/2.0
+        outer = newick.branch(destination.child,half,node)
+        inner = newick.branch(node,half,t_parent)
+        t_index = t_parent.children.index(destination)
+        t_parent.children[t_index] = inner
+        node.children.append(outer)
+        destination.child.parent = outer
+        node.parent = inner
+        
+        # Check degree of source parent; combine edges if necessary.
+        combined = None
+        if len(s_parent.children) == 1:
+            a = s_parent.children[0]
+            b = s_parent.parent
+            end = a.child
+            start = b.parent
+            comb = a.branch_length + b.branch_length
+            fakebr = newick.branch(end,comb,start)
+            end.parent = fakebr
+            b_index = start.children.index(b)
+            start.children[b_index] = fakebr
+            combined = (a,b,end,start,b_index)
+        
+        return (rerooted,(branch,destination,s_parent,s_index,t_parent,t_index,
+                          combined))
+    
+    def _undoMove(self,undo):
+        
+        ''' PRIVATE: Undo a move made in place by _applyMove. '''
+        
+        rerooted,moved = undo
+        if moved:
+            branch,destination,s_parent,s_index,t_parent,t_index,combined = \
+                moved
+            if combined:
+                a,b,end,start,b_index = combined
+                start.children[b_index] = b
                 end.parent = a
-                start.children.append(b)
-                start.children.remove(fakebr)
-            t_parent.children.append(destination)
-            t_parent.children.remove(inner)
+            t_parent.children[t_index] = destination
             destination.child.parent = destination
+            s_parent.children.insert(s_index,branch)
+        if rerooted: self._undoReroot(rerooted)
+    
+    def move(self,branch,destination,returnStruct=True,via=None):
+        
+        ''' Move a branch and attach to a destination branch. Return new
+        structure, or return merely the resultant Newick string. If a branch
+        beneath the moved branch is given, the subtree is reconnected by it
+        (a TBR move).
 
-            return result
+        :return: a :class:`.topology` object or a Newick string
         
-        else: return None
+        '''
+        
+        self._checkMove(branch,destination,via)
+        undo = self._applyMove(branch,destination,via)
+        if undo == None: return None
+        
+        if returnStruct:
+            # Immutable so recreate new structure.
+            result = dup(self)
+        else: result = self.toNewick()
+        
+        # Undo changes.
+        self._undoMove(undo)
+        return result
+    
+    def moveToStrings(self,branch,destination,via=None):
+        
+        ''' Move a branch and attach to a destination branch; return the
+        resultant Newick string alongside its structure (a Newick string
+        without branch lengths), as a :class:`.tree.tree` holds them. Both are
+        written straight from the moved tree; if this topology is rooted at
+        its lowest-order leaf, as a tree's topology is, no new structure is
+        created or parsed.
+        
+        :return: a tuple of two Newick strings, or None
+        
+        '''
+        
+        self._checkMove(branch,destination,via)
+        if not self.isCanonical():
+            newi = self.move(branch,destination,returnStruct=False,via=via)
+            if newi == None: return None
+            t = tree.tree(newi,check=True)
+            return t.getNewick(),t.getStructure()
+        undo = self._applyMove(branch,destination,via)
+        if undo == None: return None
+        result = (self.toNewick(),self.toStructure())
+        self._undoMove(undo)
+        return result
         
     def SPR(self,branch,destination):
         
@@ -526,7 +737,8 @@ class topology(base.treeStructure):
     def NNI(self,branch,destination):
         
         ''' Perform an NNI move of a branch to a destination, only if that
-        destination branch is a parent's parent or a parent's sibling. Returns a
+        destination branch is a sibling of the branch above its parent (so
+        that the two are interchanged across that branch). Returns a
         rearrangement structure (not the actual new structure) that can then be
         polled for the actual move; this is in order to save memory.
         
@@ -534,27 +746,48 @@ class topology(base.treeStructure):
         
         '''
         
-        if newick.isSibling(branch.parent,destination) or \
-           (branch.parent and destination == branch.parent.parent):
+        above = branch.parent.parent
+        if above and destination != above and \
+           newick.isSibling(above,destination):
             return rearrangement(self,TYPE_NNI,branch,destination)
         else: return None
     
-    def iterSPRForBranch(self,br,flip=True):    
+    def TBR(self,branch,destination,via=None):
+        
+        ''' Perform a TBR move: bisect the tree at a branch and reconnect the
+        subtree beneath it by a branch within it (or its current root, if
+        None) to a destination branch (or to where it was, if None). Returns a
+        rearrangement structure (not the actual new structure) that can then be
+        polled for the actual move; this is in order to save memory.
+        
+        :return: a :class:`.rearrangement` object
+        
+        '''
+        
+        return rearrangement(self,TYPE_TBR,branch,destination,via)
+    
+    def iterSPRForBranch(self,br,flip=True,unique=False):    
         
         ''' Consider all valid SPR moves for a given branch 
         in the topology and yield all possible rearrangements
         as a generator.
 
+        :param flip: whether to also move the rest of the tree by flipping it
+        around (rerooting it in the subtree beneath the branch)
+        :param unique: whether to instead only yield moves such that, over all
+        branches, every distinct neighboring topology is yielded once (see
+        _iterUniqueSPRForBranch)
         :return: a generator of :class:`.rearrangement` objects
         
         '''    
     
         # Go through possible moves.
-        partition = self._getPartition(br)
-        if (partition == None):
+        if not br in self.order:
             raise RearrangementError('Branch not in any partition of topology.')
-        forbidden = self.forbidden[br]
-        possible  = [x for x in partition if not x in forbidden and not x == br]
+        if unique:
+            for move in self._iterUniqueSPRForBranch(br): yield move
+            return
+        possible = [x for x in self.branches if self._canMove(br,x)]
         
         # Pass rearrangement structure as yielded object.
         for dest in possible:
@@ -566,7 +799,37 @@ class topology(base.treeStructure):
             ite = self._flipOperation('iterSPRForBranch',br) 
             for it in ite: yield it
     
-    def allSPRForBranch(self,br,flip=True):
+    def _iterUniqueSPRForBranch(self,br):
+        
+        ''' PRIVATE: Yield SPR moves that bisect the tree at a branch and prune
+        either the subtree beneath it or the rest of the tree (by rerooting
+        the subtree; see TBR), but not those that regraft onto a branch next to
+        where it was pruned. All of these give distinct topologies. The latter
+        are NNI moves, each of which four such moves give; only the NNI moves
+        of the branch are yielded instead. '''
+        
+        # Prune the subtree; leave out branches next to where it was.
+        if br.parent != self.root:
+            p, above = br.parent, br.parent.parent
+            sibling  = [x for x in p.children if x != br][0]
+            near = set(sibling.child.children)
+            near.update(x for x in above.parent.children if x != above)
+            near.add(above.parent.parent)
+            for dest in self.branches:
+                if not dest in near and self._canMove(br,dest):
+                    yield self.SPR(br,dest)
+        else: sibling = None
+        
+        # Prune the rest of the tree; regraft onto the subtree.
+        for via in self._getReconnections(br):
+            if via.parent.parent.parent == br.child: continue
+            if self._canReconnect(br,via):
+                yield rearrangement(self,TYPE_SPR,br,sibling,via)
+        
+        # Regraft next to where it was pruned (NNI).
+        for move in self.iterNNIForBranch(br,flip=False): yield move
+    
+    def allSPRForBranch(self,br,flip=True,unique=False):
         
         ''' Consider all valid SPR moves for a given branch in the topology and
         return all possible rearrangements.
@@ -575,20 +838,23 @@ class topology(base.treeStructure):
         
         '''
         
-        return [x for x in self.iterSPRForBranch(br,flip)]
+        return [x for x in self.iterSPRForBranch(br,flip,unique)]
     
-    def allSPR(self):
+    def allSPR(self,unique=False):
         
         ''' Consider all valid SPR moves for a given topology and return all
         possible rearrangements.
         
+        :param unique: whether to give every distinct neighboring topology
+        once, rather than all moves from both sides of every branch
+        :type unique: a boolean
         :return: a list of :class:`.rearrangement` objects
         
         '''
 
         # Output list of structures.
-        li = []        
-        for branch in self.branches: li.extend(self.allSPRForBranch(branch))
+        li,spr = [],self.allSPRForBranch
+        for branch in self.branches: li.extend(spr(branch,unique=unique))
         
         # Return the list.
         return li
@@ -603,13 +869,12 @@ class topology(base.treeStructure):
         '''
         
         # Go through possible moves.
-        partition = self._getPartition(br)
-        if (partition == None):
+        if not br in self.order:
             raise RearrangementError('Branch not in any partition of topology.')
-        possible  = [br.parent.parent] + br.parent.children
-        forbidden = self.forbidden[br]
-        possible  = [x for x in partition if x in possible and 
-                     not x in forbidden and not x == None]
+        above     = br.parent.parent
+        if above: possible = [x for x in above.parent.children if x != above]
+        else:     possible = []
+        possible  = [x for x in possible if self._canMove(br,x)]
         
         # Pass rearrangement structure as yielded object.
         for dest in possible:
@@ -632,34 +897,102 @@ class topology(base.treeStructure):
         
         return [x for x in self.iterNNIForBranch(br,flip)]
 
-    def allNNI(self):
+    def allNNI(self,unique=False):
         
         ''' Consider all valid NNI moves for a given topology and return all
         possible rearrangements.
         
+        :param unique: whether to give every distinct neighboring topology
+        once; the tree is then not flipped around, as every NNI move is
+        already made across some branch
+        :type unique: a boolean
         :return: a list of :class:`.rearrangement` objects        
         
         '''
 
         # Output list of structures.
         li,nni = [],self.allNNIForBranch        
-        for branch in self.branches: li.extend(nni(branch))
+        for branch in self.branches: li.extend(nni(branch,not unique))
+        return li
+    
+    def iterTBRForBranch(self,br,shuffle=False):
+        
+        ''' Consider all valid TBR moves that bisect the tree at a given branch
+        and yield all possible rearrangements as a generator. Every pair of a
+        branch of the subtree beneath it and a branch of the rest of the tree
+        to reconnect by is yielded once; the tree need not be flipped around
+        as both sides of the bisection are covered.
+        
+        :param shuffle: whether to yield rearrangements in a random order
+        :type shuffle: a boolean
+        :return: a generator of :class:`.rearrangement` objects
+        
+        '''
+        
+        if not br in self.order:
+            raise RearrangementError('Branch not in any partition of topology.')
+        
+        # Reconnecting by the current root of the subtree is an SPR move.
+        dests = [x for x in self.branches if self._canMove(br,x)]
+        vias  = [x for x in self._getReconnections(br)
+                 if self._canReconnect(br,x)]
+        
+        # Otherwise, the sibling (where the subtree was pruned) is possible 
+        # too; a subtree hanging off the root stays where it is.
+        if br.parent == self.root: others = dests + [None]
+        else: others = dests + [x for x in br.parent.children if x != br]
+        
+        # Pass rearrangement structure as yielded object.
+        total = len(dests) + len(vias)*len(others)
+        if shuffle: order = sample(xrange(total),total)
+        else: order = xrange(total)
+        for i in order:
+            if i < len(dests): yield self.TBR(br,dests[i])
+            else:
+                via,dest = divmod(i-len(dests),len(others))
+                yield self.TBR(br,others[dest],vias[via])
+    
+    def allTBRForBranch(self,br):
+        
+        ''' Consider all valid TBR moves that bisect the tree at a given branch
+        and return all possible rearrangements.
+        
+        :return: a list of :class:`.rearrangement` objects
+        
+        '''
+        
+        return [x for x in self.iterTBRForBranch(br)]
+    
+    def allTBR(self):
+        
+        ''' Consider all valid TBR moves for a given topology and return all
+        possible rearrangements.
+        
+        :return: a list of :class:`.rearrangement` objects
+        
+        '''
+        
+        # Output list of structures.
+        li = []
+        for branch in self.branches: li.extend(self.allTBRForBranch(branch))
         return li
     
-    def allType(self,type=TYPE_SPR):
+    def allType(self,type=TYPE_SPR,unique=False):
     
         ''' Consider all valid moves of a given rearrangement operator for a
         given topology. Uses a given rearrangement operator type defined in this
         module. For example, calling this function by providing TYPE_NNI as the
         type will iterate over all NNI operations. By default, the type is
-        TYPE_SPR.
+        TYPE_SPR. SPR and NNI moves can be restricted to give every distinct
+        neighboring topology once.
         
         :return: a list of :class:`.rearrangement` objects
         
         '''
         
-        if (type == TYPE_SPR): return self.allSPR()
-        elif (type == TYPE_NNI): return self.allNNI()
+        if (type == TYPE_SPR): return self.allSPR(unique)
+        elif (type == TYPE_NNI): return self.allNNI(unique)
+        elif (type == TYPE_TBR): return self.allTBR()
         else: raise RearrangementError('No rearrangement type of that form is\
          defined.')
     
@@ -668,10 +1001,12 @@ class topology(base.treeStructure):
         ''' Iterate over all possible rearrangements for a branch using a given
         rearrangement operator type defined in this module. For example, calling
         this function by providing TYPE_NNI as the type will iterate over all
-        NNI operations. By default, the type is TYPE_SPR. '''
+        NNI operations. By default, the type is TYPE_SPR. TBR moves cover both
+        sides of a branch and are never flipped. '''
         
         if (type == TYPE_SPR): return self.iterSPRForBranch(br,flip)
         elif (type == TYPE_NNI): return self.iterNNIForBranch(br,flip)
+        elif (type == TYPE_TBR): return self.iterTBRForBranch(br)
         else: raise RearrangementError('No rearrangement type of that form is\
          defined.')
     
@@ -698,7 +1033,7 @@ class topology(base.treeStructure):
         self.orig = newickstr
         if self.rerootFlag: self.rerootToLeaf(self.rerootLoc)
         self._getAllBranches()
-        self._getForbiddenStates()
+        self._numberBranches()
         self._clearInteriorNodeNames()
         if self.rerootFlag: self._lockLeafBranch()
         
@@ -712,6 +1047,31 @@ class topology(base.treeStructure):
         
         return self.__str__()
     
+    def toStructure(self):
+        
+        ''' Return the structure of the tree: its Newick string without any
+        branch lengths.
+        
+        :return: a Newick string (rooted)
+        
+        '''
+        
+        return newick.toStructure(self.root) + ';'
+    
+    def isCanonical(self):
+        
+        ''' Determine whether this topology is rooted at its lowest-order leaf,
+        such that its Newick string is that of any tree of the same topology.
+        
+        :return: a boolean
+        
+        '''
+        
+        if not self.rerootFlag: return False
+        if self.rerootLoc == None: return True
+        lowest = min(leaf.label for leaf in self.getAllLeaves())
+        return (self.rerootLoc.label == lowest)
+    
     def toUnrootedNewick(self):
         
         ''' Return the newick string of the tree as an unrooted topology with a
@@ -751,3 +1111,487 @@ class topology(base.treeStructure):
     def __str__(self):
         
         return str(self.root) + ';'
+
+# Compact tree structure.
+
+class compactTopology(object):
+    
+    ''' Encapsulate a binary tree topology as arrays of integers rather than
+    linked nodes and branches. Taxa are numbered in lexicographic order of
+    their names and are the first nodes; internal nodes follow. Every node
+    has a parent, two children (none for leaves; -1) and the length of the
+    branch to its parent, such that a branch is named by the node beneath it.
+    As for a topology, the tree is rooted at its lowest-order leaf, the
+    branch to which is locked. Pre- and post-order traversals are computed
+    once. Is immutable; moves create a new structure by copying the arrays
+    and changing a handful of entries. '''
+    
+    def __init__(self,taxa,parents,left,right,lengths,root):
+        
+        ''' Initialize structure from its arrays (see fromTopology).
+        
+        :param taxa: taxa names in lexicographic order
+        :type taxa: a tuple of strings
+        :param parents: the parent of every node (-1 for the root)
+        :param left: the first child of every node (-1 for leaves)
+        :param right: the second child of every node (-1 for leaves)
+        :param lengths: the length of the branch above every node
+        :param root: the root node
+        :type root: an integer
+        
+        '''
+        
+        self.taxa      = taxa
+        self.parents   = array('i',parents)
+        self.left      = array('i',left)
+        self.right     = array('i',right)
+        self.lengths   = array('d',lengths)
+        self.root      = root
+        self.preorder  = None
+        self.postorder = None
+        self.position  = None # Of every node in the pre-order traversal.
+        self.size      = None # Of the subtree beneath every node.
+        
+    @staticmethod
+    def fromTopology(topo):
+        
+        ''' Build a compact topology from a topology; it is first rerooted
+        to its lowest-order leaf if it is not. Children keep their order.
+        
+        :param topo: a binary topology
+        :type topo: a :class:`.topology` object
+        :return: a :class:`.compactTopology` object
+        
+        '''
+        
+        if not topo.isCanonical(): topo = dup(topo)
+        taxa   = tuple(sorted(leaf.label for leaf in topo.getAllLeaves()))
+        leaves = dict((t,i) for i,t in enumerate(taxa))
+        num    = 2*len(taxa)-1
+        parents,left,right = [-1]*num,[-1]*num,[-1]*num
+        lengths = [0.]*num
+        index   = dict()
+        inner   = len(taxa)
+        for n in topo.getAllNodes():
+            if len(n.children) == 0: index[n] = leaves[n.label]
+            elif len(n.children) != 2: raise RearrangementError(
+                'Compact topologies must be binary.')
+            else:
+                index[n] = inner
+                inner   += 1
+            i = index[n]
+            if n.parent:
+                parents[i] = index[n.parent.parent]
+                lengths[i] = n.parent.branch_length
+        for n,i in index.iteritems():
+            if n.children:
+                left[i]  = index[n.children[0].child]
+                right[i] = index[n.children[1].child]
+        return compactTopology(taxa,parents,left,right,lengths,
+                               index[topo.getRoot()])
+    
+    @staticmethod
+    def fromNewick(newickstr):
+        
+        ''' Build a compact topology from a Newick string.
+        
+        :param newickstr: a Newick string of a binary tree
+        :type newickstr: a string
+        :return: a :class:`.compactTopology` object
+        
+        '''
+        
+        topo = topology()
+        topo.fromNewick(newickstr)
+        return compactTopology.fromTopology(topo)
+    
+    def __len__(self):
+        
+        return len(self.parents)
+    
+    def _traverse(self):
+        
+        ''' PRIVATE: Compute pre- and post-order traversals, the position of
+        every node in the former, and the size of every subtree. '''
+        
+        left,right = self.left,self.right
+        pre, post = array('i'), array('i')
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            pre.append(n)
+            if left[n] >= 0: stack.extend((right[n],left[n]))
+        stack = [self.root]
+        while stack:
+            n = stack.pop()
+            post.append(n)
+            if left[n] >= 0: stack.extend((left[n],right[n]))
+        post.reverse()
+        position = array('i',[0]*len(pre))
+        for i,n in enumerate(pre): position[n] = i
+        size = array('i',[1]*len(pre))
+        for n in post:
+            if left[n] >= 0: size[n] += size[left[n]] + size[right[n]]
+        self.preorder, self.postorder = pre, post
+        self.position, self.size = position, size
+        
+    def getPreOrderTraversal(self):
+        
+        ''' Get all nodes in pre-order.
+        
+        :return: an array of integers
+        
+        '''
+        
+        if self.preorder == None: self._traverse()
+        return self.preorder
+    
+    def getPostOrderTraversal(self):
+        
+        ''' Get all nodes in post-order.
+        
+        :return: an array of integers
+        
+        '''
+        
+        if self.postorder == None: self._traverse()
+        return self.postorder
+    
+    def isInSubtree(self,n,top):
+        
+        ''' Determine whether a node is in the subtree beneath another node
+        (including that node).
+        
+        :param n: a node
+        :param top: the node at the top of the subtree
+        :return: a boolean
+        
+        '''
+        
+        if self.position == None: self._traverse()
+        at = self.position[top]
+        return (at <= self.position[n] < at+self.size[top])
+    
+    def getBranches(self):
+        
+        ''' Return all branches, named by the node beneath them.
+        
+        :return: a list of integers
+        
+        '''
+        
+        return [n for n in xrange(len(self)) if n != self.root]
+    
+    def getSibling(self,n):
+        
+        ''' Get the other child of the parent of a node.
+        
+        :param n: a node other than the root
+        :return: an integer
+        
+        '''
+        
+        p = self.parents[n]
+        if self.left[p] == n: return self.right[p]
+        return self.left[p]
+    
+    def _getLockedLeaf(self):
+        
+        ''' PRIVATE: Get the leaf the tree is rooted at. '''
+        
+        if self.left[self.root] < len(self.taxa): return self.left[self.root]
+        return self.right[self.root]
+    
+    def canSPR(self,n,dest):
+        
+        ''' Determine whether an SPR move of the branch above a node to the
+        branch above another node is permitted, in constant time: the
+        destination must not be in the moved subtree, a sibling, the branch
+        above the parent, or the locked leaf branch.
+        
+        :param n: a node to move
+        :param dest: a node to move above
+        :return: a boolean
+        
+        '''
+        
+        root = self.root
+        if n == root or dest == root: return False
+        p = self.parents[n]
+        if p == root or dest == p: return False
+        if dest == self.getSibling(n) or dest == self._getLockedLeaf():
+            return False
+        return not self.isInSubtree(dest,n)
+    
+    def canNNI(self,n,dest):
+        
+        ''' Determine whether an NNI move of the branch above a node to the
+        branch above another node is permitted: the destination must be the
+        sibling of the parent of that node (an uncle).
+        
+        :param n: a node to move
+        :param dest: a node to move above
+        :return: a boolean
+        
+        '''
+        
+        if n == self.root or self.parents[n] == self.root: return False
+        return (self.canSPR(n,dest) and 
+                dest == self.getSibling(self.parents[n]))
+    
+    def canReroot(self,n,via):
+        
+        ''' Determine whether the subtree beneath a node can be rerooted at the
+        branch above another node; equivalently, whether the rest of the tree
+        can be moved there by an SPR move. That node must be in the subtree
+        but neither its top nor a child of it (which give the same tree).
+        
+        :param n: a node at the top of the subtree
+        :param via: a node to reroot above
+        :return: a boolean
+        
+        '''
+        
+        if n == self.root or via == n or self.parents[via] == n: return False
+        return self.isInSubtree(via,n)
+    
+    def _move(self,n,dest):
+        
+        ''' PRIVATE: Create the structure resulting from moving the branch
+        above a node to the branch above another node, without checking the
+        move. The parent of the moved node is reused as the new node. '''
+        
+        parents,left,right = array('i',self.parents),array('i',self.left),\
+            array('i',self.right)
+        lengths = array('d',self.lengths)
+        p = parents[n]
+        s = self.getSibling(n)
+        g = parents[p]
+        
+        # Prune: the sibling takes the place of the parent.
+        if left[g] == p: left[g] = s
+        else: right[g] = s
+        parents[s] = g
+        lengths[s] += lengths[p]
+        
+        # Regraft: the parent takes the place of the destination.
+        t = parents[dest]
+        if left[t] == dest: left[t] = p
+        else: right[t] = p
+        parents[p], left[p], right[p], parents[dest] = t, n, dest, p
+        half = lengths[dest]/2.0
+        lengths[p], lengths[dest] = half, half
+        return compactTopology(self.taxa,parents,left,right,lengths,
+                               self.root)
+    
+    def _reroot(self,n,via):
+        
+        ''' PRIVATE: Create the structure resulting from rerooting the subtree
+        beneath a node at the branch above another node in it, without
+        checking. The top node of the subtree is reused as its new root; the
+        branches on the path to it are reversed. '''
+        
+        parents,left,right = array('i',self.parents),array('i',self.left),\
+            array('i',self.right)
+        lengths, old = array('d',self.lengths), self.lengths
+        
+        # Get the path of nodes from the top of the subtree.
+        path = [self.parents[via]]
+        while path[-1] != n: path.append(self.parents[path[-1]])
+        path.reverse()
+        s = self.getSibling(path[1])
+        
+        # Reverse the path; each node takes its parent as a child instead.
+        down = [via] + path[:0:-1]
+        for i in xrange(len(path)-1,0,-1):
+            q, up = path[i], path[i-1]
+            if up == n: up = s
+            if left[q] == down[len(path)-1-i]: left[q] = up
+            else: right[q] = up
+            parents[up] = q
+            if up == s: lengths[s] = old[s] + old[path[1]]
+            else: lengths[up] = old[path[i]]
+        
+        # The top node hangs in between the halves of the branch.
+        half = old[via]/2.0
+        left[n], right[n] = via, path[-1]
+        parents[via], parents[path[-1]] = n, n
+        lengths[via], lengths[path[-1]] = half, half
+        return compactTopology(self.taxa,parents,left,right,lengths,
+                               self.root)
+    
+    def SPR(self,n,dest,via=None):
+        
+        ''' Perform an SPR move of the branch above a node to the branch
+        above another node, creating a new node there. If a node beneath the
+        former is given instead of a destination, the rest of the tree is
+        moved to the branch above it (see canReroot).
+        
+        :param n: a node to move
+        :param dest: a node to move above (or None)
+        :param via: a node to move the rest of the tree above (or None)
+        :return: a new :class:`.compactTopology` object
+        
+        '''
+        
+        if via != None:
+            if dest != None or not self.canReroot(n,via):
+                raise RearrangementError('Cannot move rest of tree there.')
+            return self._reroot(n,via)
+        if not self.canSPR(n,dest):
+            raise RearrangementError('Cannot move into subtree or to sibling.')
+        return self._move(n,dest)
+    
+    def NNI(self,n,dest):
+        
+        ''' Perform an NNI move of the branch above a node to the branch
+        above the sibling of its parent.
+        
+        :param n: a node to move
+        :param dest: a node to move above
+        :return: a new :class:`.compactTopology` object
+        
+        '''
+        
+        if not self.canNNI(n,dest):
+            raise RearrangementError('NNI moves go to the sibling of a parent.')
+        return self._move(n,dest)
+    
+    def iterSPR(self):
+        
+        ''' Iterate over all permitted SPR moves of subtrees as pairs of a
+        node to move and a node to move above. These are the moves of
+        :func:`topology.iterSPRForBranch` without flipping; moves of the rest
+        of the tree are not included (see iterUniqueSPR).
+        
+        :return: a generator of tuples of integers
+        
+        '''
+        
+        branches = self.getBranches()
+        for n in branches:
+            for dest in branches:
+                if self.canSPR(n,dest): yield (n,dest)
+    
+    def iterUniqueSPR(self):
+        
+        ''' Iterate over SPR moves such that every distinct neighboring
+        topology is given once, as :func:`topology.allSPR` does when unique.
+        Moves are triples of a node to move, a node to move above and a node
+        to move the rest of the tree above (see SPR); one of the latter two is
+        None. Moves next to where a subtree was pruned are only given as NNI
+        moves.
+        
+        :return: a generator of tuples of integers (or None)
+        
+        '''
+        
+        if self.position == None: self._traverse()
+        root, parents = self.root, self.parents
+        branches = self.getBranches()
+        for n in branches:
+            p = parents[n]
+            
+            # Move the subtree; leave out branches next to where it was.
+            if p != root:
+                s, g = self.getSibling(n), parents[p]
+                near = set([g, self.getSibling(p)])
+                if self.left[s] >= 0: near.update((self.left[s],self.right[s]))
+                for dest in branches:
+                    if not dest in near and self.canSPR(n,dest):
+                        yield (n,dest,None)
+            
+            # Move the rest of the tree into the subtree.
+            at = self.position[n]
+            for via in self.preorder[at+1:at+self.size[n]]:
+                if parents[parents[via]] != n and self.canReroot(n,via):
+                    yield (n,None,via)
+            
+            # Move next to where it was (NNI).
+            if p != root and parents[p] != root:
+                dest = self.getSibling(p)
+                if self.canSPR(n,dest): yield (n,dest,None)
+    
+    def iterNNI(self):
+        
+        ''' Iterate over all permitted NNI moves as pairs of a node to move
+        and a node to move above.
+        
+        :return: a generator of tuples of integers
+        
+        '''
+        
+        for n in self.getBranches():
+            p = self.parents[n]
+            if p == self.root or self.parents[p] == self.root: continue
+            dest = self.getSibling(p)
+            if self.canSPR(n,dest): yield (n,dest)
+    
+    def _write(self,withLengths=True):
+        
+        ''' PRIVATE: Write the tree as a topology would, children of a node
+        sorted by label (empty for internal nodes). '''
+        
+        taxa,left,right,lengths = self.taxa,self.left,self.right,self.lengths
+        num, out = len(taxa), [None]*len(self)
+        for n in self.getPostOrderTraversal():
+            if n < num: st = taxa[n]
+            else:
+                a,b = left[n],right[n]
+                if (taxa[b] if b < num else '') < (taxa[a] if a < num else ''):
+                    a,b = b,a
+                st = '(%s,%s)' % (out[a],out[b])
+                out[a] = out[b] = None
+            if withLengths and lengths[n] > 0:
+                st = '%s:%s' % (st,str(lengths[n]))
+            out[n] = st
+        return out[self.root] + ';'
+    
+    def toNewick(self):
+        
+        ''' Return the Newick string of the tree; it is that of the
+        corresponding topology.
+        
+        :return: a Newick string (rooted)
+        
+        '''
+        
+        return self._write()
+    
+    def toStructure(self):
+        
+        ''' Return the structure of the tree: its Newick string without any
+        branch lengths.
+        
+        :return: a Newick string (rooted)
+        
+        '''
+        
+        return self._write(False)
+    
+    def toTopology(self):
+        
+        ''' Return the topology for this structure.
+        
+        :return: a new :class:`.topology` object
+        
+        '''
+        
+        topo = topology()
+        topo.fromNewick(self.toNewick())
+        return topo
+    
+    def toTree(self):
+        
+        ''' Return the tree object for this structure.
+        
+        :return: a new :class:`.tree.tree` object
+        
+        '''
+        
+        return tree.tree(self.toNewick(),structure=self.toStructure())
+    
+    def __str__(self):
+        
+        return self.toNewick()
+
@@ -4,13 +4,118 @@
 # Author: Alex Safatli
 # E-mail: safatli@cs.dal.ca
 
-import pll, parsimony, fitch, p4, tree, rearrangement, alignment
+import pll, parsimony, fitch, p4, tree, rearrangement, alignment, numpy
+import likelihood, cache
+from hashlib import sha1
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+beagleEnabled = True
 try:
     from model import DiscreteStateModel as State
     from pytbeaglehon.disc_state_cont_time_model import HKY85Model
     from pytbeaglehon.tree_scorer import create_toggle_partial_tree_scorer as Scorer
     from pytbeaglehon.tests.util import TreeForTesting as T
-except: pass
+except: beagleEnabled = False
+
+# Constants
+
+LIKELIHOOD_QUICK = 0 # Inherited (or default) branch lengths.
+LIKELIHOOD_LOCAL = 1 # Optimize only branches around what is not cached.
+LIKELIHOOD_FULL  = 2 # Optimize all branch lengths.
+
+BEAGLE_DEFAULT_KAPPA = 2.0
+
+# Likelihood Cache Keys
+
+def _getLikelihoodCacheKey(alignment,attribs=None):
+
+    ''' PRIVATE: Get a fingerprint of what libpll scores log-likelihood
+    against: the alignment, its partition model, and rate heterogeneity. '''
+
+    if attribs == None: attribs = pll.getInstanceAttributes(alignment)
+    model = sha1(pll.getPartitionModel(alignment).getText()).hexdigest()
+    return 'pll:%s:%s:%s' % (alignment.getFingerprint(),model,
+                             'gamma' if attribs.gamma else 'cat')
+
+def _getPruningCacheKey(engine):
+
+    ''' PRIVATE: Get a fingerprint of what the likelihood module scores
+    log-likelihood against: the alignment and substitution model. '''
+
+    return 'pruning:%s:%s' % (engine.alignment.getFingerprint(),
+                              engine.model.getFingerprint())
+
+# BEAGLE Scoring Sessions
+
+class beagleScorer(object):
+    
+    ''' A scoring session against BEAGLE via the pytbeaglehon wrapper
+    library for a single alignment. The HKY85 model and the state data of the
+    alignment are set up once and shared by every tree scored; a tree scorer
+    is built for each tree, as pytbeaglehon gives no way to hand an existing
+    scorer a new topology. Only nucleotide alignments are supported. '''
+    
+    def __init__(self,alignment,kappa=BEAGLE_DEFAULT_KAPPA):
+        
+        ''' Initialize this session.
+        
+        :param alignment: An alignment object.
+        :type alignment: :class:`.alignment.alignment`
+        :param kappa: The transition/transversion ratio of the model.
+        :type kappa: A floating point value.
+        
+        '''
+        
+        if (alignment.getDim() != 4):
+            raise ValueError('BEAGLE scoring requires a nucleotide alignment.')
+        stmod       = alignment.getStateModel()
+        self.kappa  = kappa
+        self.model  = HKY85Model(kappa,stmod.getStateFreqs())
+        self.states = stmod.getAlignmentAsStateList()
+        
+    def getLogLikelihood(self,tree):
+        
+        ''' Acquire the log-likelihood of a tree against this session.
+        
+        :param tree: A tree object.
+        :type tree: :class:`.tree.tree`
+        :returns: A floating point value.
+        
+        '''
+        
+        topo = T(tree.getSimpleNewick()[:-1])
+        return Scorer(model_list=[self.model],data=self.states,tree=topo)()
+    
+    def getLogLikelihoods(self,trees):
+        
+        ''' Acquire the log-likelihoods of many trees against this session.
+        
+        :param trees: A list of tree objects.
+        :type trees: A list of :class:`.tree.tree` objects.
+        :returns: A list of floating point values.
+        
+        '''
+        
+        return [self.getLogLikelihood(t) for t in trees]
+
+def getBeagleScorer(alignment,kappa=BEAGLE_DEFAULT_KAPPA):
+    
+    ''' Acquire the BEAGLE scoring session kept for an alignment, starting
+    one if there is none or it does not use the given model parameters.
+    
+    :param alignment: An alignment object.
+    :type alignment: :class:`.alignment.alignment`
+    :param kappa: The transition/transversion ratio of the model.
+    :type kappa: A floating point value.
+    :returns: A :class:`.beagleScorer` object.
+    
+    '''
+    
+    scorer = getattr(alignment,'_beagleScorer',None)
+    if scorer == None or scorer.kappa != kappa:
+        scorer = beagleScorer(alignment,kappa)
+        alignment._beagleScorer = scorer
+    return scorer
 
 # Scoring Functions
 
@@ -18,7 +123,8 @@ def beaglegetLogLikelihood(tree,alignment):
     
     ''' Acquire log-likelihood via C++ library
     BEAGLE via use of pybeaglethon wrapper library.
-    Currently uses HKY85 model. 
+    Currently uses HKY85 model. The model and data are
+    set up once per alignment (see getBeagleScorer).
     
     :param tree: A tree object.
     :type tree: :class:`.tree.tree`
@@ -28,20 +134,18 @@ def beaglegetLogLikelihood(tree,alignment):
     
     '''
     
-    # Construct appropriate BEAGLE instance.
-    if (alignment.getDim() == 4):
-        stmod = alignment.getStateModel()
-    else: return None
-    model = HKY85Model(2.0,stmod.getStateFreqs())
-    states = stmod.getAlignmentAsStateList()
-    newi = tree.getSimpleNewick()[:-1]
-    scorer = Scorer(model_list=[model],data=states,tree=T(newi))
-    return scorer()
+    if (alignment.getDim() != 4): return None
+    return getBeagleScorer(alignment).getLogLikelihood(tree)
 
-def getLogLikelihood(tree,alignment,updateBranchLengths=True):
+def getLogLikelihood(tree,alignment,updateBranchLengths=True,attribs=None,
+                     level=LIKELIHOOD_FULL):
     
     ''' Acquire log-likelihood via C library libpll. Requires the input
-    alignment to be "Phylip friendly" (a phylipFriendlyAlignment).
+    alignment to be "Phylip friendly" (a phylipFriendlyAlignment). If libpll
+    is not built, or only a quick or local score is asked for, falls back to
+    the likelihood module (see getLogLikelihoodByPruning). Fully optimized
+    scores are looked up in and stored in the likelihood cache of the cache
+    module, if one is set (see setLikelihoodCache), keyed by the alignment, partition model, and tree structure.
 
     :param tree: A tree object.
     :type tree: :class:`.tree.tree`
@@ -49,14 +153,32 @@ def getLogLikelihood(tree,alignment,updateBranchLengths=True):
     :type alignment: :class:`.alignment.phylipFriendlyAlignment`
     :param updateBranchLengths: Whether or not to update the branch lengths
     in the provided tree with optimized ones.
+    :param attribs: Optional libpll instance attributes (e.g., number of
+    threads); by default, those kept with the alignment.
+    :type attribs: :class:`.pll.instanceAttributes`
+    :param level: LIKELIHOOD_QUICK, LIKELIHOOD_LOCAL, or LIKELIHOOD_FULL.
     :returns: A floating point value.    
     
     '''
 
+    if not pll.pllEnabled or level != LIKELIHOOD_FULL:
+        return getLogLikelihoodByPruning(tree,alignment,updateBranchLengths,
+                                         level=level)
+    # Look the tree up in the cache.
+    store = cache.likelihoodCache
+    if store != None:
+        key = _getLikelihoodCacheKey(alignment,attribs)
+        hit = store.get(key,tree.getStructure())
+        if hit != None:
+            if updateBranchLengths:
+                try: tree.updateNewick(hit[1],reroot=True)
+                except ValueError, e: pass
+            return hit[0]
     topo = tree.toTopology()
     
-    # Acquire a data model for libpll.
-    try: p = pll.dataModel(topo,alignment)
+    # Acquire a data model for libpll from instances kept for the alignment.
+    pool = pll.getInstancePool(alignment,attribs)
+    try: p = pool.acquire(topo)
     except: return None
 
     # Try and acquire the actual log-likelihood.
@@ -66,14 +188,84 @@ def getLogLikelihood(tree,alignment,updateBranchLengths=True):
         return None
     
     # Update the tree's Newick string based on new branch lengths.
+    newi = p.getNewickString().strip()
+    if store != None: store.set(key,tree.getStructure(),(sc,newi))
     if updateBranchLengths:
-        try: tree.updateNewick(p.getNewickString().strip(),reroot=True)
+        try: tree.updateNewick(newi,reroot=True)
         except ValueError, e: pass
     
-    # Close instance and return.
-    p.close()
+    # Return instance to the pool and return.
+    pool.release(p)
     return sc    
 
+def getLogLikelihoodByPruning(tree,alignment,updateBranchLengths=True,
+                              model=None,level=LIKELIHOOD_FULL):
+    
+    ''' Acquire log-likelihood in-process by Felsenstein's pruning algorithm
+    (see the likelihood module); needs neither libpll nor BEAGLE. Scores are
+    given at one of three levels, from cheapest to most exact:
+    LIKELIHOOD_QUICK takes branch lengths as they are (missing ones take a
+    default length); LIKELIHOOD_LOCAL only optimizes branches around subtrees
+    not already scored (e.g., those a rearrangement of a tree scored before
+    changed); LIKELIHOOD_FULL optimizes all branch lengths under a fixed
+    substitution model. Only the last is looked up in and stored in the
+    likelihood cache of the cache module, if one is set.
+    
+    :param tree: A tree object.
+    :type tree: :class:`.tree.tree`
+    :param alignment: An alignment object.
+    :type alignment: :class:`.alignment.alignment`
+    :param updateBranchLengths: Whether or not to update the branch lengths
+    in the provided tree with optimized ones.
+    :param model: An optional substitution model; by default, HKY85 for
+    nucleotides and WAG for amino acids.
+    :type model: :class:`.likelihood.substitutionModel`
+    :param level: LIKELIHOOD_QUICK, LIKELIHOOD_LOCAL, or LIKELIHOOD_FULL.
+    :returns: A floating point value.
+    
+    '''
+    
+    engine = likelihood.getLikelihoodEngine(alignment,model)
+    store  = cache.likelihoodCache
+    if level != LIKELIHOOD_FULL: store = None
+    hit    = None
+    if store != None:
+        key = _getPruningCacheKey(engine)
+        hit = store.get(key,tree.getStructure())
+    if hit != None: sc,newi = hit
+    else:
+        try: sc,newi = engine.score(tree.getNewick(),
+                                    level != LIKELIHOOD_QUICK,
+                                    level == LIKELIHOOD_LOCAL)
+        except ValueError: return None
+        if store != None: store.set(key,tree.getStructure(),(sc,newi))
+    if updateBranchLengths and level != LIKELIHOOD_QUICK:
+        try: tree.updateNewick(newi)
+        except ValueError, e: pass
+    return sc
+
+def getLogLikelihoodForRearrangement(rearr,alignment,model=None):
+    
+    ''' Acquire log-likelihood of the tree a rearrangement induces by the
+    likelihood module. If the rearranged topology was scored before (see
+    getLogLikelihoodByPruning), only conditional likelihoods on paths the
+    rearrangement changed are recomputed and only branches adjacent to them
+    are optimized; all other branch lengths are kept.
+    
+    :param rearr: A rearrangement.
+    :type rearr: :class:`.rearrangement.rearrangement`
+    :param alignment: An alignment object.
+    :type alignment: :class:`.alignment.alignment`
+    :param model: An optional substitution model.
+    :type model: :class:`.likelihood.substitutionModel`
+    :returns: A tuple of a floating point value and a Newick string.
+    
+    '''
+    
+    engine = likelihood.getLikelihoodEngine(alignment,model)
+    try: return engine.scoreRearrangement(rearr)
+    except ValueError: return (None,None)
+
 def _pygetParsimonyFromProfiles(topology,profiles):
     
     ''' Acquire parsimony via a Python implementation.
@@ -118,7 +310,25 @@ def getParsimonyForTopology(topo,alignment):
     
     profiles = parsimony.profile_set(alignment)
     return getParsimonyFromProfiles(
-        topology.toNewick(),profiles)
+        topo.toNewick(),profiles)
+
+def getProfileHandle(profiles):
+    
+    ''' Acquire the native handle holding the packed profiles, weights and
+    taxa of a profile set. It is created once per profile set and kept with
+    it so that profiles are not marshalled for every tree scored.
+    
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :returns: A handle for the fitch C++ module.
+    
+    '''
+    
+    if not hasattr(profiles,'_fitchhandle'):
+        prolist = [str(x) for x in profiles.profiles]
+        profiles._fitchhandle = fitch.new(prolist,profiles.weights,
+                                          profiles.taxa)
+    return profiles._fitchhandle
 
 def getParsimonyFromProfiles(newick,profiles):
     
@@ -131,10 +341,7 @@ def getParsimonyFromProfiles(newick,profiles):
 
     '''        
     
-    prolist = [str(x) for x in profiles.profiles]
-    weilist = profiles.weights
-    taxdict = profiles.taxa
-    return fitch.calculateCost(newick,prolist,weilist,taxdict)
+    return fitch.cost(getProfileHandle(profiles),newick)
 
 def getParsimonyFromProfilesForTopology(topology,profiles):
     
@@ -148,10 +355,353 @@ def getParsimonyFromProfilesForTopology(topology,profiles):
     
     '''        
     
+    return getParsimonyFromProfiles(topology.toNewick(),profiles)
+
+def getTopologyState(topo,profiles):
+    
+    ''' Acquire the native state of a topology for a set of profiles: the
+    Fitch state sets of every node, kept with the topology so that its
+    rearrangements can be rescored without rebuilding the whole tree.
+    
+    :param topo: A topology object.
+    :type topo: :class:`.rearrangement.topology`
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :returns: A tuple of a tree handle and a dictionary mapping nodes of the
+    topology to their indices in that handle.
+    
+    '''
+    
+    state = getattr(topo,'_fitchstate',None)
+    if state and state[0] is profiles: return state[1:]
+    
+    # Lay nodes out in post-order with indices to their parents.
+    nodes   = topo.getPostOrderTraversal()
+    index   = dict((n,i) for i,n in enumerate(nodes))
+    parents = [-1 for _ in nodes]
+    for n in nodes:
+        for br in n.children: parents[index[br.child]] = index[n]
+    labels  = [n.label if n.isLeaf() else '' for n in nodes]
+    
+    handle = fitch.newTree(getProfileHandle(profiles),parents,labels)
+    topo._fitchstate = (profiles,handle,index)
+    return handle,index
+
+def getParsimonyForRearrangement(rearr,profiles):
+    
+    ''' Acquire parsimony of the tree a rearrangement would result in without
+    performing the move. Only the state sets along the paths from the pruning
+    and regrafting points to the root are recomputed.
+    
+    :param rearr: A rearrangement object.
+    :type rearr: :class:`.rearrangement.rearrangement`
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :returns: An integer value.
+    
+    '''
+    
+    if not rearr.isPruneAndRegraft():
+        return getParsimonyFromProfiles(rearr.toNewick(),profiles)
+    handle,index = getTopologyState(rearr.topol,profiles)
+    return fitch.moveCost(handle,index[rearr.target.child],
+                          index[rearr.destination.child])
+
+def getParsimonyFromProfilesForAll(trees,profiles,threads=1):
+    
+    ''' Acquire parsimony of many trees in a single call to the C++
+    implementation. Trees are parsed and scored without holding the
+    interpreter lock, optionally across a number of native threads.
+    
+    :param trees: A list of Newick strings or topology objects.
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param threads: The number of native threads to score with.
+    :returns: A list of integer values in the order trees were given.
+    
+    '''
+    
+    newicks = [t if isinstance(t,basestring) else t.toNewick() for t in trees]
+    return fitch.costs(getProfileHandle(profiles),newicks,threads)
+
+def getParsimonyStepsFromProfiles(newick,profiles):
+    
+    ''' Acquire the steps every profile (site pattern) incurs on a tree via
+    the C++ implementation. Steps are not weighted; see
+    :meth:`.parsimony.profile_set.toSites` to expand them to every site.
+    
+    :param newick: A New Hampshire (Newick) tree string.
+    :type newick: a string
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :returns: A (read-only) numpy array of integers, one for every profile.
+    
+    '''
+    
+    steps = fitch.steps(getProfileHandle(profiles),newick)
+    return numpy.frombuffer(steps,dtype=numpy.intc)
+
+def getParsimonyStepsFromProfilesForAll(trees,profiles,threads=1):
+    
+    ''' Acquire the steps every profile (site pattern) incurs on many trees
+    in a single call to the C++ implementation, as in
+    :func:`getParsimonyFromProfilesForAll`.
+    
+    :param trees: A list of Newick strings or topology objects.
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param threads: The number of native threads to score with.
+    :returns: A (read-only) numpy array of integers with a row for every tree
+    in the order trees were given and a column for every profile.
+    
+    '''
+    
+    newicks = [t if isinstance(t,basestring) else t.toNewick() for t in trees]
+    steps   = fitch.allSteps(getProfileHandle(profiles),newicks,threads)
+    return numpy.frombuffer(steps,dtype=numpy.intc).reshape(
+        len(newicks),len(profiles))
+
+def getParsimonyForRearrangements(rearrs,profiles,threads=1):
+    
+    ''' Acquire parsimony of the trees many rearrangements would result in
+    without performing the moves. Rearrangements of the same topology are
+    rescored together as in :func:`getParsimonyForRearrangement` without
+    holding the interpreter lock, optionally across a number of native
+    threads.
+    
+    :param rearrs: A list of rearrangement objects.
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param threads: The number of native threads to score with.
+    :returns: A list of integer values in the order rearrangements were given.
+    
+    '''
+    
+    scores = [None for _ in rearrs]
+    groups, others = dict(), list()
+    for i,rearr in enumerate(rearrs):
+        if rearr.isPruneAndRegraft():
+            groups.setdefault(rearr.topol,[]).append(i)
+        else: others.append(i)
+    
+    # Rescore moves of each topology from its state sets.
+    for topo,inds in groups.iteritems():
+        handle,index = getTopologyState(topo,profiles)
+        clips = [index[rearrs[i].target.child] for i in inds]
+        dests = [index[rearrs[i].destination.child] for i in inds]
+        costs = fitch.moveCosts(handle,clips,dests,threads)
+        for i,cost in zip(inds,costs): scores[i] = cost
+    
+    # Anything else is scored from its Newick string.
+    if others:
+        newicks = [rearrs[i].toNewick() for i in others]
+        costs   = getParsimonyFromProfilesForAll(newicks,profiles,threads)
+        for i,cost in zip(others,costs): scores[i] = cost
+    return scores
+
+def getBestRearrangement(rearrs,profiles,better=None,threads=1):
+    
+    ''' Acquire the rearrangement of least parsimony among many by branch and
+    bound. Rearrangements of the same topology that prune the same branch
+    share a lower bound on their parsimony taken from the state sets of that
+    topology; they are only rescored as in :func:`getParsimonyForRearrangement`
+    if that bound can beat the best score found so far.
+    
+    :param rearrs: A list of rearrangement objects.
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param better: Only consider rearrangements scoring less than this value.
+    :param threads: The number of native threads to score with.
+    :returns: A tuple of the best rearrangement and its parsimony; both are
+    None if no rearrangement scores less than the given value.
+    
+    '''
+    
+    groups, order, others = dict(), list(), list()
+    for rearr in rearrs:
+        if rearr.isPruneAndRegraft():
+            key = (rearr.topol,rearr.target)
+            if not key in groups:
+                groups[key] = list()
+                order.append(key)
+            groups[key].append(rearr)
+        else: others.append(rearr)
+    
+    # Bound all moves pruning the same branch of the same topology.
+    bounded, topos, targets = list(), list(), dict()
+    for topo,targ in order:
+        if not topo in targets:
+            targets[topo] = list()
+            topos.append(topo)
+        targets[topo].append(targ)
+    for topo in topos:
+        targs = targets[topo]
+        handle,index = getTopologyState(topo,profiles)
+        bounds = fitch.moveBounds(handle,[index[t.child] for t in targs],
+                                  threads)
+        for targ,bound in zip(targs,bounds):
+            bounded.append((bound,groups[(topo,targ)]))
+    bounded.sort(key=lambda d: d[0])
+    
+    # Anything else is scored from its Newick string.
+    best, bestScore = None, better
+    if others:
+        costs = getParsimonyFromProfilesForAll(
+            [rearr.toNewick() for rearr in others],profiles,threads)
+        for rearr,cost in zip(others,costs):
+            if bestScore == None or cost < bestScore:
+                best, bestScore = rearr, cost
+    
+    # Rescore moves in order of their bound until none can do better.
+    for bound,moves in bounded:
+        if bestScore != None and bound >= bestScore: break
+        costs = getParsimonyForRearrangements(moves,profiles,threads)
+        for rearr,cost in zip(moves,costs):
+            if bestScore == None or cost < bestScore:
+                best, bestScore = rearr, cost
+    if best == None: return None,None
+    return best,bestScore
+
+def getSankoffHandle(profiles,matrix):
+    
+    ''' Acquire the native handle holding the patterns of a profile set
+    resolved against the states of a step matrix. It is kept with the profile
+    set for the last step matrix used.
+    
+    :param profiles: A set of profiles that are not recoded.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param matrix: A step matrix.
+    :type matrix: :class:`.parsimony.stepMatrix`
+    :returns: A handle for the fitch C++ module.
+    
+    '''
+    
+    if profiles.recoded:
+        raise ValueError('Weighted parsimony requires profiles that keep the'
+                         ' characters of sites (not recoded).')
+    key = (matrix.getStates(),matrix.toList())
+    cached = getattr(profiles,'_sankoffhandle',None)
+    if cached and cached[0] == key: return cached[1]
     prolist = [str(x) for x in profiles.profiles]
-    weilist = profiles.weights
-    taxdict = profiles.taxa
-    return fitch.calculateCost(topology.toNewick(),prolist,
-                               weilist,taxdict)
+    handle  = fitch.newSankoff(prolist,profiles.weights,profiles.taxa,
+                               matrix.getStates(),matrix.toList())
+    profiles._sankoffhandle = (key,handle)
+    return handle
+
+def getWeightedParsimony(newick,alignment,matrix):
+    
+    ''' Acquire weighted (Sankoff) parsimony via a C++ implementation.
+    
+    :param newick: A New Hampshire (Newick) tree string.
+    :param alignment: An alignment object.
+    :type alignment: :class:`.alignment.alignment`
+    :param matrix: A step matrix.
+    :type matrix: :class:`.parsimony.stepMatrix`
+    :returns: A floating point value.
+    
+    '''
+    
+    profiles = parsimony.profile_set(alignment,recode=False)
+    return getWeightedParsimonyFromProfiles(newick,profiles,matrix)
+
+def getWeightedParsimonyFromProfiles(newick,profiles,matrix):
+    
+    ''' Acquire weighted (Sankoff) parsimony via a C++ implementation.
+    
+    :param newick: A New Hampshire (Newick) tree string.
+    :param profiles: A set of profiles that are not recoded.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param matrix: A step matrix.
+    :type matrix: :class:`.parsimony.stepMatrix`
+    :returns: A floating point value.
+    
+    '''
+    
+    return fitch.sankoffCost(getSankoffHandle(profiles,matrix),newick)
+
+def getWeightedParsimonyFromProfilesForAll(trees,profiles,matrix,threads=1):
+    
+    ''' Acquire weighted (Sankoff) parsimony of many trees in a single call to
+    the C++ implementation; see :func:`getParsimonyFromProfilesForAll`.
+    
+    :param trees: A list of Newick strings or topology objects.
+    :param profiles: A set of profiles that are not recoded.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param matrix: A step matrix.
+    :type matrix: :class:`.parsimony.stepMatrix`
+    :param threads: The number of native threads to score with.
+    :returns: A list of floating point values in the order trees were given.
+    
+    '''
+    
+    newicks = [t if isinstance(t,basestring) else t.toNewick() for t in trees]
+    return fitch.sankoffCosts(getSankoffHandle(profiles,matrix),newicks,
+                              threads)
+
+# Partitioned Scoring
+
+def _mapPartitions(func,parts,threads=None):
+    
+    ''' PRIVATE: Apply a function to every partition, concurrently across a
+    number of threads; by default, one for every partition up to the number
+    of processors. '''
+    
+    if threads == None: threads = min(len(parts),cpu_count())
+    if threads <= 1 or len(parts) <= 1: return map(func,parts)
+    pool = ThreadPool(threads)
+    try: return pool.map(func,parts)
+    finally:
+        pool.close()
+        pool.join()
+
+def getPartitionedParsimonyFromProfiles(newick,profiles,threads=None):
+    
+    ''' Acquire parsimony of a tree for every partition of an alignment (see
+    setPartitions of an alignment) via a C++ implementation. Partitions are
+    scored concurrently; the native module releases the interpreter lock.
+    Their sum is the parsimony of the tree.
+    
+    :param newick: A New Hampshire (Newick) tree string.
+    :param profiles: A set of profiles corresponding to an alignment.
+    :type profiles: :class:`.parsimony.profile_set`
+    :param threads: The number of partitions to score at once.
+    :returns: A list of integer values in the order of partitions.
+    
+    '''
+    
+    score = lambda pro: fitch.costs(getProfileHandle(pro),[newick],1)[0]
+    return _mapPartitions(score,profiles.getPartitionSets(),threads)
+
+def getPartitionedLogLikelihood(tree,alignment,threads=None):
     
+    ''' Acquire log-likelihood of a tree for every partition of an alignment
+    (see setPartitions of an alignment) by the likelihood module, each under
+    its own default substitution model and with its own branch lengths
+    optimized. Partitions are scored concurrently (numpy releases the
+    interpreter lock for much of the work); their sum is the log-likelihood
+    of the tree with branch lengths unlinked between partitions. The tree is
+    not updated. libpll, by contrast, scores all partitions of an alignment
+    in a single instance with branch lengths linked (see getLogLikelihood)
+    and does not report them separately.
     
+    :param tree: A tree object.
+    :type tree: :class:`.tree.tree`
+    :param alignment: An alignment object.
+    :type alignment: :class:`.alignment.alignment`
+    :param threads: The number of partitions to score at once.
+    :returns: A list of floating point values in the order of partitions
+    (None for any that could not be scored).
+    
+    '''
+    
+    if alignment.isPartitioned():
+        parts = [alignment.getPartition(i) for i in xrange(
+            len(alignment.getPartitions()))]
+    else: parts = [alignment]
+    engines = [likelihood.getLikelihoodEngine(ali) for ali in parts]
+    newick  = tree.getNewick()
+    def score(engine):
+        try: return engine.getLogLikelihood(newick)
+        except ValueError: return None
+    return _mapPartitions(score,engines,threads)
+
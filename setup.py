@@ -15,7 +15,7 @@ LONG    = 'A Python library and code framework for phylogenetic tree reconstruct
 URL     = 'http://www.github.com/AlexSafatli/Pylogeny'
 AUTHOR  = 'Alex Safatli'
 EMAIL   = 'safatli@cs.dal.ca'
-DEPNDS  = ['networkx','pandas','mysql-python','p4']
+DEPNDS  = ['networkx','numpy','pandas','mysql-python','p4']
 LINKS   = ['http://p4-phylogenetics.googlecode.com/archive/4491de464e68fdb49c7a11e06737cd34a98143ec.tar.gz#egg=p4']
 PKGDATA = {'pylogeny':['fitch.cpp','libpllWrapper.c']}
 FITCHCC = os.path.join('pylogeny','fitch.cpp')
@@ -24,7 +24,7 @@ PLLC    = os.path.join('pylogeny','libpllWrapper.c')
 # Compilation for C/C++ Extensions (Fitch, Pylibpll)
 
 pllExtension   = extension('libpllWrapper',sources=[PLLC],include_dirs=['/usr/local/include'],libraries=['pll-sse3'],library_dirs=['/usr/local/lib'])
-fitchExtension = extension('fitch',sources=[FITCHCC],include_dirs=['/usr/local/include'],language="c++",extra_compile_args=['-std=c++11'])
+fitchExtension = extension('fitch',sources=[FITCHCC],include_dirs=['/usr/local/include'],language="c++",extra_compile_args=['-std=c++11','-pthread'],extra_link_args=['-pthread'])
 
 # Setup
 
@@ -24,6 +24,21 @@ class alignmentTest(testCase):
         for seq in self.alignment:
             self.assertIsNotNone(seq)
             self.assertTrue(type(seq) == Sequence)
+
+    def test_setPartitions(self):
+        ali  = alignment(TESTS_ALIGNMENT)
+        half = ali.getSize()/2
+        ali.setPartitions(['p1','p2'],[(1,half),(half+1,ali.getSize())])
+        self.assertTrue(ali.isPartitioned())
+        first,second = ali.getPartition(0),ali.getPartition(1)
+        self.assertEqual(len(first)+len(second),len(ali))
+        for i in xrange(ali.getNumSeqs()):
+            self.assertEqual(first.getSequenceString(i)+
+                             second.getSequenceString(i),
+                             ali.getSequenceString(i))
+        self.assertRaises(ValueError,ali.setPartitions,['p1'],
+                          [(1,ali.getSize()+1)])
+        ali.close()
             
 if __name__ == '__main__':
 
@@ -0,0 +1,45 @@
+from base import *
+from unittest import skipUnless
+from pylogeny.scoring import beagleEnabled, getBeagleScorer, \
+     BEAGLE_DEFAULT_KAPPA
+if beagleEnabled:
+    from pytbeaglehon.disc_state_cont_time_model import HKY85Model
+    from pytbeaglehon.tree_scorer import create_toggle_partial_tree_scorer \
+         as Scorer
+    from pytbeaglehon.tests.util import TreeForTesting as T
+
+@skipUnless(beagleEnabled,'pytbeaglehon is not installed.')
+class beagleTest(testCase):
+
+    alignment = None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.alignment == None:
+            cls.alignment = alignment(TESTS_ALIGNMENT)
+            taxa = sorted(cls.alignment.getTaxa())
+            cls.trees = list()
+            for order in (taxa,taxa[::-1]):
+                newi = order[0]
+                for tax in order[1:]: newi = '(%s,%s)' % (newi,tax)
+                cls.trees.append(treeObject(newi + ';',check=True))
+
+    def getFreshLogLikelihood(self,tree):
+        stmod  = self.alignment.getStateModel()
+        model  = HKY85Model(BEAGLE_DEFAULT_KAPPA,stmod.getStateFreqs())
+        scorer = Scorer(model_list=[model],
+                        data=stmod.getAlignmentAsStateList(),
+                        tree=T(tree.getSimpleNewick()[:-1]))
+        return scorer()
+
+    def test_sessionScoresAsNew(self):
+        session = getBeagleScorer(self.alignment)
+        self.assertIs(getBeagleScorer(self.alignment),session)
+        for tree in self.trees + self.trees[:1]:
+            self.assertAlmostEqual(session.getLogLikelihood(tree),
+                                   self.getFreshLogLikelihood(tree))
+
+if __name__ == '__main__':
+
+    suite = loader().loadTestsFromTestCase(beagleTest)
+    tests(verbosity=2).run(suite)
@@ -1,5 +1,7 @@
 from base import *
 from pylogeny import heuristic
+from pylogeny.parsimony import profile_set, transitionTransversionMatrix
+from pylogeny.scoring import getWeightedParsimonyFromProfiles
 
 class heuristicTest(phylogeneticLandscapeTest):
 
@@ -15,10 +17,48 @@ class implementedHeuristicsTest(heuristicTest):
         self.resetLandscape()
         self.runLinearHeuristic(heuristic.parsimonyGreedy)
     
+    def test_runParsimonyGreedyHeuristicBounded(self):
+        ends = list()
+        for bound in (False,True):
+            self.resetLandscape()
+            h = heuristic.parsimonyGreedy(self.landscape,
+                                          self.landscape.getNode(0),bound)
+            h.explore()
+            ends.append(h.getBestTree()['tree'].score[1])
+        self.assertEqual(ends[0],ends[1])
+    
+    def test_runParsimonyGreedyHeuristicWithStepMatrix(self):
+        matrix = transitionTransversionMatrix()
+        for bound in (False,True):
+            self.resetLandscape()
+            self.landscape.setStepMatrix(matrix)
+            pro  = profile_set(self.landscape.getAlignment(),recode=False)
+            pars = lambda d: d['tree'].score[1]
+            h = heuristic.parsimonyGreedy(self.landscape,
+                                          self.landscape.getNode(0),bound)
+            h.explore()
+            for d in h.path: self.assertAlmostEqual(
+                pars(d),getWeightedParsimonyFromProfiles(
+                    d['tree'].getNewick(),pro,matrix))
+            self.assertTrue(all([pars(a) > pars(b) for a,b in
+                                 zip(h.path,h.path[1:])]))
+            self.landscape.exploreTree(h.bestTree['index'])
+            for i in self.landscape.getNeighborsFor(h.bestTree['index']):
+                self.assertGreaterEqual(pars(self.landscape.getNode(i)),
+                                        pars(h.bestTree))
+    
     def test_runLikelihoodGreedyHeuristic(self):
         self.resetLandscape()
         self.runLinearHeuristic(heuristic.likelihoodGreedy)
         
+    def test_runLikelihoodGreedyHeuristicWithoutPll(self):
+        enabled = heuristic.landscape.pllEnabled
+        heuristic.landscape.pllEnabled = False
+        try:
+            self.resetLandscape()
+            self.runHeuristic(heuristic.likelihoodGreedy,0,1,True)
+        finally: heuristic.landscape.pllEnabled = enabled
+        
     def test_runSmoothGreedyHeuristic(self):
         self.resetLandscape()
         self.runLinearHeuristic(heuristic.smoothGreedy)
@@ -1,5 +1,61 @@
 from base import *
+import fitch
 from random import sample
+from tempfile import NamedTemporaryFile
+from pylogeny.scoring import getParsimonyFromProfiles, \
+     getParsimonyForRearrangements, getBestRearrangement, getTopologyState, \
+     getPartitionedParsimonyFromProfiles, getWeightedParsimony, \
+     getWeightedParsimonyFromProfiles, getWeightedParsimonyFromProfilesForAll
+from pylogeny.parsimony import profile_set, stepMatrix, readStepMatrix, \
+     transitionTransversionMatrix, DNA_STATES, fitch_cost
+from pylogeny import landscape as landscapeModule, cache, base as treeBase
+
+def fitchBySite(newick,ali):
+    
+    ''' Parsimony of a tree by Fitch's algorithm over every site of an
+    alignment, column by column, to check profiles and their constant against.
+    A node with k children whose state sets do not intersect costs k-1. '''
+    
+    data  = ali.toArray()
+    rows  = dict((tax,i) for i,tax in enumerate(ali.getTaxa()))
+    order = list(treeBase.treeStructure.postOrderTraversal(
+        newickParser(newick).parse()))
+    total = 0
+    for col in data.T:
+        sets = {}
+        for node in order:
+            if node.isLeaf():
+                sets[node] = set([col[rows[node.label]]])
+                continue
+            below = [sets[br.child] for br in node.children]
+            sets[node] = set.intersection(*below)
+            if not sets[node]:
+                sets[node] = set.union(*below)
+                total += len(below)-1
+    return total
+
+def sankoff(newick,profiles,matrix):
+    
+    ''' Weighted parsimony of a tree by Sankoff's algorithm, column by column,
+    to check the native implementation against. '''
+    
+    states = matrix.getStates()
+    topol  = treeObject(newick).toTopology()
+    order  = list(treeBase.treeStructure.postOrderTraversal(topol.getRoot()))
+    total  = 0.
+    for p in xrange(len(profiles)):
+        costs = {}
+        for node in order:
+            if node.isLeaf():
+                char = profiles.getForTaxa(p,node.label).upper()
+                costs[node] = [0. if (char == st or not char in states)
+                               else float('inf') for st in states]
+                continue
+            costs[node] = [sum([min([costs[br.child][t] + matrix.cost(s,u)
+                                     for t,u in enumerate(states)])
+                                for br in node.children]) for s in states]
+        total += min(costs[order[-1]])*profiles.weight(p)
+    return total
 
 class landscapeTest(phylogeneticLandscapeTest):
 
@@ -20,6 +76,190 @@ class landscapeTest(phylogeneticLandscapeTest):
             self.assertEqual(self.landscape.findTreeTopologyByStructure(t.getStructure()),tr)
             self.assertIsNotNone(self.landscape.getEdge(treeid,tr))        
         
+    def test_exploreParsimonyMatchesNewick(self):
+        self.landscape.exploreTree(0)
+        profiles = self.landscape.parsimony_profiles
+        for tr in self.landscape.getNeighborsFor(0):
+            t = self.landscape.getTree(tr)
+            self.assertEqual(t.getScore()[1],
+                             getParsimonyFromProfiles(t.getNewick(),profiles))
+        
+    def test_exploreBestParsimonyNeighbor(self):
+        best = self.landscape.exploreBestParsimonyNeighbor(0)
+        self.landscape.exploreTree(0)
+        pars = lambda d: self.landscape.getTree(d).getScore()[1]
+        near = min(self.landscape.getNeighborsFor(0),key=pars)
+        if best == None: self.assertGreaterEqual(pars(near),pars(0))
+        else:
+            self.assertEqual(pars(best),pars(near))
+            self.assertLess(pars(best),pars(0))
+
+    def test_moveBounds(self):
+        pro = self.landscape.parsimony_profiles
+        for t in (self.landscape.getTree(0),self.getRandomTree(0)):
+            topo  = t.toTopology()
+            moves = [m for m in topo.allSPR() + topo.allTBR()
+                     if m.isPruneAndRegraft()]
+            costs = getParsimonyForRearrangements(moves,pro)
+            for move,cost in zip(moves,costs):
+                handle,index = getTopologyState(move.topol,pro)
+                bound = fitch.moveBounds(handle,[index[move.target.child]],1)
+                self.assertLessEqual(bound[0],cost)
+                self.assertEqual(cost,getParsimonyFromProfiles(
+                    move.toNewick(),pro))
+            self.assertEqual(getBestRearrangement(moves,pro,threads=2)[1],
+                             min(costs))
+
+    def test_exploreCachesParsimony(self):
+        self.landscape.exploreTree(0)
+        key = self.landscape._getCacheKey()
+        for tr in self.landscape.getNeighborsFor(0):
+            t = self.landscape.getTree(tr)
+            self.assertEqual(self.landscape.cache.get(key,t.getStructure()),
+                             t.getScore()[1])
+
+    def test_parsimonyCacheScope(self):
+        ali = self.landscape.getAlignment()
+        self.assertIs(landscape(ali,root=False).cache,self.landscape.cache)
+        self.assertIsNot(landscape(alignment(TESTS_ALIGNMENT),root=False).cache,
+                         self.landscape.cache)
+        shared = cache.scoreCache()
+        prior  = cache.parsimonyCache
+        cache.setParsimonyCache(shared)
+        try: self.assertIs(landscape(None,root=False).cache,shared)
+        finally: cache.setParsimonyCache(prior)
+
+    def test_uninformativeProfiles(self):
+        self.landscape.exploreTree(0)
+        ali  = self.landscape.getAlignment()
+        pro  = self.landscape.parsimony_profiles
+        self.assertGreater(pro.constant,0)
+        self.assertFalse(all(pro.informative))
+        for i in self.landscape.getNodeNames()[:25]:
+            newi = self.landscape.getTree(i).getNewick()
+            pars = getParsimonyFromProfiles(newi,pro)
+            self.assertEqual(pars,fitchBySite(newi,ali))
+            self.assertEqual(pars,fitch_cost(treeObject(newi).toTopology(),pro))
+        taxa = sorted(ali.getTaxa())
+        newi = '((%s),(%s),%s);' % (','.join(taxa[:3]),','.join(taxa[3:5]),
+                                    ','.join(taxa[5:]))
+        self.assertEqual(getParsimonyFromProfiles(newi,pro),
+                         fitchBySite(newi,ali))
+
+    def test_getParsimonySteps(self):
+        self.landscape.exploreTree(0)
+        profiles = self.landscape.parsimony_profiles
+        nodes = self.landscape.getNodeNames()
+        steps = self.landscape.getParsimonySteps(nodes)
+        sites = self.landscape.getParsimonySteps(nodes,sites=True)
+        self.assertEqual(sites.shape,(len(nodes),profiles.numSites))
+        for i,row,col in zip(nodes,steps,sites):
+            pars = self.landscape.getTree(i).getScore()[1]
+            self.assertEqual(sum(row*profiles.weights),pars)
+            self.assertEqual(sum(col),pars)
+
+    def test_partitionedParsimony(self):
+        ali  = alignment(TESTS_ALIGNMENT)
+        half = ali.getSize()/2
+        ali.setPartitions(['p1','p2'],[(1,half),(half+1,ali.getSize())])
+        newi = self.landscape.getTree(0).getNewick()
+        pro  = profile_set(ali)
+        self.assertEqual(len(pro.getPartitionSets()),2)
+        self.assertEqual(sum(getPartitionedParsimonyFromProfiles(newi,pro)),
+                         getParsimonyFromProfiles(newi,pro))
+        ali.close()
+
+    def test_weightedParsimony(self):
+        self.landscape.exploreTree(0)
+        ali    = self.landscape.getAlignment()
+        pro    = profile_set(ali,recode=False)
+        trees  = [self.landscape.getTree(i).getNewick() for i in
+                  self.landscape.getNodeNames()[:10]]
+        for matrix in (stepMatrix(DNA_STATES),transitionTransversionMatrix()):
+            many = getWeightedParsimonyFromProfilesForAll(trees,pro,matrix,2)
+            for newi,scr in zip(trees,many):
+                ref = sankoff(newi,pro,matrix)
+                self.assertAlmostEqual(scr,ref)
+                self.assertAlmostEqual(
+                    getWeightedParsimonyFromProfiles(newi,pro,matrix),ref)
+            self.assertAlmostEqual(getWeightedParsimony(trees[0],ali,matrix),
+                                   many[0])
+        self.assertRaises(ValueError,getWeightedParsimonyFromProfiles,
+                          trees[0],profile_set(ali),stepMatrix(DNA_STATES))
+
+    def test_readStepMatrix(self):
+        fh = NamedTemporaryFile(suffix='.txt')
+        fh.write('# Transitions cost 1, transversions 2.\n A C G T\n' +
+                 'A 0 2 1 2\nC 2 0 2 1\nG 1 2 0 2\nT 2 1 2 0\n')
+        fh.flush()
+        self.assertEqual(readStepMatrix(fh.name),
+                         transitionTransversionMatrix())
+        fh.close()
+
+    def test_stepMatrixRejectsBadInput(self):
+        self.assertRaises(ValueError,stepMatrix,'')
+        self.assertRaises(ValueError,stepMatrix,'ACA')
+        self.assertRaises(ValueError,stepMatrix,'Aa')
+        self.assertRaises(ValueError,stepMatrix,'AC',[[0,1]])
+        self.assertRaises(ValueError,stepMatrix,'AC',[[0,1],[1]])
+        self.assertRaises(ValueError,stepMatrix,'AC',[[0,1],[1,0,1]])
+        self.assertRaises(ValueError,stepMatrix,'AC',[[0,-1],[1,0]])
+
+    def test_stepMatrixLandscape(self):
+        ali    = self.landscape.getAlignment()
+        newi   = self.landscape.getTree(0).getNewick()
+        matrix = transitionTransversionMatrix()
+        pro    = profile_set(ali,recode=False)
+        wpars  = lambda l,i: getWeightedParsimonyFromProfiles(
+            l.getTree(i).getNewick(),pro,matrix)
+        land   = landscape(ali,starting_tree=treeObject(newi),
+                           stepmatrix=matrix)
+        land.exploreTree(0)
+        self.assertGreater(len(land),1)
+        for i in land.getNodeNames():
+            self.assertAlmostEqual(land.getTree(i).getScore()[1],wpars(land,i))
+        land = landscape(ali,starting_tree=treeObject(newi))
+        land.exploreTree(0)
+        land.setStepMatrix(matrix)
+        for i in land.getNodeNames():
+            self.assertAlmostEqual(land.getTree(i).getScore()[1],wpars(land,i))
+        land.setStepMatrix(None)
+        for i in land.getNodeNames():
+            self.assertEqual(land.getTree(i).getScore()[1],
+                             getParsimonyFromProfiles(
+                                 land.getTree(i).getNewick(),
+                                 land.parsimony_profiles))
+
+    def test_scoreLikelihoodsInParallel(self):
+        self.landscape.exploreTree(0)
+        nodes  = self.landscape.getNeighborsFor(0)[:4]
+        scores = self.landscape.scoreLikelihoods(nodes,workers=2)
+        self.assertEqual(sorted(scores),sorted(nodes))
+        for i in nodes:
+            if scores[i] == None: self.assertTrue(self.landscape.getNode(i)['failed'])
+            else: self.assertEqual(scores[i],self.landscape.getTree(i).getScore()[0])
+
+    def test_scoreApproximateLikelihoods(self):
+        self.landscape.exploreTree(0)
+        nodes  = self.landscape.getNeighborsFor(0)[:4]
+        before = [self.landscape.getTree(i).getNewick() for i in nodes]
+        scores = self.landscape.scoreApproximateLikelihoods(nodes)
+        for i,newi in zip(nodes,before):
+            self.assertEqual(scores[i],
+                             self.landscape.getVertex(i).getApproximateLikelihood())
+            self.assertEqual(self.landscape.getTree(i).getNewick(),newi)
+
+    def test_exploreTreeByLikelihoodWithoutPll(self):
+        enabled = landscapeModule.pllEnabled
+        landscapeModule.pllEnabled = False
+        try:
+            self.resetLandscape()
+            self.assertRaises(SystemError,
+                              self.landscape.exploreTreeByLikelihood,0)
+            self.assertFalse(self.landscape.getNode(0)['explored'])
+            self.assertEqual(len(self.landscape),1)
+        finally: landscapeModule.pllEnabled = enabled
+
     def test_getTreeNewick(self):
         treeNewick = self.landscape.getTree(0).getNewick()
         self.assertTrue(type(treeNewick) == str and treeNewick != None)
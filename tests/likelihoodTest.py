@@ -0,0 +1,103 @@
+from base import *
+from pylogeny.likelihood import likelihoodEngine, discreteGamma, jc69Model, \
+     hky85Model, gtrModel
+from pylogeny.scoring import getLogLikelihoodByPruning, LIKELIHOOD_QUICK, \
+     LIKELIHOOD_LOCAL, LIKELIHOOD_FULL
+from pylogeny import cache
+from tempfile import NamedTemporaryFile
+
+class likelihoodTest(testCase):
+
+    alignment = None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.alignment == None:
+            cls.alignment = alignment(TESTS_ALIGNMENT)
+            cls.engine    = likelihoodEngine(cls.alignment)
+            taxa = sorted(cls.alignment.getTaxa())
+            newi = taxa[0]
+            for tax in taxa[1:]: newi = '(%s,%s)' % (newi,tax)
+            cls.newick = newi + ';'
+
+    def test_discreteGamma(self):
+        for alpha in [0.1,0.5,1.,10.]:
+            rates = discreteGamma(alpha)
+            self.assertAlmostEqual(rates.mean(),1.)
+            self.assertTrue(all(rates[:-1] < rates[1:]))
+
+    def test_modelsAgree(self):
+        jc  = likelihoodEngine(self.alignment,jc69Model())
+        hky = likelihoodEngine(self.alignment,hky85Model(kappa=1.))
+        gtr = likelihoodEngine(self.alignment,gtrModel([2.]*6))
+        ref = jc.getLogLikelihood(self.newick,optimize=False)
+        self.assertAlmostEqual(hky.getLogLikelihood(self.newick,False),ref)
+        self.assertAlmostEqual(gtr.getLogLikelihood(self.newick,False),ref)
+
+    def test_optimizeImproves(self):
+        lnl,newi = self.engine.score(self.newick)
+        self.assertGreater(lnl,self.engine.getLogLikelihood(self.newick,False))
+        self.assertAlmostEqual(self.engine.getLogLikelihood(newi,False),lnl,
+                               places=4)
+
+    def test_rerootUnchanged(self):
+        lnl,newi = self.engine.score(self.newick)
+        rerooted = treeObject(newi,check=True).getNewick()
+        self.assertAlmostEqual(self.engine.getLogLikelihood(rerooted,False),
+                               lnl,places=4)
+
+    def test_scoreRearrangement(self):
+        topo = treeObject(self.engine.score(self.newick)[1]).toTopology()
+        self.engine.score(topo.toNewick(),optimize=False)
+        plain = likelihoodEngine(self.alignment,cacheBytes=0)
+        hits  = self.engine.partials.hits
+        for rearr in topo.allSPR()[:10]:
+            exact = self.engine.scoreRearrangement(rearr,optimize=False)[0]
+            self.assertAlmostEqual(exact,plain.getLogLikelihood(
+                rearr.toNewick(),False))
+            self.assertGreaterEqual(self.engine.scoreRearrangement(rearr)[0],
+                                    exact)
+        self.assertGreater(self.engine.partials.hits,hits)
+
+    def test_scoringLevels(self):
+        tre = treeObject(self.newick)
+        scr = lambda level,update=False: getLogLikelihoodByPruning(
+            tre,self.alignment,update,level=level)
+        quick = scr(LIKELIHOOD_QUICK)
+        self.assertLessEqual(quick,scr(LIKELIHOOD_LOCAL))
+        full  = scr(LIKELIHOOD_FULL,True)
+        self.assertGreater(full,quick)
+        self.assertAlmostEqual(scr(LIKELIHOOD_QUICK),full,places=4)
+
+    def test_likelihoodCache(self):
+        path  = NamedTemporaryFile(suffix='.db').name
+        store = cache.likelihoodScoreCache(path=path)
+        prior = cache.likelihoodCache
+        cache.setLikelihoodCache(store)
+        try:
+            tre = treeObject(self.newick)
+            lnl = getLogLikelihoodByPruning(tre,self.alignment)
+            self.assertEqual(store.misses,1)
+            (key,struct),(scr,newi) = store.scores.items()[0]
+            other = cache.likelihoodScoreCache(path=path)
+            self.assertEqual(other.get(key,struct),(lnl,newi))
+            again = treeObject(self.newick)
+            self.assertEqual(getLogLikelihoodByPruning(again,self.alignment),
+                             lnl)
+            self.assertEqual(store.hits,1)
+            self.assertEqual(again.getNewick(),tre.getNewick())
+            other.close()
+        finally:
+            cache.setLikelihoodCache(prior)
+            store.close()
+
+    def test_siteLogLikelihoods(self):
+        sites = self.engine.getSiteLogLikelihoods(self.newick)
+        self.assertEqual(len(sites),self.alignment.getSize())
+        self.assertAlmostEqual(sum(sites),
+                               self.engine.getLogLikelihood(self.newick))
+
+if __name__ == '__main__':
+
+    suite = loader().loadTestsFromTestCase(likelihoodTest)
+    tests(verbosity=2).run(suite)
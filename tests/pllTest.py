@@ -0,0 +1,40 @@
+from base import *
+from unittest import skipUnless
+from pylogeny.pll import pllEnabled, dataModel, instancePool
+
+@skipUnless(pllEnabled,'libpll is not installed.')
+class pllTest(testCase):
+
+    alignment = None
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.alignment == None:
+            cls.alignment = alignment(TESTS_ALIGNMENT)
+            taxa = sorted(cls.alignment.getTaxa())
+            cls.trees = list()
+            for order in (taxa,taxa[::-1]):
+                newi = order[0]
+                for tax in order[1:]: newi = '(%s,%s)' % (newi,tax)
+                cls.trees.append(treeObject(newi + ';',check=True))
+
+    def test_pooledInstanceScoresAsNew(self):
+        first,second = [t.toTopology() for t in self.trees]
+        pool  = instancePool(self.alignment,size=1)
+        data  = pool.acquire(first)
+        data.getLogLikelihood()
+        pool.release(data)
+        again = pool.acquire(second)
+        self.assertIs(again,data)
+        fresh = dataModel(second,self.alignment)
+        try: self.assertAlmostEqual(again.getLogLikelihood(),
+                                    fresh.getLogLikelihood(),places=4)
+        finally:
+            fresh.close()
+            again.close()
+            pool.close()
+
+if __name__ == '__main__':
+
+    suite = loader().loadTestsFromTestCase(pllTest)
+    tests(verbosity=2).run(suite)
@@ -2,6 +2,8 @@ from unittest import TestLoader as loader, TestCase as testCase, TextTestRunner
 from os.path import isfile
 from pylogeny.tree import tree, treeSet
 from pylogeny.alignment import alignment
+from pylogeny.rearrangement import compactTopology
+from pylogeny import rearrangement, base
 
 class treeTest(testCase):
 
@@ -33,6 +35,60 @@ class treeTest(testCase):
         t = self.tree_.toTopology()
         self.assertEqual(t.toNewick(),self.tree_.getNewick())
         
+    def test_rearrangement_toTree(self):
+        t = self.tree_.toTopology()
+        for move in t.allNNI():
+            new = move.toTree()
+            old = move.toTopology().toTree()
+            self.assertEqual(new.getNewick(),old.getNewick())
+            self.assertEqual(new.getStructure(),old.getStructure())
+        
+    def test_compactTopology(self):
+        t = self.tree_.toTopology()
+        c = compactTopology.fromTopology(t)
+        self.assertEqual(c.toNewick(),t.toNewick())
+        self.assertEqual(c.toStructure(),self.tree_.getStructure())
+        for typ,moves in (('SPR',c.iterSPR()),('NNI',c.iterNNI())):
+            old = [m.toTree().getNewick() for b in t.getBranches() for m in
+                   t.iterTypeForBranch(b,getattr(rearrangement,'TYPE_'+typ),
+                                       flip=False)]
+            new = [getattr(c,typ)(n,dest).toNewick() for n,dest in moves]
+            self.assertEqual(sorted(new),sorted(old))
+        splits = lambda topo: frozenset(frozenset(
+            leaf.label for leaf in base.treeStructure.leaves(b.child))
+            for b in topo.getBranches())
+        old = [splits(m.toTopology()) for m in t.allSPR(unique=True)]
+        new = [splits(c.SPR(*m).toTopology()) for m in c.iterUniqueSPR()]
+        self.assertEqual(len(new),len(set(new)))
+        self.assertEqual(set(new),set(old))
+
+    def test_allSPRUnique(self):
+        t = self.tree_.toTopology()
+        num = len(t.getAllLeaves())
+        moves = t.allSPR(unique=True)
+        self.assertEqual(len(moves),2*(num-3)*(2*num-7))
+        structs = set(move.toTree().getStructure() for move in moves)
+        self.assertEqual(len(structs),len(moves))
+        self.assertNotIn(self.tree_.getStructure(),structs)
+        self.assertEqual(len(t.allNNI(unique=True)),2*(num-3))
+
+    def test_allTBR(self):
+        t = self.tree_.toTopology()
+        newi,num = t.toNewick(),len(t.getAllLeaves())
+        edges,count = lambda k: max(1,2*k-3),0
+        for b in t.getBranches():
+            k = len(base.treeStructure.leaves(b.child))
+            if b.parent == t.getRoot() and k == 1: continue # Locked leaf.
+            count += edges(k)*edges(num-k)-1
+        moves = t.allTBR()
+        self.assertEqual(len(moves),count)
+        self.assertEqual(t.toNewick(),newi)
+        for move in moves[::max(1,len(moves)/50)]:
+            new = move.toTree()
+            self.assertNotEqual(new.getStructure(),self.tree_.getStructure())
+            self.assertEqual(new.getStructure(),
+                             tree(new.getNewick(),check=True).getStructure())
+
     def test_treeSet_indexOfTree(self):
         self.assertGreaterEqual(self.trees.indexOf(self.tree_),0)
         